@@ -3,13 +3,55 @@ import time
 import poplib
 from email import policy
 from email.parser import BytesParser
-from email.utils import parseaddr, parsedate_to_datetime, parsedate
+from email.utils import parseaddr, parsedate_to_datetime, parsedate, format_datetime
 import hashlib
 import json
-from datetime import datetime
+from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError # Para manejo de zonas horarias (ej. CST)
 import re
 import logging # Módulo para el registro de eventos del script
+import logging.handlers
+import threading
+import tempfile
+import base64
+import quopri
+import sqlite3 # Almacén de metadatos opcional
+import asyncio # Transporte POP3 alternativo basado en asyncio
+import ssl
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed # Procesamiento concurrente de cuentas y reindexado
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import argparse
+import atexit
+import mmap
+import struct
+import math
+from functools import lru_cache
+import io
+import gzip
+import lzma
+import sys
+import random
+import queue
+import socket
+import socketserver # Servidor POP3 de prueba (--test-server, --benchmark)
+import subprocess
+import shutil
+import bisect
+import cProfile # Modo de perfil (--profile, profile_cycle.txt)
+import pstats
+import tracemalloc
+import http.server # Endpoint local de métricas (metrics_port)
+from contextlib import contextmanager
+try:
+    import resource # CPU y memoria máxima del banco de pruebas; no existe en Windows.
+except ImportError:
+    resource = None
+try:
+    import zstandard # Opcional: códec "zstd" de eml_compression.
+except ImportError:
+    zstandard = None
 
 # Esta variable se llenará después de la selección de idioma
 LANG_MESSAGES = {}
@@ -79,7 +121,7 @@ MESSAGES = {
         'loading_existing_metadata': "Attempting to load existing metadata from '{path}'...",
         'existing_metadata_loaded': "Existing metadata loaded successfully. Found {count} records.",
         'metadata_file_bad_format': "WARNING: Metadata file '{path}' does not have the expected format. Proceeding as if it's a new file.", # Keep
-        'json_decode_error_metadata': "ERROR: Could not decode JSON file '{path}'. File might be corrupt or empty. Proceeding as if it's a new file.",
+        'json_decode_error_metadata': "ERROR: Could not decode JSON file '{path}'. File might be corrupt or empty.",
         'unexpected_error_loading_metadata': "ERROR: Unexpected error loading metadata from '{path}'. Details: {e}. Proceeding as if it's a new file.",
         'metadata_file_not_found': "Metadata file '{path}' not found. A new one will be created after the verification cycle.",
         'saving_metadata_records': "Saving {count} metadata records to '{path}'...",
@@ -138,6 +180,111 @@ MESSAGES = {
         'getting_mailbox_status': "Getting mailbox status for '{user}'...",
         'mailbox_status_info': "Mailbox for '{user}': {count} email(s) with a total size of {total_size} bytes.",
         'ignoring_empty_line': "Line {line_num}: Ignoring empty line or comment in accounts.txt.",
+
+        # Sincronización incremental por UIDL
+        'uidl_index_loaded': "UIDL index for '{user}' loaded: {count} known UID(s).",
+        'uidl_index_load_error': "WARNING: Could not read UIDL index '{path}'. Details: {e}. Falling back to a full header check for this cycle.",
+        'uidl_index_save_error': "ERROR: Could not save UIDL index '{path}'. Details: {e}",
+        'uidl_not_supported': "Server for '{user}' does not support UIDL. Using header hash verification.",
+        'uidl_sync_summary': "UIDL sync for '{user}': {new} new UID(s) out of {total} message(s).",
+
+        # Configuración y pipelining de comandos POP3
+        'invalid_setting_value': "Invalid value for setting '{key}' in settings.json: {value!r}. Using default {default!r}.",
+        'pipelining_enabled': "Server for '{user}' supports PIPELINING. Sending up to {window} TOP/RETR command(s) at a time.",
+        'pipelining_not_supported': "Server for '{user}' does not announce PIPELINING. Using one command at a time.",
+
+        # Procesamiento concurrente de cuentas
+        'concurrent_processing_started': "Processing {count} account(s) with up to {workers} at a time ({per_server} per server).",
+
+        # Transporte asyncio
+        'account_timeout': "Account '{user}' exceeded the {seconds} second limit for this cycle and was cancelled.",
+
+        # Almacenes de metadatos
+        'metadata_imported_from_json': "{count} record(s) imported from '{path}' into the '{backend}' metadata store.",
+        'metadata_exported': "{count} metadata record(s) exported to '{path}'.",
+        'metadata_log_bad_line': "WARNING: Ignoring unreadable line {line_num} in '{path}'.",
+        'metadata_log_compacted': "Metadata log '{path}' compacted to {count} record(s).",
+
+        # Escrituras seguras ante cortes
+        'fsync_failed': "WARNING: Could not sync '{path}' to disk. Details: {e}",
+        'metadata_recovering_from_eml': "Metadata file was unreadable (kept as '{path}'). Rebuilding metadata from the .eml files on disk...",
+
+        # Reindexado
+        'reindex_summary': "Reindex: {total} .eml file(s), {unchanged} unchanged, {parsed} parsed with {workers} process(es), {failed} failed.",
+        'reindex_finished': "Metadata store rebuilt with {count} record(s).",
+
+        # Hash rápido de encabezados
+        'header_hash_mismatch': "Header hash mismatch for '{filename}': parser {expected}..., fast path {actual}...",
+        'header_hash_check_summary': "Header hash check: {total} file(s), {mismatches} mismatch(es). Parser {parser_ms:.1f} ms, fast path {fast_ms:.1f} ms.",
+
+        # Índice compacto de hashes
+        'dedup_index_built': "Compact dedup index '{path}' built with {count} hash(es).",
+        'dedup_index_error': "Could not use the compact dedup index for '{path}': {error}. Using an in-memory set.",
+        'dedup_index_requires_store': "The compact dedup index requires the 'jsonl' or 'sqlite' metadata backend. Using an in-memory set.",
+
+        # Zona horaria
+        'timezone_not_found': "Timezone '{timezone}' not found. Email dates will not be converted.",
+
+        # Listas de palabras compiladas
+        'word_blacklist_matches': "Blacklisted word(s) found: {words}.",
+        'word_whitelist_matches': "Whitelisted word(s) found: {words}.",
+
+        # Motor de reglas de spam
+        'spam_rules_compiled': "Spam rules compiled: {mail_whitelist} whitelisted sender(s), {mail_blacklist} blacklisted sender(s), {word_whitelist} whitelisted and {word_blacklist} blacklisted word(s).",
+        'error_reading_spam_config': "Could not read '{path}': {error}. Its rules are ignored.",
+        'sender_blacklisted': "Sender '{sender}' is blacklisted.",
+        'sender_whitelisted': "Sender '{sender}' is whitelisted.",
+
+        # Política previa a RETR
+        'list_not_supported': "WARNING: LIST failed for '{user}'; message size limits are not applied this cycle. Details: {e}",
+        'email_deferred_by_policy': "      Email #{num} deferred: {reason}.",
+        'email_skipped_by_policy': "      Email #{num} skipped without downloading: {reason}.",
+        'email_previously_skipped': "Email #{num} (hash {hash}...) was skipped by the header policy in a previous cycle for '{user}'. Skipping.",
+        'skipped_registry_error': "ERROR: Could not read or write skipped messages registry '{path}'. Details: {e}",
+        'download_budget_reached': "  Download budget reached for '{user}': {scheduled} email(s) ({kb} KB) this cycle, {deferred} deferred to the next one.",
+
+        # Puntos de control
+        'checkpoint_saved': "Checkpoint for '{user}': {count} email(s) recorded.",
+        'checkpoint_save_error': "ERROR: Could not save checkpoint '{path}'. Details: {e}",
+        'checkpoint_read_error': "ERROR: Could not read checkpoint '{path}'. Details: {e}",
+        'checkpoint_recovered': "  {count} email(s) from an interrupted cycle recovered from checkpoints.",
+
+        # Almacén de contenido
+        'blob_link_failed': "WARNING: Could not link '{path}' into the blob store; saving it as a regular file. Details: {e}",
+        'blob_dedup_summary': "  Blob store: {new} new email(s), {reused} duplicate(s) linked, {saved_kb} KB saved this cycle.",
+
+        # Compresión de .eml
+        'zstd_not_available': "WARNING: eml_compression is 'zstd' but the 'zstandard' package is not installed. Emails are saved uncompressed.",
+        'compression_benchmark_corpus': "{count} file(s), {mb:.1f} MB uncompressed.",
+        'compression_benchmark_result': "{codec}: ratio {ratio:.2f}x ({percent:.1f}% of original), compress {compress_mbs:.1f} MB/s, decompress {decompress_mbs:.1f} MB/s.",
+        'parse_pool_broken': "WARNING: The parse process pool stopped working. Remaining emails are processed inline.",
+        'test_server_listening': "Test POP3 server listening on {host}:{port}: {accounts} mailbox(es), {mb:.1f} MB. Any password is accepted.",
+        'test_server_accounts': "accounts.txt lines:",
+        'benchmark_started': "Benchmark: {accounts} mailbox(es) x {messages} email(s), {mb:.1f} MB on the test server, {cycles} cycle(s).",
+        'benchmark_failed': "[ERROR] The benchmark process failed (exit code {code}). Last output:\n{output}",
+        'benchmark_cycle_result': "Cycle {cycle}: {messages} new email(s) in {seconds:.2f} s, {msgs_per_s:.1f} emails/s, {mb_per_s:.2f} MB/s, CPU {cpu:.2f} s, peak RSS {rss}.",
+        'benchmark_process_usage': "Whole run (including start-up and worker processes): CPU {user:.2f} s user + {system:.2f} s system, peak RSS {rss:.1f} MB.",
+        'benchmark_report_saved': "Benchmark report saved to '{path}'.",
+        'metrics_write_failed': "WARNING: Could not write the metrics file '{path}': {error}",
+        'metrics_endpoint_failed': "Could not start the metrics endpoint on port {port}: {error}",
+        'metrics_endpoint_started': "Metrics available at http://127.0.0.1:{port}/metrics",
+        'profile_started': "Profiling the next {cycles} cycle(s) with cProfile and tracemalloc.",
+        'profile_saved': "Profile saved to '{path}.txt' and '{path}.prof'.",
+        'profile_write_failed': "Could not write the profile: {error}",
+        'profile_trigger_unreadable': "WARNING: Could not read '{path}': {error}",
+        'profile_trigger_invalid': "WARNING: '{path}' should contain a number of cycles; profiling 1 cycle.",
+
+        # Registro y progreso en modo quiet
+        'account_progress': "  [{user}] {checked}/{total} checked, {downloaded} downloaded ({rate:.0f} emails/s).",
+        'invalid_log_level': "WARNING: Unknown log_level '{level}'. Using INFO.",
+        'interrupted_account_flush_error': "ERROR: Could not record the emails already saved for '{user}' after the interruption. Details: {e}",
+        'checkpoint_store_error': "ERROR: Could not record the checkpointed emails in the metadata store. The checkpoints are kept for the next cycle. Details: {e}",
+        'metadata_store_write_error': "ERROR: Could not record {count} new email(s) in the '{backend}' metadata store. They are kept in the checkpoints and will be recorded in the next cycle. Details: {e}",
+        'email_reserved_by_other_account': "Email #{num} (hash {hash}...) is being downloaded by another account. '{user}' will check it again in the next cycle.",
+
+        # Banco de pruebas de la conversión de fechas (--benchmark-dates)
+        'date_benchmark_corpus': "{count} synthetic message(s): {repeated:.0f}% drawn from {distinct} repeated dates, {invalid:.1f}% unparsable.",
+        'date_benchmark_result': "Date conversion: {before_us:.1f} us/message parsing every Date header, {after_us:.1f} us/message with the raw value and memoization ({speedup:.0f}x). Different results: {mismatches}.",
     },
     'es': {
         # General
@@ -202,7 +349,7 @@ MESSAGES = {
         'loading_existing_metadata': "Intentando cargar metadatos existentes desde '{path}'...",
         'existing_metadata_loaded': "Metadatos existentes cargados exitosamente. Se encontraron {count} registros.",
         'metadata_file_bad_format': "ADVERTENCIA: El archivo de metadatos '{path}' no tiene el formato esperado. Se procederá como si fuera un archivo nuevo.", # Keep
-        'json_decode_error_metadata': "ERROR: No se pudo decodificar el archivo JSON '{path}'. El archivo podría estar corrupto o vacío. Se procederá como si fuera un archivo nuevo.",
+        'json_decode_error_metadata': "ERROR: No se pudo decodificar el archivo JSON '{path}'. El archivo podría estar corrupto o vacío.",
         'unexpected_error_loading_metadata': "ERROR: Error inesperado al cargar metadatos desde '{path}'. Detalles: {e}. Se procederá como si fuera un archivo nuevo.",
         'metadata_file_not_found': "Archivo de metadatos '{path}' no encontrado. Se creará uno nuevo después del ciclo de verificación.",
         'saving_metadata_records': "Guardando {count} registros de metadatos en '{path}'...",
@@ -261,6 +408,111 @@ MESSAGES = {
         'getting_mailbox_status': "Obteniendo estado del buzón para '{user}'...",
         'mailbox_status_info': "Buzón de '{user}': {count} correo(s) con un tamaño total de {total_size} bytes.",
         'ignoring_empty_line': "Línea {line_num}: Ignorando línea vacía o comentario en accounts.txt.",
+
+        # Sincronización incremental por UIDL
+        'uidl_index_loaded': "Índice UIDL de '{user}' cargado: {count} UID(s) conocidos.",
+        'uidl_index_load_error': "ADVERTENCIA: No se pudo leer el índice UIDL '{path}'. Detalles: {e}. Se hará una verificación completa de encabezados en este ciclo.",
+        'uidl_index_save_error': "ERROR: No se pudo guardar el índice UIDL '{path}'. Detalles: {e}",
+        'uidl_not_supported': "El servidor de '{user}' no soporta UIDL. Se usará la verificación por hash de encabezados.",
+        'uidl_sync_summary': "Sincronización UIDL para '{user}': {new} UID(s) nuevos de {total} correo(s).",
+
+        # Configuración y pipelining de comandos POP3
+        'invalid_setting_value': "Valor inválido para la opción '{key}' en settings.json: {value!r}. Se usará el valor predeterminado {default!r}.",
+        'pipelining_enabled': "El servidor de '{user}' soporta PIPELINING. Se enviarán hasta {window} comando(s) TOP/RETR a la vez.",
+        'pipelining_not_supported': "El servidor de '{user}' no anuncia PIPELINING. Se usará un comando a la vez.",
+
+        # Procesamiento concurrente de cuentas
+        'concurrent_processing_started': "Procesando {count} cuenta(s), hasta {workers} a la vez ({per_server} por servidor).",
+
+        # Transporte asyncio
+        'account_timeout': "La cuenta '{user}' superó el límite de {seconds} segundos para este ciclo y fue cancelada.",
+
+        # Almacenes de metadatos
+        'metadata_imported_from_json': "{count} registro(s) importados desde '{path}' al almacén de metadatos '{backend}'.",
+        'metadata_exported': "{count} registro(s) de metadatos exportados a '{path}'.",
+        'metadata_log_bad_line': "ADVERTENCIA: Se ignora la línea ilegible {line_num} en '{path}'.",
+        'metadata_log_compacted': "Registro de metadatos '{path}' compactado a {count} registro(s).",
+
+        # Escrituras seguras ante cortes
+        'fsync_failed': "ADVERTENCIA: No se pudo sincronizar '{path}' con el disco. Detalles: {e}",
+        'metadata_recovering_from_eml': "El archivo de metadatos era ilegible (se conservó como '{path}'). Reconstruyendo los metadatos desde los archivos .eml en disco...",
+
+        # Reindexado
+        'reindex_summary': "Reindexado: {total} archivo(s) .eml, {unchanged} sin cambios, {parsed} parseados con {workers} proceso(s), {failed} con error.",
+        'reindex_finished': "Almacén de metadatos reconstruido con {count} registro(s).",
+
+        # Hash rápido de encabezados
+        'header_hash_mismatch': "Diferencia de hash de encabezados en '{filename}': parser {expected}..., ruta rápida {actual}...",
+        'header_hash_check_summary': "Comprobación de hash de encabezados: {total} archivo(s), {mismatches} diferencia(s). Parser {parser_ms:.1f} ms, ruta rápida {fast_ms:.1f} ms.",
+
+        # Índice compacto de hashes
+        'dedup_index_built': "Índice compacto de hashes '{path}' creado con {count} hash(es).",
+        'dedup_index_error': "No se pudo usar el índice compacto de hashes de '{path}': {error}. Se usa un set en memoria.",
+        'dedup_index_requires_store': "El índice compacto de hashes requiere el almacén de metadatos 'jsonl' o 'sqlite'. Se usa un set en memoria.",
+
+        # Zona horaria
+        'timezone_not_found': "No se encontró la zona horaria '{timezone}'. Las fechas de los correos no se convertirán.",
+
+        # Listas de palabras compiladas
+        'word_blacklist_matches': "Palabra(s) de la lista negra encontradas: {words}.",
+        'word_whitelist_matches': "Palabra(s) de la lista blanca encontradas: {words}.",
+
+        # Motor de reglas de spam
+        'spam_rules_compiled': "Reglas de spam compiladas: {mail_whitelist} remitente(s) en lista blanca, {mail_blacklist} en lista negra, {word_whitelist} palabra(s) en lista blanca y {word_blacklist} en lista negra.",
+        'error_reading_spam_config': "No se pudo leer '{path}': {error}. Se ignoran sus reglas.",
+        'sender_blacklisted': "El remitente '{sender}' está en la lista negra.",
+        'sender_whitelisted': "El remitente '{sender}' está en la lista blanca.",
+
+        # Política previa a RETR
+        'list_not_supported': "ADVERTENCIA: LIST falló para '{user}'; los límites de tamaño no se aplican en este ciclo. Detalles: {e}",
+        'email_deferred_by_policy': "      Correo #{num} aplazado: {reason}.",
+        'email_skipped_by_policy': "      Correo #{num} omitido sin descargar: {reason}.",
+        'email_previously_skipped': "El correo #{num} (hash {hash}...) ya fue omitido por la política de encabezados en un ciclo anterior para '{user}'. Omitiendo.",
+        'skipped_registry_error': "ERROR: No se pudo leer o escribir el registro de correos omitidos '{path}'. Detalles: {e}",
+        'download_budget_reached': "  Presupuesto de descarga alcanzado para '{user}': {scheduled} correo(s) ({kb} KB) en este ciclo, {deferred} aplazado(s) al siguiente.",
+
+        # Puntos de control
+        'checkpoint_saved': "Punto de control de '{user}': {count} correo(s) registrado(s).",
+        'checkpoint_save_error': "ERROR: No se pudo guardar el punto de control '{path}'. Detalles: {e}",
+        'checkpoint_read_error': "ERROR: No se pudo leer el punto de control '{path}'. Detalles: {e}",
+        'checkpoint_recovered': "  {count} correo(s) de un ciclo interrumpido recuperado(s) de los puntos de control.",
+
+        # Almacén de contenido
+        'blob_link_failed': "ADVERTENCIA: No se pudo enlazar '{path}' con el almacén de contenido; se guarda como archivo normal. Detalles: {e}",
+        'blob_dedup_summary': "  Almacén de contenido: {new} correo(s) nuevo(s), {reused} duplicado(s) enlazado(s), {saved_kb} KB ahorrados en este ciclo.",
+
+        # Compresión de .eml
+        'zstd_not_available': "ADVERTENCIA: eml_compression es 'zstd' pero el paquete 'zstandard' no está instalado. Los correos se guardan sin comprimir.",
+        'compression_benchmark_corpus': "{count} archivo(s), {mb:.1f} MB sin comprimir.",
+        'compression_benchmark_result': "{codec}: proporción {ratio:.2f}x ({percent:.1f}% del original), compresión {compress_mbs:.1f} MB/s, descompresión {decompress_mbs:.1f} MB/s.",
+        'parse_pool_broken': "ADVERTENCIA: El pool de procesos de análisis dejó de funcionar. Los correos restantes se procesan en línea.",
+        'test_server_listening': "Servidor POP3 de prueba escuchando en {host}:{port}: {accounts} buzón(es), {mb:.1f} MB. Se acepta cualquier contraseña.",
+        'test_server_accounts': "Líneas para accounts.txt:",
+        'benchmark_started': "Banco de pruebas: {accounts} buzón(es) x {messages} correo(s), {mb:.1f} MB en el servidor de prueba, {cycles} ciclo(s).",
+        'benchmark_failed': "[ERROR] El proceso del banco de pruebas falló (código {code}). Última salida:\n{output}",
+        'benchmark_cycle_result': "Ciclo {cycle}: {messages} correo(s) nuevo(s) en {seconds:.2f} s, {msgs_per_s:.1f} correos/s, {mb_per_s:.2f} MB/s, CPU {cpu:.2f} s, memoria máxima {rss}.",
+        'benchmark_process_usage': "Ejecución completa (con el arranque y los procesos auxiliares): CPU {user:.2f} s de usuario + {system:.2f} s de sistema, memoria máxima {rss:.1f} MB.",
+        'benchmark_report_saved': "Informe del banco de pruebas guardado en '{path}'.",
+        'metrics_write_failed': "ADVERTENCIA: No se pudo escribir el archivo de métricas '{path}': {error}",
+        'metrics_endpoint_failed': "No se pudo iniciar el endpoint de métricas en el puerto {port}: {error}",
+        'metrics_endpoint_started': "Métricas disponibles en http://127.0.0.1:{port}/metrics",
+        'profile_started': "Perfilando los próximos {cycles} ciclo(s) con cProfile y tracemalloc.",
+        'profile_saved': "Perfil guardado en '{path}.txt' y '{path}.prof'.",
+        'profile_write_failed': "No se pudo escribir el perfil: {error}",
+        'profile_trigger_unreadable': "ADVERTENCIA: No se pudo leer '{path}': {error}",
+        'profile_trigger_invalid': "ADVERTENCIA: '{path}' debe contener un número de ciclos; se perfila 1 ciclo.",
+
+        # Registro y progreso en modo quiet
+        'account_progress': "  [{user}] {checked}/{total} verificados, {downloaded} descargados ({rate:.0f} correos/s).",
+        'invalid_log_level': "ADVERTENCIA: log_level '{level}' desconocido. Se usa INFO.",
+        'interrupted_account_flush_error': "ERROR: No se pudieron registrar los correos ya guardados de '{user}' tras la interrupción. Detalles: {e}",
+        'checkpoint_store_error': "ERROR: No se pudieron registrar en el almacén de metadatos los correos de los puntos de control. Se conservan para el siguiente ciclo. Detalles: {e}",
+        'metadata_store_write_error': "ERROR: No se pudieron registrar {count} correo(s) nuevo(s) en el almacén de metadatos '{backend}'. Se conservan en los puntos de control y se registrarán en el siguiente ciclo. Detalles: {e}",
+        'email_reserved_by_other_account': "Correo #{num} (hash {hash}...) lo está descargando otra cuenta. '{user}' lo verificará de nuevo en el siguiente ciclo.",
+
+        # Banco de pruebas de la conversión de fechas (--benchmark-dates)
+        'date_benchmark_corpus': "{count} correo(s) sintético(s): {repeated:.0f}% con una de {distinct} fechas repetidas, {invalid:.1f}% no interpretables.",
+        'date_benchmark_result': "Conversión de fechas: {before_us:.1f} us/correo interpretando cada encabezado Date, {after_us:.1f} us/correo con el valor crudo y memorización ({speedup:.0f}x). Resultados distintos: {mismatches}.",
     }
 }
 
@@ -286,6 +538,9 @@ def _get_or_create_user_data_directory():
 
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Los procesos "spawn"/"forkserver" de los pools (análisis, reindexado) vuelven a importar este módulo: en ellos no se pregunta
+# el idioma ni se cargan settings.json y el registro; configurar_proceso_auxiliar aplica los del proceso principal.
+ES_PROCESO_AUXILIAR = __name__ == "__mp_main__" or multiprocessing.parent_process() is not None
 USER_DATA_ROOT = _get_or_create_user_data_directory()
 
 # --- Configuración de Idioma ---
@@ -351,11 +606,13 @@ def load_or_select_language(user_data_root_path):
             lang = default_lang
     return lang
 
-SELECTED_LANG_CODE = load_or_select_language(USER_DATA_ROOT)
+SELECTED_LANG_CODE = 'en' if ES_PROCESO_AUXILIAR else load_or_select_language(USER_DATA_ROOT)
 LANG_MESSAGES = MESSAGES[SELECTED_LANG_CODE]
 
 # --- Configuración de Logging ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [SCRIPT] - %(message)s')
+FORMATO_REGISTRO = '%(asctime)s - %(levelname)s - [SCRIPT] - %(message)s'
+if not ES_PROCESO_AUXILIAR:
+    logging.basicConfig(level=logging.INFO, format=FORMATO_REGISTRO)
 
 # --- Configuraciones de Rutas Globales ---
 DATA_DIR = USER_DATA_ROOT
@@ -369,12 +626,352 @@ CHECK_INTERVAL = 15 * 60 # Intervalo de verificación en segundos (15 minutos)
 
 TRIGGER_FILE_NAME = "trigger_check.txt"
 TRIGGER_FILE_PATH = os.path.join(DATA_DIR, TRIGGER_FILE_NAME)
+PROFILE_TRIGGER_FILE_NAME = "profile_cycle.txt" # Pide perfilar los próximos ciclos (su contenido: cuántos; vacío = 1).
+PROFILE_TRIGGER_FILE_PATH = os.path.join(DATA_DIR, PROFILE_TRIGGER_FILE_NAME)
 
 METADATA_FILE = os.path.join(DATA_DIR, "emails_metadata.json")
+METADATA_LOG_FILE = os.path.join(DATA_DIR, "emails_metadata.jsonl") # Almacén "jsonl" (registro de solo-anexado).
+METADATA_DB_FILE = os.path.join(DATA_DIR, "emails_metadata.sqlite3") # Almacén "sqlite".
+REINDEX_STATE_FILE = os.path.join(DATA_DIR, "reindex_state.json") # mtime/tamaño y metadatos de cada .eml del último reindexado.
+BLOBS_DIR = os.path.join(DATA_DIR, "blobs") # Almacén de contenido (blob_store): un archivo por contenido, enlazado desde cada cuenta.
+UIDL_INDEX_DIR = os.path.join(DATA_DIR, "uidl_index") # Índices UIDL por cuenta para la sincronización incremental.
+CHECKPOINT_DIR = os.path.join(DATA_DIR, "checkpoints") # Diarios por cuenta con los correos de un ciclo aún no registrados en el almacén.
+CYCLE_CHECKPOINT_NAME = "_cycle" # Diario con los registros de un ciclo cuyo almacén no se pudo actualizar (no coincide con ninguna dirección de correo).
+SKIPPED_MESSAGES_FILE = os.path.join(DATA_DIR, "skipped_messages.jsonl") # Correos omitidos antes de RETR por la política de encabezados.
+METRICS_FILE = os.path.join(DATA_DIR, "metrics.prom") # Métricas en formato de texto de Prometheus (metrics_file).
 
 ACCOUNTS_FILE = os.path.join(DATA_DIR, "accounts.txt")
 USER_SETTINGS_FILE_IN_DATA = os.path.join(DATA_DIR, "settings.json") # Used for language
-SPAM_CONFIG_FILE = os.path.join(DATA_DIR, "spam_config.json") # Path defined, but file won't be read by default
+SPAM_CONFIG_FILE = os.path.join(DATA_DIR, "spam_config.json") # Reglas de spam (opcional); ver load_spam_config.
+WORD_WHITELIST_FILE = os.path.join(FILTERS_DIR, "word_whitelist.txt") # Una palabra o frase por línea; "#" para comentarios.
+WORD_BLACKLIST_FILE = os.path.join(FILTERS_DIR, "word_blacklist.txt")
+ARCHIVOS_LISTAS_SPAM = { # Clave de spam_config.json -> lista equivalente en FILTERS_DIR (se combinan).
+    "mail_whitelist": os.path.join(FILTERS_DIR, "mail_whitelist.txt"),
+    "mail_blacklist": os.path.join(FILTERS_DIR, "mail_blacklist.txt"),
+    "word_whitelist": WORD_WHITELIST_FILE,
+    "word_blacklist": WORD_BLACKLIST_FILE,
+}
+
+# --- Configuración de Rendimiento (claves opcionales en settings.json) ---
+DEFAULT_SETTINGS = {
+    "pipelining_window": 16, # Máximo de comandos TOP/RETR pendientes en el socket si el servidor anuncia PIPELINING.
+    "max_concurrent_accounts": 4, # Cuentas procesadas al mismo tiempo en cada ciclo.
+    "max_connections_per_server": 2, # Conexiones simultáneas a un mismo servidor POP3.
+    "transport": "threads", # "threads" (poplib, un hilo por cuenta) o "asyncio" (un único bucle de eventos).
+    "account_timeout_seconds": 600, # Tiempo máximo por cuenta y ciclo con el transporte asyncio.
+    "tls_verify": False, # Verifica el certificado y el nombre del servidor en POP3S y STLS (ambos transportes). False = como poplib por defecto.
+    "metadata_backend": "json", # "json" (emails_metadata.json completo), "jsonl" (solo-anexado) o "sqlite".
+    "jsonl_compaction_ratio": 1.5, # El registro jsonl se compacta cuando tiene más de esta proporción de líneas por hash único.
+    "export_viewer_json": True, # Con jsonl/sqlite, regenera emails_metadata.json para MailEML Viewer cuando hay correos nuevos.
+    "fsync": True, # Sincroniza con el disco (en lote al final del ciclo) los .eml y los archivos de metadatos.
+    "reindex_workers": 0, # Procesos para --reindex (0 = uno por núcleo de CPU).
+    "dedup_index": "set", # "set" (hashes en memoria) o "compact" (índice de 32 bytes por hash en un archivo mapeado; solo almacenes jsonl y sqlite).
+    "dedup_bloom_bits_per_hash": 10, # Tamaño del filtro de Bloom del índice compacto (0 = sin filtro).
+    "timezone": "America/Mexico_City", # Zona horaria (IANA) a la que se convierten las fechas de los correos.
+    "body_text_max_bytes_per_part": 262144, # Bytes de cada parte text/plain que se leen para las reglas sobre el cuerpo (0 = sin límite).
+    "raw_date_log": "full", # Log de fechas crudas: "full" (intento y resultado), "result" (solo resultado) u "off".
+    "raw_date_log_buffer_kb": 64, # El log de fechas crudas se escribe al terminar cada cuenta y ciclo, o al llenar este búfer.
+    "skip_blacklisted_senders": False, # No descarga (RETR) los correos de remitentes en la lista negra que no estén en la blanca.
+    "skip_spam_score_above": 0.0, # No descarga los correos con un score de spam en encabezados mayor a este valor (0 = desactivado).
+    "max_message_size_kb": 0, # Tamaño máximo (según LIST) de los correos que se descargan (0 = sin límite).
+    "size_limit_action": "defer", # Correos que superan max_message_size_kb: "defer" (se descargan en off_peak_hours, o se reevalúan cada ciclo) o "skip" (se omiten).
+    "off_peak_hours": "", # Franja "HH:MM-HH:MM" (hora local) en la que sí se descargan los correos aplazados por tamaño ("" = ninguna).
+    "download_order": "server", # Orden de RETR de los correos nuevos: "server" (1..n), "smallest_first" o "newest_first".
+    "download_budget_kb_per_cycle": 0, # KB máximos descargados por cuenta y ciclo según LIST; el resto pasa al próximo ciclo (0 = sin límite).
+    "checkpoint_every_messages": 200, # Punto de control de cada cuenta cada N correos descargados (0 = desactivado).
+    "checkpoint_every_seconds": 60, # Punto de control de cada cuenta cada T segundos con correos descargados (0 = desactivado).
+    "eml_compression": "none", # Compresión de los .eml nuevos: "none", "gzip", "lzma" o "zstd" (requiere el paquete zstandard).
+    "parse_pipeline": False, # Analiza los correos descargados (metadatos y reglas) en un pool de procesos mientras continúa la descarga.
+    "parse_workers": 0, # Procesos de parse_pipeline (0 = uno por núcleo de CPU).
+    "parse_queue_size": 32, # Correos descargados que pueden esperar análisis por cuenta antes de pausar la descarga.
+    "log_level": "INFO", # Nivel mínimo del log: "DEBUG", "INFO", "WARNING" o "ERROR". Con "WARNING" no se formatean los mensajes por correo.
+    "log_format": "text", # "json": un objeto JSON por línea, con la clave del mensaje y sus valores como campos.
+    "log_background": False, # Escribe el log desde un hilo (QueueHandler/QueueListener) para que la descarga nunca espere a la consola.
+    "quiet": False, # Sin líneas por correo en la consola: una línea de progreso por cuenta (ver progress_every_*).
+    "progress_every_messages": 500, # En modo quiet, correos entre líneas de progreso.
+    "progress_every_seconds": 10, # En modo quiet, segundos máximos entre líneas de progreso.
+    "metrics_file": False, # Escribe metrics.prom (formato de texto de Prometheus) cada metrics_interval segundos y al final de cada ciclo.
+    "metrics_interval": 15, # Segundos entre escrituras de metrics.prom.
+    "metrics_port": 0, # Puerto local (127.0.0.1) con las mismas métricas en http://127.0.0.1:<puerto>/metrics; 0 = desactivado.
+    "blob_store": False, # Guarda cada contenido una sola vez en BLOBS_DIR y lo enlaza (enlace duro) en la carpeta de cada cuenta.
+    "blob_buffer_kb": 8192, # Con blob_store, tamaño hasta el que una descarga se mantiene en memoria: si ya está en el almacén no se escribe.
+}
+
+def cargar_configuracion(settings_file_path):
+    """
+    Carga las opciones de rendimiento desde settings.json.
+    Las claves ausentes o con un tipo distinto al esperado toman el valor predeterminado.
+    """
+    config = dict(DEFAULT_SETTINGS)
+    try:
+        if os.path.exists(settings_file_path):
+            with open(settings_file_path, 'r', encoding='utf-8') as f:
+                settings_data = json.load(f)
+            for key, default_value in DEFAULT_SETTINGS.items():
+                value = settings_data.get(key, default_value)
+                if isinstance(default_value, float) and isinstance(value, int) and not isinstance(value, bool):
+                    value = float(value) # En JSON "5" y "5.0" son el mismo número.
+                if isinstance(value, type(default_value)) and not (isinstance(value, bool) and not isinstance(default_value, bool)):
+                    config[key] = value
+                else:
+                    logging.warning(LANG_MESSAGES.get('invalid_setting_value', "Invalid value for setting '{key}' in settings.json: {value!r}. Using default {default!r}.").format(key=key, value=value, default=default_value))
+    except (json.JSONDecodeError, IOError) as e:
+        logging.error(LANG_MESSAGES.get('error_reading_settings_json', "Could not read or parse settings.json: {error}.").format(error=e))
+    return config
+
+SETTINGS = dict(DEFAULT_SETTINGS) if ES_PROCESO_AUXILIAR else cargar_configuracion(USER_SETTINGS_FILE_IN_DATA)
+
+# --- Registro de bajo costo (log_level, log_format, log_background, quiet) ---
+class TextoDiferido:
+    """
+    Mensaje de log que solo se formatea si un handler lo emite (LogRecord.getMessage llama a str()).
+    """
+    __slots__ = ("plantilla", "valores")
+
+    def __init__(self, plantilla, valores):
+        self.plantilla = plantilla
+        self.valores = valores
+
+    def __str__(self):
+        return self.plantilla.format(**self.valores)
+
+def registrar_evento(nivel, clave, predeterminado, sufijo="", **valores):
+    """
+    Registra el mensaje `clave` de LANG_MESSAGES (más `sufijo`, con los mismos valores) sin formatearlo
+    si `nivel` no está habilitado ni antes de que un handler lo emita. Con log_format "json", la clave
+    y los valores se incluyen como campos del registro.
+    """
+    if logging.root.isEnabledFor(nivel):
+        logging.root.log(nivel, TextoDiferido(LANG_MESSAGES.get(clave, predeterminado) + sufijo, valores), extra={"evento": clave, "campos": valores})
+
+def mostrar(clave, predeterminado, **valores):
+    """
+    Muestra en la consola un mensaje por correo; en modo quiet se omite y ProgresoCuenta resume el avance.
+    """
+    if not SETTINGS["quiet"]:
+        print(LANG_MESSAGES.get(clave, predeterminado).format(**valores))
+
+class FormateadorJSON(logging.Formatter):
+    """
+    Un objeto JSON por línea: hora (UTC), nivel, hilo y mensaje; en los registros de registrar_evento,
+    también la clave del mensaje ("event") y sus valores ("fields").
+    """
+    def format(self, record):
+        datos = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        evento = getattr(record, "evento", None)
+        if evento:
+            datos["event"] = evento
+            datos["fields"] = {clave: valor if isinstance(valor, (int, float, bool, type(None))) else str(valor) for clave, valor in record.campos.items()}
+        if record.exc_info:
+            datos["exception"] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False)
+
+class ManejadorColaRegistro(logging.handlers.QueueHandler):
+    """
+    Encola el registro sin formatearlo: el hilo de QueueListener hace el formato y la escritura.
+    (QueueHandler formatea en prepare() para poder enviar el registro a otro proceso; aquí la cola es local.)
+    """
+    def prepare(self, record):
+        return record
+
+def configurar_registro():
+    """
+    Aplica log_level y log_format a los handlers del logger raíz y, con log_background, los pasa a un
+    QueueListener: el ciclo solo encola los registros y nunca espera a la consola ni al disco.
+    """
+    raiz = logging.getLogger()
+    nivel = logging.getLevelName(str(SETTINGS["log_level"]).upper())
+    if not isinstance(nivel, int):
+        logging.warning(LANG_MESSAGES.get('invalid_log_level', "WARNING: Unknown log_level '{level}'. Using INFO.").format(level=SETTINGS["log_level"]))
+        nivel = logging.INFO
+    raiz.setLevel(nivel)
+    if SETTINGS["log_format"] == "json":
+        for handler in raiz.handlers:
+            handler.setFormatter(FormateadorJSON())
+    if SETTINGS["log_background"] and raiz.handlers:
+        cola = queue.SimpleQueue()
+        oyente = logging.handlers.QueueListener(cola, *raiz.handlers, respect_handler_level=True)
+        raiz.handlers = [ManejadorColaRegistro(cola)]
+        oyente.start()
+        atexit.register(oyente.stop) # Escribe los registros pendientes al salir.
+
+if not ES_PROCESO_AUXILIAR:
+    configurar_registro()
+
+class ProgresoCuenta:
+    """
+    Progreso de una cuenta en modo quiet: una línea cada progress_every_messages correos o
+    progress_every_seconds segundos, y otra al terminar, en lugar de varias líneas por correo.
+    """
+    def __init__(self, user, total):
+        self.user = user
+        self.total = total
+        self.verificados = 0
+        self.descargados = 0
+        self.sin_mostrar = 0
+        self.inicio = self.ultimo = time.monotonic()
+
+    def anotar(self, verificados=0, descargados=0):
+        if not SETTINGS["quiet"]:
+            return
+        self.verificados += verificados
+        self.descargados += descargados
+        self.sin_mostrar += 1
+        ahora = time.monotonic()
+        if self.sin_mostrar >= SETTINGS["progress_every_messages"] or ahora - self.ultimo >= SETTINGS["progress_every_seconds"]:
+            self.mostrar(ahora)
+
+    def mostrar(self, ahora=None):
+        ahora = ahora or time.monotonic()
+        print(LANG_MESSAGES.get('account_progress', "  [{user}] {checked}/{total} checked, {downloaded} downloaded ({rate:.0f} emails/s).").format(
+            user=self.user, checked=self.verificados, total=self.total, downloaded=self.descargados,
+            rate=(self.verificados + self.descargados) / max(ahora - self.inicio, 1e-6)))
+        self.sin_mostrar = 0
+        self.ultimo = ahora
+
+    def terminar(self):
+        if SETTINGS["quiet"] and self.sin_mostrar:
+            self.mostrar()
+
+BLOQUEO_HASHES = threading.Lock() # Protege existing_hashes cuando varias cuentas se procesan en paralelo.
+HASHES_EN_CURSO = set() # Hashes reservados por una cuenta cuyo correo aún no se guardó (protegido por BLOQUEO_HASHES).
+BLOQUEO_ESCRITURAS = threading.Lock() # Protege ESCRITURAS_PENDIENTES.
+ESCRITURAS_PENDIENTES = set() # Archivos .eml escritos en el ciclo actual que aún no se sincronizaron con fsync.
+
+class MedidorFases:
+    """
+    Histograma del tiempo de cada fase de un ciclo (conexión, TOP, RETR, análisis, escritura...) y
+    contadores (bytes descargados, correos por resultado, errores por tipo), por cuenta.
+    Se exportan en formato Prometheus con metrics_file/metrics_port; el banco de pruebas (--benchmark)
+    lo reinicia al comienzo de cada ciclo que mide.
+    """
+    CUBETAS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0) # Límites en segundos.
+
+    def __init__(self):
+        self.bloqueo = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self.bloqueo:
+            self.fases = {} # (fase, cuenta) -> [mediciones, segundos, [mediciones por cubeta (la última, +Inf)]]
+            self.contadores = {} # (nombre, cuenta, detalle) -> valor
+            self.indicadores = {} # nombre -> último valor (p. ej. la hora del último ciclo)
+
+    def registrar(self, fase, segundos, cuenta=""):
+        with self.bloqueo:
+            acumulado = self.fases.get((fase, cuenta))
+            if acumulado is None:
+                acumulado = self.fases[(fase, cuenta)] = [0, 0.0, [0] * (len(self.CUBETAS) + 1)]
+            acumulado[0] += 1
+            acumulado[1] += segundos
+            acumulado[2][bisect.bisect_left(self.CUBETAS, segundos)] += 1
+
+    def contar(self, nombre, cantidad=1, cuenta="", detalle=""):
+        """
+        Suma `cantidad` al contador `nombre`; `detalle` distingue variantes como el tipo de error.
+        """
+        if not cantidad:
+            return
+        with self.bloqueo:
+            clave = (nombre, cuenta, detalle)
+            self.contadores[clave] = self.contadores.get(clave, 0) + cantidad
+
+    def fijar(self, nombre, valor):
+        with self.bloqueo:
+            self.indicadores[nombre] = valor
+
+    @contextmanager
+    def medir(self, fase, cuenta=""):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar(fase, time.perf_counter() - inicio, cuenta)
+
+    def medir_iteracion(self, fase, iterable, cuenta=""):
+        """
+        Genera los elementos de `iterable` registrando en `fase` lo que tarda en llegar cada uno
+        (p. ej. la espera de cada respuesta RETR), sin incluir el trabajo que se hace con él.
+        """
+        iterador = iter(iterable)
+        while True:
+            inicio = time.perf_counter()
+            try:
+                elemento = next(iterador)
+            except StopIteration:
+                return
+            self.registrar(fase, time.perf_counter() - inicio, cuenta)
+            yield elemento
+
+    async def medir_iteracion_async(self, fase, iterable, cuenta=""):
+        """
+        Igual que medir_iteracion, para iteradores asíncronos.
+        """
+        iterador = iterable.__aiter__()
+        while True:
+            inicio = time.perf_counter()
+            try:
+                elemento = await iterador.__anext__()
+            except StopAsyncIteration:
+                return
+            self.registrar(fase, time.perf_counter() - inicio, cuenta)
+            yield elemento
+
+    def resumen(self):
+        """
+        Retorna {"phases": {fase: {"count", "seconds"}}, "counters": {nombre: valor}} sumando todas las cuentas.
+        """
+        with self.bloqueo:
+            fases = {}
+            for (fase, _), (mediciones, segundos, _) in self.fases.items():
+                total = fases.setdefault(fase, {"count": 0, "seconds": 0.0})
+                total["count"] += mediciones
+                total["seconds"] += segundos
+            contadores = {}
+            for (nombre, _, detalle), valor in self.contadores.items():
+                clave = f"{nombre}_{detalle}" if detalle else nombre
+                contadores[clave] = contadores.get(clave, 0) + valor
+        return {"phases": fases, "counters": contadores}
+
+    def copiar(self):
+        """
+        Retorna una copia de las fases, los contadores y los indicadores para exportarlos sin bloquear las mediciones.
+        """
+        with self.bloqueo:
+            fases = {clave: (mediciones, segundos, list(cubetas)) for clave, (mediciones, segundos, cubetas) in self.fases.items()}
+            return fases, dict(self.contadores), dict(self.indicadores)
+
+    def extraer(self):
+        """
+        Retorna las fases y los contadores medidos hasta ahora y los vacía (los procesos del pool de análisis
+        envían así sus mediciones con cada resultado, y el proceso principal las suma con combinar).
+        """
+        with self.bloqueo:
+            fases, contadores = self.fases, self.contadores
+            self.fases, self.contadores = {}, {}
+        return fases, contadores
+
+    def combinar(self, fases, contadores):
+        """
+        Suma a este medidor las fases y los contadores retornados por extraer en otro proceso.
+        """
+        with self.bloqueo:
+            for clave, (mediciones, segundos, cubetas) in fases.items():
+                acumulado = self.fases.get(clave)
+                if acumulado is None:
+                    acumulado = self.fases[clave] = [0, 0.0, [0] * (len(self.CUBETAS) + 1)]
+                acumulado[0] += mediciones
+                acumulado[1] += segundos
+                acumulado[2] = [a + b for a, b in zip(acumulado[2], cubetas)]
+            for clave, valor in contadores.items():
+                self.contadores[clave] = self.contadores.get(clave, 0) + valor
+
+MEDIDOR_FASES = MedidorFases()
 
 def crear_directorios_necesarios():
     """
@@ -385,6 +982,8 @@ def crear_directorios_necesarios():
         os.makedirs(EMAILS_BASE_DIR, exist_ok=True) # Carpeta para los archivos .eml
         os.makedirs(FILTERS_DIR, exist_ok=True) # Directorio de filtros, aunque no se usen los archivos individuales ahora
         os.makedirs(LOG_DIR_SCRIPT, exist_ok=True) # Carpeta para los logs de depuración
+        os.makedirs(UIDL_INDEX_DIR, exist_ok=True) # Carpeta para los índices UIDL de cada cuenta
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True) # Carpeta para los puntos de control de cada cuenta
         logging.info(LANG_MESSAGES.get('essential_dirs_verified', "Essential directories verified/created successfully within the user data folder."))
     except Exception as e:
         logging.critical(LANG_MESSAGES.get('critical_error', "CRITICAL ERROR: {details}").format(details=f"Could not create necessary directories. Please check write permissions. Error: {e}"))
@@ -452,71 +1051,202 @@ def sanitizar_nombre(nombre):
     """
     return "".join(c if c.isalnum() or c in ("_", "-", ".", " ") else "" for c in nombre)
 
-def log_fecha_cruda(fecha_str, user_email, fecha_cst_formateada):
+class RegistroFechasCrudas:
+    """
+    Destino del log de fechas crudas (RawDates_Script_{date}.log) con búfer en memoria.
+    Mantiene el archivo del día abierto, cambia de archivo al cambiar la fecha y escribe el búfer
+    al terminar cada cuenta y cada ciclo, o antes si supera "raw_date_log_buffer_kb".
+    """
+    def __init__(self):
+        self.bloqueo = threading.Lock()
+        self.lineas = [] # (fecha del archivo, línea)
+        self.tamano = 0
+        self.fecha_archivo = None
+        self.archivo = None
+
+    def escribir(self, fecha_str, user_email, fecha_cst_formateada):
+        ahora = datetime.now()
+        linea = f"[{ahora.strftime('%Y-%m-%d %H:%M:%S')}]: User: {user_email} | Raw Date: '{fecha_str}' | Converted CST: '{fecha_cst_formateada}'\n"
+        with self.bloqueo:
+            self.lineas.append((ahora.strftime('%Y-%m-%d'), linea))
+            self.tamano += len(linea)
+            if self.tamano >= SETTINGS["raw_date_log_buffer_kb"] * 1024:
+                self._vaciar()
+
+    def vaciar(self):
+        with self.bloqueo:
+            self._vaciar()
+
+    def _vaciar(self):
+        lineas, self.lineas, self.tamano = self.lineas, [], 0
+        for fecha, linea in lineas:
+            try:
+                if fecha != self.fecha_archivo or self.archivo is None:
+                    self._abrir(fecha)
+                self.archivo.write(linea)
+            except Exception as e:
+                logging.error(LANG_MESSAGES.get('error_writing_raw_date_log', "ERROR: Could not write raw date to log file '{file}'. Details: {e}").format(file=self._ruta(fecha), e=e))
+                self._cerrar_archivo()
+        if self.archivo is not None:
+            try:
+                self.archivo.flush()
+            except Exception:
+                self._cerrar_archivo()
+
+    def _ruta(self, fecha):
+        log_filename_template = LANG_MESSAGES.get('log_raw_dates_script_file', "RawDates_Script_{date}.log")
+        return os.path.join(LOG_DIR_SCRIPT, log_filename_template.format(date=fecha))
+
+    def _abrir(self, fecha):
+        self._cerrar_archivo()
+        self.archivo = open(self._ruta(fecha), 'a', encoding='utf-8')
+        self.fecha_archivo = fecha
+
+    def _cerrar_archivo(self):
+        if self.archivo is not None:
+            try:
+                self.archivo.close()
+            except Exception:
+                pass
+        self.archivo = None
+        self.fecha_archivo = None
+
+    def cerrar(self):
+        with self.bloqueo:
+            self._vaciar()
+            self._cerrar_archivo()
+
+REGISTRO_FECHAS_CRUDAS = RegistroFechasCrudas()
+atexit.register(REGISTRO_FECHAS_CRUDAS.cerrar)
+
+def log_fecha_cruda(fecha_str, user_email, fecha_cst_formateada, intento=False):
+    """
+    Registra la fecha cruda del encabezado del correo y su conversión en el log de fechas crudas.
+    "raw_date_log" en settings.json: "full" (intento y resultado), "result" (solo el resultado) u "off".
+    """
+    nivel = SETTINGS["raw_date_log"]
+    if nivel == "off" or (intento and nivel != "full"):
+        return
+    REGISTRO_FECHAS_CRUDAS.escribir(fecha_str, user_email, fecha_cst_formateada)
+
+def resolver_zona_horaria(nombre_zona):
     """
-    Registra la fecha cruda del encabezado del correo y su conversión en un archivo de log.
+    Resuelve una sola vez la zona horaria de destino ("timezone" en settings.json).
+    Retorna None si no existe; en ese caso las fechas se registran como "Timezone not found".
     """
-    log_filename_template = LANG_MESSAGES.get('log_raw_dates_script_file', "RawDates_Script_{date}.log")
-    log_file = os.path.join(LOG_DIR_SCRIPT, log_filename_template.format(date=datetime.now().strftime('%Y-%m-%d')))
     try:
-        with open(log_file, 'a', encoding='utf-8') as f:
-            f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}]: User: {user_email} | Raw Date: '{fecha_str}' | Converted CST: '{fecha_cst_formateada}'\n")
-    except Exception as e:
-        logging.error(LANG_MESSAGES.get('error_writing_raw_date_log', "ERROR: Could not write raw date to log file '{file}'. Details: {e}").format(file=log_file, e=e))
-        pass
+        return ZoneInfo(nombre_zona)
+    except (ZoneInfoNotFoundError, ValueError):
+        logging.error(LANG_MESSAGES.get('timezone_not_found', "Timezone '{timezone}' not found. Email dates will not be converted.").format(timezone=nombre_zona))
+        return None
+
+ZONA_HORARIA_DESTINO = resolver_zona_horaria(SETTINGS["timezone"])
+
+@lru_cache(maxsize=4096)
+def convertir_fecha_correo(fecha_str):
+    """
+    Convierte el valor crudo del encabezado Date a la zona horaria de destino.
+    Retorna (fecha_formateada, fecha_iso, texto para el log de fechas crudas). Se memoriza por
+    valor crudo porque los envíos masivos repiten exactamente la misma fecha.
+    """
+    fecha_dt = None # Objeto datetime para la fecha parseada.
+    try:
+        fecha_dt = parsedate_to_datetime(fecha_str)
+    except Exception: # Captura errores durante el parseo con parsedate_to_datetime.
+        fecha_dt = None # Asegura que fecha_dt sea None para el siguiente intento.
+    if fecha_dt is None: # Si el primer intento falló, intenta con parsedate.
+        try:
+            fecha_tuple = parsedate(fecha_str) # parsedate devuelve una tupla de tiempo.
+            if fecha_tuple:
+                year, month, day, hour, minute, second, *rest = fecha_tuple
+                fecha_dt = datetime(year, month, day, hour, minute, second, tzinfo=timezone.utc)
+        except Exception: # Captura errores durante el parseo con parsedate.
+            pass
+    if not fecha_dt: # Si después de todos los intentos, fecha_dt sigue siendo None.
+        return "", "", LANG_MESSAGES.get('log_date_not_parsable', "N/A (Not parsable)")
+    if ZONA_HORARIA_DESTINO is None:
+        return "", "", LANG_MESSAGES.get('log_date_tz_not_found', "N/A (Timezone not found)")
+    try:
+        if fecha_dt.tzinfo is None:
+            fecha_dt = fecha_dt.replace(tzinfo=timezone.utc)
+        fecha_cst = fecha_dt.astimezone(ZONA_HORARIA_DESTINO)
+        fecha_formateada = f"{fecha_cst.day:02d}-{fecha_cst.month:02d}-{fecha_cst.year}_{fecha_cst.hour:02d}-{fecha_cst.minute:02d}"
+        return fecha_formateada, fecha_cst.isoformat(), fecha_formateada # Formato ISO 8601.
+    except Exception:
+        return "", "", LANG_MESSAGES.get('log_date_conversion_error', "N/A (Conversion error)")
+
+def obtener_fecha_cruda(msg):
+    """
+    Retorna el primer encabezado Date tal como viene en el correo (sin la normalización que
+    aplica policy.default al leerlo con msg.get), o None si no existe.
+    """
+    for nombre, valor in msg.raw_items():
+        if nombre.lower() == 'date':
+            valor = str(valor).replace('\r', '').replace('\n', '').strip()
+            return valor if valor.isascii() else str(msg.get('Date')) # Bytes no ASCII: se usa el valor saneado.
+    return None
 
 def obtener_fecha_hora_correo(msg, user_email_for_log="Desconocido"):
     """
-    Extrae y formatea la fecha y hora de un correo electrónico, convirtiéndola a CST.
+    Extrae y formatea la fecha y hora de un correo electrónico, convirtiéndola a la zona
+    horaria configurada (CST por defecto).
     """
-    fecha_str = msg.get('Date')
-    fecha_formateada = "" # Valor por defecto si no se puede obtener la fecha.
-    fecha_iso = ""        # Valor por defecto si no se puede obtener la fecha ISO.
-    fecha_dt = None       # Objeto datetime para la fecha parseada.
+    fecha_str = obtener_fecha_cruda(msg)
     log_fecha_cruda(
         fecha_str if fecha_str else LANG_MESSAGES.get('log_raw_date_header', "No Date Header"),
         user_email_for_log,
-        LANG_MESSAGES.get('log_parsing_attempt', "--- Attempting to parse ---"))
-    if fecha_str: # Procede solo si el encabezado 'Date' existe.
-        try:
-            fecha_dt = parsedate_to_datetime(fecha_str)
-            if fecha_dt is None: # Si parsedate_to_datetime no pudo parsear.
-                 pass
-        except Exception as e: # Captura errores durante el parseo con parsedate_to_datetime.
-            fecha_dt = None # Asegura que fecha_dt sea None para el siguiente intento.
-        if fecha_dt is None: # Si el primer intento falló, intenta con parsedate.
-            try:
-                fecha_tuple = parsedate(fecha_str) # parsedate devuelve una tupla de tiempo.
-                if fecha_tuple:
-                    year, month, day, hour, minute, second, *rest = fecha_tuple
-                    fecha_dt = datetime(year, month, day, hour, minute, second, tzinfo=ZoneInfo("UTC"))
-                else:
-                    pass
-            except Exception as e: # Captura errores durante el parseo con parsedate.
-                pass
-        if fecha_dt: # Si se logró parsear la fecha a un objeto datetime.
-            try:
-                cst_zone = ZoneInfo("America/Mexico_City") # Define la zona horaria de destino.
-                if fecha_dt.tzinfo is None:
-                     fecha_dt = fecha_dt.replace(tzinfo=ZoneInfo("UTC"))
-                fecha_cst = fecha_dt.astimezone(cst_zone)
-                fecha_formateada = f"{fecha_cst.day:02d}-{fecha_cst.month:02d}-{fecha_cst.year}_{fecha_cst.hour:02d}-{fecha_cst.minute:02d}"
-                fecha_iso = fecha_cst.isoformat() # Formato ISO 8601.
-                log_fecha_cruda(fecha_str, user_email_for_log, fecha_formateada)
-            except ZoneInfoNotFoundError:
-                fecha_formateada = ""
-                fecha_iso = ""
-                log_fecha_cruda(fecha_str, user_email_for_log, LANG_MESSAGES.get('log_date_tz_not_found', "N/A (Timezone not found)"))
-            except Exception as e:
-                fecha_formateada = ""
-                fecha_iso = ""
-                log_fecha_cruda(fecha_str, user_email_for_log, LANG_MESSAGES.get('log_date_conversion_error', "N/A (Conversion error)"))
-        else: # Si después de todos los intentos, fecha_dt sigue siendo None.
-            log_fecha_cruda(fecha_str, user_email_for_log, LANG_MESSAGES.get('log_date_not_parsable', "N/A (Not parsable)"))
-    else: # Si el encabezado 'Date' no se encontró en el correo.
+        LANG_MESSAGES.get('log_parsing_attempt', "--- Attempting to parse ---"),
+        intento=True)
+    if not fecha_str: # Si el encabezado 'Date' no se encontró en el correo.
         log_fecha_cruda(LANG_MESSAGES.get('log_raw_date_header', "No Date Header"), user_email_for_log, LANG_MESSAGES.get('log_date_header_not_found', "N/A (Header not found)"))
+        return "", ""
+    fecha_formateada, fecha_iso, resultado_log = convertir_fecha_correo(fecha_str)
+    log_fecha_cruda(fecha_str, user_email_for_log, resultado_log)
     return fecha_formateada, fecha_iso
 
+def comparar_conversion_fechas(cantidad=20000):
+    """
+    Modo --benchmark-dates: mide obtener_fecha_hora_correo() sobre `cantidad` correos sintéticos
+    (70% con una de 200 fechas repetidas, como los envíos masivos, y 0.2% no interpretables) frente
+    a interpretar cada encabezado Date con policy.default y convertirlo sin memorizar, que es como se
+    hacía antes. Comprueba que ambos den la misma fecha. Retorna el número de resultados distintos.
+    """
+    azar = random.Random(1)
+    def fecha_aleatoria():
+        zona = timezone(timedelta(minutes=azar.choice([-480, -360, -300, 0, 60, 120, 330, 540])))
+        return format_datetime(datetime(2020, 1, 1, tzinfo=zona) + timedelta(seconds=azar.randrange(5 * 365 * 86400)))
+    repetidas = [fecha_aleatoria() for _ in range(200)]
+    fechas = []
+    for i in range(cantidad):
+        if i % 500 == 0:
+            fechas.append("not a date") # 0.2% no interpretables.
+        elif azar.random() < 0.7:
+            fechas.append(azar.choice(repetidas))
+        else:
+            fechas.append(fecha_aleatoria())
+    parser = BytesParser(policy=policy.default)
+    correos = [parser.parsebytes(f"From: ana@example.com\r\nSubject: x\r\nDate: {fecha}\r\n\r\n".encode(), headersonly=True) for fecha in fechas]
+    print(f"  {LANG_MESSAGES.get('date_benchmark_corpus', '{count} synthetic message(s): {repeated:.0f}% drawn from {distinct} repeated dates, {invalid:.1f}% unparsable.').format(count=cantidad, repeated=100 * sum(fecha in repetidas for fecha in fechas) / cantidad, distinct=len(repetidas), invalid=100 * fechas.count('not a date') / cantidad)}")
+
+    nivel_log = SETTINGS["raw_date_log"]
+    SETTINGS["raw_date_log"] = "off" # Solo se mide la conversión.
+    try:
+        inicio = time.perf_counter()
+        anteriores = [convertir_fecha_correo.__wrapped__(str(msg.get('Date')))[:2] for msg in correos]
+        tiempo_anterior = time.perf_counter() - inicio
+        convertir_fecha_correo.cache_clear()
+        inicio = time.perf_counter()
+        actuales = [obtener_fecha_hora_correo(msg) for msg in correos]
+        tiempo_actual = time.perf_counter() - inicio
+    finally:
+        SETTINGS["raw_date_log"] = nivel_log
+    diferencias = sum(anterior != actual for anterior, actual in zip(anteriores, actuales))
+    resumen = LANG_MESSAGES.get('date_benchmark_result', "Date conversion: {before_us:.1f} us/message parsing every Date header, {after_us:.1f} us/message with the raw value and memoization ({speedup:.0f}x). Different results: {mismatches}.").format(
+        before_us=tiempo_anterior / cantidad * 1e6, after_us=tiempo_actual / cantidad * 1e6, speedup=tiempo_anterior / max(tiempo_actual, 1e-9), mismatches=diferencias)
+    logging.info(resumen)
+    print(f"  {resumen}")
+    return diferencias
+
 def obtener_hash_encabezados(msg):
     """
     Calcula un hash SHA256 de los encabezados de un mensaje de correo.
@@ -527,17 +1257,158 @@ def obtener_hash_encabezados(msg):
     )
     return hashlib.sha256(headers_bytes).hexdigest()
 
+# --- Hash de encabezados sin construir el mensaje completo ---
+# Los encabezados no estructurados en ASCII y sin palabras codificadas (Received, DKIM-Signature, etc.)
+# se devuelven tal cual con policy.default, así que se copian directamente. Los demás (direcciones,
+# fechas, Message-ID, Content-Type...) o los que traen "=?" se normalizan con la misma header_factory
+# que usa el parser, con una caché porque remitentes y destinatarios se repiten mucho en un buzón.
+ENCABEZADOS_ESTRUCTURADOS = frozenset(policy.default.header_factory.registry)
+PATRON_BYTES_NO_SEGUROS_ENCABEZADO = re.compile(rb'[^\t\x20-\x7e]') # Control, CR/LF sueltos o no ASCII: se usa el parser.
+PATRON_NOMBRE_ENCABEZADO = re.compile(rb'[\x21-\x39\x3b-\x7e]+:') # Mismo criterio que email.feedparser.headerRE.
+# Si el valor empieza en una línea de continuación ("Subject:\r\n foo"), policy.default le deja el espacio
+# inicial hasta Python 3.13.x, que pasó a quitarlo; se comprueba una vez para dar el mismo hash que el parser.
+CONTINUACION_SIN_ESPACIO_INICIAL = policy.default.header_source_parse(['X:\r\n', ' a\r\n'])[1] == 'a'
+
+@lru_cache(maxsize=8192)
+def _valor_encabezado_normalizado(nombre, valor):
+    """
+    Retorna el valor de un encabezado tal como lo expone un mensaje parseado con policy.default.
+    """
+    return str(policy.default.header_factory(nombre, valor)).encode('utf-8', errors='ignore')
+
+def obtener_hash_encabezados_crudos(lineas):
+    """
+    Calcula el mismo hash que obtener_hash_encabezados() directamente a partir de las líneas
+    (sin fin de línea) del bloque de encabezados, p. ej. la respuesta de TOP.
+    Los bloques con casos que el tokenizador no reproduce se delegan al parser completo.
+    """
+    campos = []
+    for linea in lineas:
+        if not linea:
+            break # Línea vacía: fin de los encabezados.
+        if PATRON_BYTES_NO_SEGUROS_ENCABEZADO.search(linea):
+            return _hash_encabezados_con_parser(lineas)
+        if linea[0] in b' \t':
+            if not campos:
+                return _hash_encabezados_con_parser(lineas)
+            campos[-1].append(linea) # Continuación del encabezado anterior.
+            continue
+        if linea.startswith((b'From ', b':')):
+            return _hash_encabezados_con_parser(lineas) # Línea "From " de mbox o encabezado sin nombre.
+        if not PATRON_NOMBRE_ENCABEZADO.match(linea):
+            break # El parser trata el resto como cuerpo.
+        campos.append([linea])
+
+    partes = []
+    for campo in campos:
+        nombre, _, valor = campo[0].partition(b':')
+        valor = valor.lstrip(b' \t')
+        if len(campo) > 1:
+            valor = b''.join([valor, *campo[1:]])
+            if CONTINUACION_SIN_ESPACIO_INICIAL:
+                valor = valor.lstrip(b' \t')
+        nombre_minusculas = nombre.lower().decode('ascii')
+        if nombre_minusculas in ENCABEZADOS_ESTRUCTURADOS or b'=?' in valor:
+            valor = _valor_encabezado_normalizado(nombre_minusculas, valor.decode('ascii'))
+        partes.append(nombre + b': ' + valor)
+    return hashlib.sha256(b'\r\n'.join(partes)).hexdigest()
+
+def _hash_encabezados_con_parser(lineas):
+    return obtener_hash_encabezados(BytesParser(policy=policy.default).parsebytes(b'\r\n'.join(lineas)))
+
 def load_spam_config():
     """
-    Esta función ahora retorna filtros vacíos ya que spam_config.json no se debe usar.
+    Carga las reglas de spam de spam_config.json y de las listas de FILTERS_DIR y las compila:
+    remitentes en ListaRemitentes (set de direcciones + árbol de sufijos de dominio) y palabras
+    en AutomataPalabras. Solo se vuelve a compilar cuando cambia alguno de los archivos.
+    Retorna (mail_whitelist, mail_blacklist, word_whitelist, word_blacklist).
+    """
+    global REGLAS_SPAM_COMPILADAS
+    firma = tuple(firma_archivo(ruta) for ruta in (SPAM_CONFIG_FILE, *ARCHIVOS_LISTAS_SPAM.values()))
+    if REGLAS_SPAM_COMPILADAS and REGLAS_SPAM_COMPILADAS[0] == firma:
+        return REGLAS_SPAM_COMPILADAS[1]
+    spam_config = {}
+    if os.path.exists(SPAM_CONFIG_FILE):
+        try:
+            with open(SPAM_CONFIG_FILE, 'r', encoding='utf-8') as f:
+                spam_config = json.load(f)
+            if not isinstance(spam_config, dict):
+                raise ValueError("expected a JSON object")
+        except (OSError, ValueError) as e:
+            logging.error(LANG_MESSAGES.get('error_reading_spam_config', "Could not read '{path}': {error}. Its rules are ignored.").format(path=SPAM_CONFIG_FILE, error=e))
+            spam_config = {}
+    entradas = {}
+    for clave, ruta in ARCHIVOS_LISTAS_SPAM.items():
+        valores = spam_config.get(clave, [])
+        entradas[clave] = [str(valor).strip().lower() for valor in valores] if isinstance(valores, list) else []
+        if os.path.exists(ruta): # Las listas de FILTERS_DIR son opcionales.
+            entradas[clave].extend(load_list_from_file(ruta))
+    reglas = (
+        ListaRemitentes(entradas["mail_whitelist"]),
+        ListaRemitentes(entradas["mail_blacklist"]),
+        AutomataPalabras(entradas["word_whitelist"]),
+        AutomataPalabras(entradas["word_blacklist"]))
+    REGLAS_SPAM_COMPILADAS = (firma, reglas)
+    logging.info(LANG_MESSAGES.get('spam_rules_compiled', "Spam rules compiled: {mail_whitelist} whitelisted sender(s), {mail_blacklist} blacklisted sender(s), {word_whitelist} whitelisted and {word_blacklist} blacklisted word(s).").format(
+        mail_whitelist=len(reglas[0]), mail_blacklist=len(reglas[1]), word_whitelist=len(reglas[2]), word_blacklist=len(reglas[3])))
+    return reglas
+
+REGLAS_SPAM_COMPILADAS = None # (firma de los archivos de origen, reglas compiladas)
+
+def firma_archivo(ruta):
+    """
+    Retorna (mtime_ns, tamaño) de un archivo, o None si no existe.
     """
-    mail_whitelist = set()
-    mail_blacklist = set()
-    word_whitelist = []
-    word_blacklist = []
-    # Ya no se lee spam_config.json
-    logging.info(LANG_MESSAGES.get('filters_loaded', "Spam filtering is currently not configured to read spam_config.json. Using empty filters."))
-    return mail_whitelist, mail_blacklist, word_whitelist, word_blacklist
+    try:
+        estado = os.stat(ruta)
+        return estado.st_mtime_ns, estado.st_size
+    except OSError:
+        return None
+
+class ListaRemitentes:
+    """
+    Lista blanca o negra de remitentes compilada.
+    "usuario@dominio" coincide solo con esa dirección; "dominio", "@dominio" o "*.dominio" coinciden
+    con el dominio y todos sus subdominios (árbol de sufijos por etiquetas).
+    """
+    FIN = "" # Marca de dominio completo dentro del árbol (ninguna etiqueta real es vacía).
+
+    def __init__(self, entradas):
+        self.direcciones = set()
+        self.dominios = {}
+        self.total = 0
+        for entrada in entradas:
+            entrada = entrada.strip().lower()
+            if not entrada:
+                continue
+            if "@" in entrada and not entrada.startswith("@"):
+                self.direcciones.add(entrada)
+            else:
+                nodo = self.dominios
+                for etiqueta in reversed(entrada.lstrip("@*.").split(".")):
+                    nodo = nodo.setdefault(etiqueta, {})
+                nodo[self.FIN] = True
+            self.total += 1
+
+    def __len__(self):
+        return self.total
+
+    def coincide(self, direccion):
+        """
+        Indica si una dirección de correo (ya en minúsculas) está en la lista.
+        """
+        if not direccion:
+            return False
+        if direccion in self.direcciones:
+            return True
+        nodo = self.dominios
+        for etiqueta in reversed(direccion.rpartition("@")[2].split(".")):
+            nodo = nodo.get(etiqueta)
+            if nodo is None:
+                return False
+            if self.FIN in nodo:
+                return True
+        return False
 
 def load_list_from_file(file_path, use_set=False):
     """
@@ -594,11 +1465,88 @@ def check_text_contains_keywords(text, keywords_collection):
     if not text or not keywords_collection: # Si el texto o la colección están vacíos, no hay coincidencias.
         return False
     text_lower = text.lower() # Convierte el texto a minúsculas una sola vez para eficiencia.
+    if isinstance(keywords_collection, AutomataPalabras):
+        return bool(keywords_collection.buscar(text_lower))
     for keyword in keywords_collection:
         if keyword in text_lower: # Comprueba si la palabra clave está en el texto.
             return True # Retorna True en la primera coincidencia.
     return False # Si se recorrieron todas las palabras clave y no se encontró ninguna.
 
+class AutomataPalabras:
+    """
+    Autómata de Aho-Corasick sobre una lista de palabras o frases (ya en minúsculas).
+    Una sola pasada por el texto encuentra todas las que aparecen como subcadena, con un costo
+    que depende del largo del texto y no del número de palabras.
+    """
+    def __init__(self, palabras):
+        self.transiciones = [{}] # Estado -> {carácter: estado siguiente}
+        self.fallos = [0]
+        self.salidas = [()] # Estado -> palabras que terminan en él (incluidas las de sus fallos).
+        palabras = sorted({palabra for palabra in palabras if palabra})
+        self.palabras = palabras
+        for palabra in palabras:
+            estado = 0
+            for caracter in palabra:
+                siguiente = self.transiciones[estado].get(caracter)
+                if siguiente is None:
+                    siguiente = len(self.transiciones)
+                    self.transiciones[estado][caracter] = siguiente
+                    self.transiciones.append({})
+                    self.fallos.append(0)
+                    self.salidas.append(())
+                estado = siguiente
+            self.salidas[estado] += (palabra,)
+        cola = deque(self.transiciones[0].values())
+        while cola: # Recorrido en anchura para calcular los enlaces de fallo.
+            estado = cola.popleft()
+            for caracter, siguiente in self.transiciones[estado].items():
+                cola.append(siguiente)
+                fallo = self.fallos[estado]
+                while fallo and caracter not in self.transiciones[fallo]:
+                    fallo = self.fallos[fallo]
+                destino = self.transiciones[fallo].get(caracter, 0)
+                self.fallos[siguiente] = destino if destino != siguiente else 0
+                self.salidas[siguiente] += self.salidas[self.fallos[siguiente]]
+        # Los caracteres que no aparecen en ninguna palabra devuelven al estado inicial, así que solo
+        # se recorren los tramos del texto formados por caracteres del alfabeto de las palabras.
+        alfabeto = {caracter for palabra in palabras for caracter in palabra}
+        self.tramos = re.compile("[" + "".join(re.escape(c) for c in sorted(alfabeto)) + "]+") if alfabeto else None
+
+    def __len__(self):
+        return len(self.palabras)
+
+    def buscar(self, texto):
+        """
+        Retorna el conjunto de palabras de la lista que aparecen en `texto` (ya en minúsculas).
+        """
+        encontradas = set()
+        if self.tramos is None or not texto:
+            return encontradas
+        transiciones, fallos, salidas = self.transiciones, self.fallos, self.salidas
+        for tramo in self.tramos.findall(texto):
+            estado = 0
+            for caracter in tramo:
+                while True:
+                    siguiente = transiciones[estado].get(caracter)
+                    if siguiente is not None:
+                        estado = siguiente
+                        break
+                    if not estado:
+                        break
+                    estado = fallos[estado]
+                if salidas[estado]:
+                    encontradas.update(salidas[estado])
+        return encontradas
+
+def buscar_palabras_en_correo(automata, asunto_lower, cuerpo_correo):
+    """
+    Busca las palabras de un autómata en el asunto y el cuerpo de un correo en una sola pasada.
+    El cuerpo solo se extrae si la lista tiene palabras.
+    """
+    if not automata:
+        return set()
+    return automata.buscar(asunto_lower + "\n" + cuerpo_correo.texto_minusculas)
+
 def extraer_texto_del_cuerpo(msg):
     """
     Extrae el texto plano del cuerpo de un mensaje de correo.
@@ -624,9 +1572,350 @@ def extraer_texto_del_cuerpo(msg):
                 pass
     return body_text.strip() # Elimina cualquier espacio en blanco al inicio y al final del texto extraído.
 
-def guardar_correo_y_obtener_metadata(user_email, msg_bytes, msg, hash_correo, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist):
+def _decodificar_parte_texto(lineas, encabezados_parte):
+    """
+    Decodifica el cuerpo de una parte text/plain según su Content-Transfer-Encoding y charset.
+    """
+    cte = str(encabezados_parte.get('Content-Transfer-Encoding', '')).strip().lower()
+    if cte == 'base64':
+        contenido = base64.b64decode(b''.join(lineas), validate=False)
+    elif cte == 'quoted-printable':
+        contenido = quopri.decodestring(b'\n'.join(lineas))
+    else:
+        contenido = b'\n'.join(lineas)
+    charset = encabezados_parte.get_content_charset() or 'utf-8'
+    try:
+        return contenido.decode(charset, errors='replace')
+    except LookupError: # Charset desconocido.
+        return contenido.decode('utf-8', errors='replace')
+
+def extraer_texto_del_cuerpo_desde_archivo(ruta_eml, max_bytes_por_parte=0):
+    """
+    Equivalente de extraer_texto_del_cuerpo que recorre el archivo .eml línea por línea.
+    Solo se parsean los encabezados de cada parte y el contenido de las partes text/plain
+    que no son adjuntos; el resto (p. ej. adjuntos grandes) se salta sin cargarse en memoria.
+    Como msg.walk(), entra en los correos adjuntos (message/rfc822 y los demás message/*).
+    Con `max_bytes_por_parte` solo se decodifican los primeros bytes (codificados) de cada parte.
+    """
+    parser_encabezados = BytesParser(policy=policy.default)
+    textos = []
+    limite_parte = max_bytes_por_parte or float('inf')
+    try:
+        with abrir_eml(ruta_eml) as f:
+            def leer_encabezados(tipo_por_defecto="text/plain"):
+                bloque = []
+                for linea in f:
+                    if linea in (b'\r\n', b'\n'):
+                        break
+                    bloque.append(linea)
+                encabezados_parte = parser_encabezados.parsebytes(b''.join(bloque), headersonly=True)
+                encabezados_parte.set_default_type(tipo_por_defecto)
+                # El cuerpo de un message/* (salvo delivery-status, que son solo bloques de encabezados)
+                # es otro correo completo: se sigue con sus encabezados, igual que el parser de email.
+                if (encabezados_parte.get_content_maintype() == 'message'
+                        and encabezados_parte.get_content_type() != 'message/delivery-status'):
+                    return leer_encabezados()
+                return encabezados_parte
+
+            def es_texto_plano(encabezados_parte):
+                return (encabezados_parte.get_content_type() == "text/plain"
+                        and "attachment" not in str(encabezados_parte.get("Content-Disposition")))
+
+            encabezados = leer_encabezados()
+            if encabezados.get_content_maintype() != 'multipart':
+                if es_texto_plano(encabezados):
+                    lineas_parte, tamano_parte = [], 0
+                    for linea in f:
+                        if tamano_parte >= limite_parte:
+                            break
+                        lineas_parte.append(linea.rstrip(b'\r\n'))
+                        tamano_parte += len(linea)
+                    textos.append(_decodificar_parte_texto(lineas_parte, encabezados))
+                return "\n".join(textos).strip()
+
+            limites = [] # Pila de delimitadores de las partes multipart anidadas.
+            digests = set() # Delimitadores de multipart/digest, cuyas partes son message/rfc822 por defecto.
+            def abrir_multipart(encabezados_multipart):
+                limite = encabezados_multipart.get_boundary()
+                if limite:
+                    limites.append(limite.encode('utf-8', errors='replace'))
+                    if encabezados_multipart.get_content_subtype() == 'digest':
+                        digests.add(limites[-1])
+
+            abrir_multipart(encabezados)
+            parte_actual = None # Encabezados de la parte text/plain que se está acumulando.
+            lineas_parte = []
+            tamano_parte = 0
+            for linea in f:
+                linea = linea.rstrip(b'\r\n')
+                delimitador = linea[2:].rstrip() if linea.startswith(b'--') else None
+                es_cierre = delimitador is not None and delimitador.endswith(b'--') and delimitador[:-2] in limites
+                if delimitador is not None and (delimitador in limites or es_cierre):
+                    if parte_actual is not None:
+                        textos.append(_decodificar_parte_texto(lineas_parte, parte_actual))
+                        parte_actual, lineas_parte, tamano_parte = None, [], 0
+                    if es_cierre:
+                        del limites[limites.index(delimitador[:-2]):] # Cierra la parte multipart y las anidadas.
+                        continue
+                    encabezados_parte = leer_encabezados("message/rfc822" if delimitador in digests else "text/plain")
+                    if encabezados_parte.get_content_maintype() == 'multipart':
+                        abrir_multipart(encabezados_parte)
+                    elif es_texto_plano(encabezados_parte):
+                        parte_actual = encabezados_parte
+                elif parte_actual is not None and tamano_parte < limite_parte:
+                    lineas_parte.append(linea) # Pasado el límite se siguen leyendo líneas solo para encontrar el delimitador.
+                    tamano_parte += len(linea) + 2
+            if parte_actual is not None:
+                textos.append(_decodificar_parte_texto(lineas_parte, parte_actual))
+    except Exception as e:
+        logging.debug(f"Could not extract body text from '{ruta_eml}': {e}")
+    return "\n".join(textos).strip()
+
+class CuerpoCorreo:
+    """
+    Texto del cuerpo de un .eml que se extrae solo la primera vez que una regla lo pide.
+    Cada parte text/plain se limita a "body_text_max_bytes_per_part" bytes.
+    """
+    def __init__(self, ruta_eml):
+        self.ruta_eml = ruta_eml
+        self._texto_minusculas = None
+
+    @property
+    def texto_minusculas(self):
+        if self._texto_minusculas is None:
+            self._texto_minusculas = extraer_texto_del_cuerpo_desde_archivo(self.ruta_eml, SETTINGS["body_text_max_bytes_per_part"]).lower()
+        return self._texto_minusculas
+
+# --- Compresión de los .eml (eml_compression) ---
+# El códec se identifica por la extensión del archivo (".eml.gz", ".eml.xz", ".eml.zst"), así que
+# los lectores no necesitan los metadatos para abrirlo; el campo "compression" es informativo.
+CODECS_EML = {"gzip": ".gz", "lzma": ".xz", "zstd": ".zst"} # Códec -> extensión añadida a ".eml".
+EXTENSIONES_EML = (".eml", *(f".eml{extension}" for extension in CODECS_EML.values()))
+
+@lru_cache(maxsize=8)
+def obtener_codec_compresion(codec):
+    """
+    Retorna el códec de eml_compression que se usará, o None para guardar sin comprimir
+    ("none", un valor desconocido o "zstd" sin el paquete zstandard).
+    """
+    if codec not in CODECS_EML:
+        return None
+    if codec == "zstd" and zstandard is None:
+        logging.warning(LANG_MESSAGES.get('zstd_not_available', "WARNING: eml_compression is 'zstd' but the 'zstandard' package is not installed. Emails are saved uncompressed."))
+        return None
+    return codec
+
+def codec_de_ruta(ruta):
+    """
+    Retorna el códec de un .eml según su extensión, o None si no está comprimido.
+    """
+    for codec, extension in CODECS_EML.items():
+        if ruta.endswith(f".eml{extension}"):
+            return codec
+    return None
+
+def abrir_escritor_comprimido(archivo, codec):
+    """
+    Envuelve un archivo binario abierto para escritura con el compresor del códec, con un búfer
+    para no comprimir línea por línea. Cerrar el escritor no cierra `archivo`.
+    """
+    if codec == "gzip":
+        compresor = gzip.GzipFile(fileobj=archivo, mode='wb', compresslevel=6, mtime=0)
+    elif codec == "lzma":
+        compresor = lzma.LZMAFile(archivo, 'wb', preset=6)
+    else:
+        compresor = zstandard.ZstdCompressor(level=3).stream_writer(archivo, closefd=False)
+    return io.BufferedWriter(compresor, 65536)
+
+def abrir_eml(ruta):
+    """
+    Abre un .eml para lectura binaria, descomprimiéndolo al vuelo si su extensión lo indica.
+    El objeto retornado se puede recorrer línea por línea y usar con "with".
+    Pensada también para integraciones como MailEML Viewer que leen los archivos de "path".
+    """
+    codec = codec_de_ruta(ruta)
+    if codec == "gzip":
+        return gzip.open(ruta, 'rb')
+    if codec == "lzma":
+        return lzma.open(ruta, 'rb')
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError(f"'{ruta}' is zstd-compressed but the 'zstandard' package is not installed")
+        return io.BufferedReader(zstandard.open(ruta, 'rb'))
+    return open(ruta, 'rb')
+
+def leer_eml(ruta):
+    """
+    Retorna el contenido completo (descomprimido) de un .eml.
+    """
+    with abrir_eml(ruta) as f:
+        return f.read()
+
+def comparar_compresion(limite_archivos=0):
+    """
+    Modo --benchmark-compression: comprime y descomprime en memoria los .eml guardados (o los
+    primeros `limite_archivos`) con cada códec disponible y muestra la proporción y la velocidad.
+    """
+    muestras = []
+    for _, ruta_eml, _, _, _ in listar_archivos_eml():
+        muestras.append(leer_eml(ruta_eml))
+        if limite_archivos and len(muestras) >= limite_archivos:
+            break
+    total = sum(len(muestra) for muestra in muestras)
+    if not total:
+        print(f"  {LANG_MESSAGES.get('no_eml_found', 'No .eml files found in the specified directory.')}")
+        return
+    print(f"  {LANG_MESSAGES.get('compression_benchmark_corpus', '{count} file(s), {mb:.1f} MB uncompressed.').format(count=len(muestras), mb=total / 1048576)}")
+    for codec in CODECS_EML:
+        if obtener_codec_compresion(codec) is None:
+            continue
+        comprimidos = []
+        inicio = time.perf_counter()
+        for muestra in muestras:
+            destino = io.BytesIO()
+            with abrir_escritor_comprimido(destino, codec) as escritor:
+                escritor.write(muestra)
+            comprimidos.append(destino.getvalue())
+        tiempo_compresion = time.perf_counter() - inicio
+        descompresor = zstandard.ZstdDecompressor() if codec == "zstd" else None
+        inicio = time.perf_counter()
+        for comprimido in comprimidos:
+            if codec == "gzip":
+                gzip.decompress(comprimido)
+            elif codec == "lzma":
+                lzma.decompress(comprimido)
+            else:
+                descompresor.stream_reader(comprimido).read() # El flujo no guarda el tamaño original, así que no sirve decompress().
+        tiempo_descompresion = time.perf_counter() - inicio
+        tamano = sum(len(comprimido) for comprimido in comprimidos)
+        resumen = LANG_MESSAGES.get('compression_benchmark_result', "{codec}: ratio {ratio:.2f}x ({percent:.1f}% of original), compress {compress_mbs:.1f} MB/s, decompress {decompress_mbs:.1f} MB/s.").format(
+            codec=codec, ratio=total / tamano, percent=100 * tamano / total,
+            compress_mbs=total / 1048576 / max(tiempo_compresion, 1e-9), decompress_mbs=total / 1048576 / max(tiempo_descompresion, 1e-9))
+        logging.info(resumen)
+        print(f"  {resumen}")
+
+class DescargaEnCurso:
+    """
+    Destino de una respuesta RETR: escribe las líneas en un archivo temporal dentro del
+    directorio del usuario a medida que llegan y solo guarda en memoria el bloque de encabezados.
+    El contenido del archivo es idéntico al de unir con CRLF las líneas que retorna poplib.retr()
+    (comprimido con el códec de eml_compression, si hay uno).
+    Con blob_store el contenido se acumula en memoria (hasta blob_buffer_kb) mientras se calcula su
+    clave; si ese contenido ya está en el almacén, no se escribe y `ruta_temporal` apunta al blob.
+    """
+    PREFIJO = ".descarga-"
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self.ruta_temporal = None
+        self.archivo_crudo = self.archivo = None
+        self.codec = obtener_codec_compresion(SETTINGS["eml_compression"])
+        self.encabezados = bytearray()
+        self.en_encabezados = True
+        self.bytes_recibidos = 0
+        self.hash_contenido = hashlib.sha256() if SETTINGS["blob_store"] else None # Clave de contenido: SHA256 de los bytes crudos.
+        self.memoria = bytearray() if self.hash_contenido is not None else None
+        self.en_almacen = False # True si ruta_temporal es un blob existente (no se mueve ni se elimina).
+        if self.memoria is None:
+            self._abrir_archivo()
+
+    def _abrir_archivo(self):
+        descriptor, self.ruta_temporal = tempfile.mkstemp(prefix=self.PREFIJO, suffix=".tmp", dir=self.directorio)
+        self.archivo_crudo = os.fdopen(descriptor, 'wb')
+        self.archivo = abrir_escritor_comprimido(self.archivo_crudo, self.codec) if self.codec else self.archivo_crudo
+
+    def _volcar_memoria(self):
+        self._abrir_archivo()
+        self.archivo.write(self.memoria)
+        self.memoria = None
+
+    def escribir_linea(self, linea):
+        separador = b'\r\n' if self.bytes_recibidos else b''
+        if self.hash_contenido is not None:
+            self.hash_contenido.update(separador)
+            self.hash_contenido.update(linea)
+        if self.memoria is not None:
+            self.memoria += separador
+            self.memoria += linea
+            if len(self.memoria) > SETTINGS["blob_buffer_kb"] * 1024:
+                self._volcar_memoria() # Demasiado grande para esperar en memoria: sigue en el archivo temporal.
+        else:
+            if separador:
+                self.archivo.write(separador)
+            self.archivo.write(linea)
+        self.bytes_recibidos += len(linea) + 2
+        if self.en_encabezados:
+            if linea:
+                self.encabezados += linea + b'\r\n'
+            else:
+                self.en_encabezados = False # La primera línea vacía separa encabezados y cuerpo.
+
+    def cerrar(self):
+        if self.memoria is not None:
+            ruta_blob = obtener_ruta_blob(self.clave_contenido(), CODECS_EML.get(self.codec, ""))
+            if os.path.exists(ruta_blob):
+                self.ruta_temporal = ruta_blob # Contenido repetido: se lee y se enlaza el blob, sin escribir nada.
+                self.en_almacen = True
+                self.memoria = None
+                return
+            self._volcar_memoria()
+        if self.archivo is None:
+            return
+        if not self.archivo.closed:
+            self.archivo.close() # Con compresión, escribe el final del flujo comprimido.
+        if not self.archivo_crudo.closed:
+            self.archivo_crudo.close()
+
+    def descartar(self):
+        """
+        Cierra y elimina el archivo temporal si todavía existe (no se movió a su nombre definitivo).
+        """
+        self.memoria = None
+        if self.en_almacen:
+            return
+        if self.archivo is not None and not self.archivo.closed:
+            self.archivo.close()
+        if self.archivo_crudo is not None and not self.archivo_crudo.closed:
+            self.archivo_crudo.close()
+        if self.ruta_temporal is None:
+            return
+        try:
+            os.remove(self.ruta_temporal)
+        except FileNotFoundError:
+            pass
+
+    def obtener_encabezados(self):
+        return BytesParser(policy=policy.default).parsebytes(bytes(self.encabezados), headersonly=True)
+
+    def clave_contenido(self):
+        """
+        Retorna la clave del almacén de contenido, o None si blob_store está desactivado.
+        """
+        if self.hash_contenido is None:
+            return None
+        return self.hash_contenido.hexdigest()
+
+def limpiar_descargas_incompletas(user_dir):
+    """
+    Elimina archivos temporales de descargas interrumpidas en ciclos anteriores.
+    """
+    try:
+        for nombre in os.listdir(user_dir):
+            if nombre.startswith(DescargaEnCurso.PREFIJO) and nombre.endswith(".tmp"):
+                os.remove(os.path.join(user_dir, nombre))
+    except OSError:
+        pass
+
+def guardar_correo_y_obtener_metadata(user_email, ruta_temporal, msg, hash_correo, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist, archivo_existente=None, clave_blob=None, compresion=None, mover=True):
     """
-    Guarda el contenido raw del correo en un archivo .eml y extrae sus metadatos.
+    Extrae los metadatos del correo descargado en `ruta_temporal` y lo mueve a su archivo .eml definitivo.
+    `msg` solo necesita los encabezados; el texto del cuerpo se lee del archivo.
+    Con `archivo_existente` no se mueve nada: se generan los metadatos de un .eml que ya está en disco
+    (usado para reconstruir los metadatos). Con mover=False solo se generan los metadatos (etapa de
+    análisis del pool de procesos) y el llamador mueve después el archivo con mover_correo_descargado().
+    Con `clave_blob` el correo se guarda en el almacén de contenido y el .eml de la cuenta es un enlace
+    duro al blob. `compresion` es el códec con el que se escribió `ruta_temporal` (ver DescargaEnCurso);
+    define la extensión del archivo.
     Aplica reglas de filtro de spam basadas en listas blancas/negras.
     """
     from_header = msg.get('From', 'N/A')
@@ -674,7 +1963,8 @@ def guardar_correo_y_obtener_metadata(user_email, msg_bytes, msg, hash_correo, m
     recipients_bcc = parse_recipients_list(bcc_header)
     remitente_s = sanitizar_nombre(sender_display)
     asunto_s = sanitizar_nombre(asunto)
-    fecha_formateada, fecha_iso = obtener_fecha_hora_correo(msg, user_email)
+    with MEDIDOR_FASES.medir("date", user_email):
+        fecha_formateada, fecha_iso = obtener_fecha_hora_correo(msg, user_email)
     if fecha_formateada: # Solo usa la fecha si no está vacía.
         max_len = 150 # Longitud máxima deseada para el nombre del archivo.
         base_name = f"{fecha_formateada} --- {asunto_s} --- {remitente_s}"
@@ -687,35 +1977,50 @@ def guardar_correo_y_obtener_metadata(user_email, msg_bytes, msg, hash_correo, m
     else:
         nombre_archivo_eml = f"Correo_SinFecha_{hash_correo[:10]}.eml"
         logging.warning(LANG_MESSAGES.get('email_date_not_available', "WARNING: Email date not available. Using generic filename: '{filename}'").format(filename=nombre_archivo_eml))
+    if compresion:
+        nombre_archivo_eml += CODECS_EML[compresion]
 
     path_usuario = os.path.join(EMAILS_BASE_DIR, user_email)
-    archivo_eml_completo = os.path.join(path_usuario, nombre_archivo_eml)
-    raw_email_bytes = b'\r\n'.join(msg_bytes)
-    logging.info(LANG_MESSAGES.get('attempting_to_save_email', "Attempting to save email: Subject='{subject}', Sender='{sender}'").format(subject=asunto, sender=sender_display))
-    try:
-        with open(archivo_eml_completo, 'wb') as f: # Abre el archivo en modo escritura binaria.
-            f.write(raw_email_bytes) # Escribe el contenido raw del correo.
-        logging.info(LANG_MESSAGES.get('email_file_saved_successfully', "Email file saved successfully at '{path}'.").format(path=archivo_eml_completo))
-    except Exception as e:
-        logging.error(LANG_MESSAGES.get('error_saving_eml_file', "ERROR: Could not save .eml file '{path}'. Details: {e}. Metadata for this email will not be registered.").format(path=archivo_eml_completo, e=e))
-        return None # Retorna None si el archivo no se pudo guardar, indicando un fallo.
+    if archivo_existente:
+        archivo_eml_completo = archivo_existente
+        nombre_archivo_eml = os.path.basename(archivo_existente)
+        compresion = codec_de_ruta(archivo_existente)
+        ruta_contenido = archivo_existente
+    else:
+        archivo_eml_completo = os.path.join(path_usuario, nombre_archivo_eml)
+        ruta_contenido = ruta_temporal # Se lee antes de moverlo; el contenido es el mismo.
     tamano_eml = -1
     try:
-        tamano_eml = os.path.getsize(archivo_eml_completo)
-        logging.debug(f"Size of saved .eml file: {tamano_eml} bytes.")
+        tamano_eml = os.path.getsize(ruta_contenido)
+        logging.debug("Size of saved .eml file: %d bytes.", tamano_eml)
     except Exception as e:
-        logging.warning(LANG_MESSAGES.get('error_getting_file_size', "WARNING: Error getting size of file '{path}'. Details: {e}").format(path=archivo_eml_completo, e=e))
+        logging.warning(LANG_MESSAGES.get('error_getting_file_size', "WARNING: Error getting size of file '{path}'. Details: {e}").format(path=ruta_contenido, e=e))
         pass
     asunto_lower = asunto.lower() if asunto != 'Sin Asunto' else ""
-    cuerpo_correo_lower = extraer_texto_del_cuerpo(msg).lower()
+    cuerpo_correo = CuerpoCorreo(ruta_contenido) # El texto se extrae solo si alguna regla usa cuerpo_correo.texto_minusculas.
     spam_score = extraer_score_spam(msg) # Extrae la puntuación de spam (puede ser None).
     spam_filter_status = "no" # Asume que el correo no es spam por defecto.
     spam_filter_whitelist_status = "no" # Nuevo campo para indicar si una whitelist se activó.
     
-    # Lógica de filtrado de spam eliminada ya que spam_config.json no se usa.
-    # Si se quisiera reintroducir una lógica de filtrado diferente, iría aquí.
-    # Por ahora, todos los correos tendrán spam_filter_status = "no" y spam_filter_whitelist_status = "no"
-    # a menos que se modifique esta sección.
+    # Reglas de spam (spam_config.json + FILTERS_DIR). Primero lo barato (remitente) y luego las palabras;
+    # las listas blancas solo se evalúan si una lista negra marcó el correo, para no leer el cuerpo sin necesidad.
+    if mail_blacklist and mail_blacklist.coincide(sender_email_for_filter):
+        spam_filter_status = "yes"
+        registrar_evento(logging.INFO, 'sender_blacklisted', "Sender '{sender}' is blacklisted.", sender=sender_email_for_filter)
+    else:
+        palabras_negras = buscar_palabras_en_correo(word_blacklist, asunto_lower, cuerpo_correo)
+        if palabras_negras:
+            spam_filter_status = "yes"
+            registrar_evento(logging.INFO, 'word_blacklist_matches', "Blacklisted word(s) found: {words}.", words=", ".join(sorted(palabras_negras)))
+    if spam_filter_status == "yes":
+        if mail_whitelist and mail_whitelist.coincide(sender_email_for_filter):
+            spam_filter_status, spam_filter_whitelist_status = "no", "yes"
+            registrar_evento(logging.INFO, 'sender_whitelisted', "Sender '{sender}' is whitelisted.", sender=sender_email_for_filter)
+        else:
+            palabras_blancas = buscar_palabras_en_correo(word_whitelist, asunto_lower, cuerpo_correo)
+            if palabras_blancas:
+                spam_filter_status, spam_filter_whitelist_status = "no", "yes"
+                registrar_evento(logging.INFO, 'word_whitelist_matches', "Whitelisted word(s) found: {words}.", words=", ".join(sorted(palabras_blancas)))
 
     metadatos = {
         "name": nombre_archivo_eml,
@@ -736,20 +2041,407 @@ def guardar_correo_y_obtener_metadata(user_email, msg_bytes, msg, hash_correo, m
         "spam_filter": spam_filter_status, # 'yes' si es spam según las reglas (sin score), 'no' si no lo es o fue anulado por lista blanca.
         "spam_filter_whitelist": spam_filter_whitelist_status # Nuevo campo: 'yes' si una whitelist se activó, 'no' en caso contrario.
     }
-    logging.info(LANG_MESSAGES.get('spam_filter_info', "Spam filter info for this email: Score={score}, Filtered: '{filtered}', Whitelist Active: '{whitelist}'.").format(score=spam_score if spam_score is not None else 'N/A', filtered=spam_filter_status, whitelist=spam_filter_whitelist_status))
-    return metadatos
+    if compresion:
+        metadatos["compression"] = compresion # Códec del archivo de "path"; se lee con abrir_eml().
+    registrar_evento(logging.INFO, 'spam_filter_info', "Spam filter info for this email: Score={score}, Filtered: '{filtered}', Whitelist Active: '{whitelist}'.",
+                     score=spam_score if spam_score is not None else 'N/A', filtered=spam_filter_status, whitelist=spam_filter_whitelist_status)
+    if archivo_existente or not mover:
+        return metadatos
+    return mover_correo_descargado(ruta_temporal, metadatos, clave_blob)
 
-def cargar_metadatos_existentes():
+def mover_correo_descargado(ruta_temporal, metadatos, clave_blob=None):
     """
-    Carga los metadatos de correos electrónicos existentes desde el archivo JSON.
-    Retorna una lista de metadatos y un set de hashes de correos existentes.
+    Mueve un correo descargado a la ruta de sus metadatos ("path"), o lo enlaza desde el almacén de
+    contenido si se indica `clave_blob`. Retorna los metadatos (con "blob" si quedó enlazado), o None
+    si el archivo no se pudo guardar.
     """
-    all_emails_metadata = []
-    existing_hashes = set()
-    logging.info(LANG_MESSAGES.get('loading_existing_metadata', "Attempting to load existing metadata from '{path}'...").format(path=METADATA_FILE))
-    if os.path.exists(METADATA_FILE):
-        try:
-            with open(METADATA_FILE, 'r', encoding='utf-8') as f:
+    archivo_eml_completo = os.path.join(EMAILS_BASE_DIR, metadatos["path"])
+    registrar_evento(logging.INFO, 'attempting_to_save_email', "Attempting to save email: Subject='{subject}', Sender='{sender}'", subject=metadatos["subject"], sender=metadatos["sender"])
+    try:
+        if clave_blob and guardar_en_almacen_blobs(ruta_temporal, clave_blob, archivo_eml_completo, CODECS_EML.get(metadatos.get("compression"), "")):
+            metadatos["blob"] = clave_blob # Clave en el almacén de contenido; el archivo de "path" es un enlace a ese blob.
+        elif os.path.dirname(os.path.dirname(ruta_temporal)) == BLOBS_DIR:
+            # Copia de un blob existente que no se pudo enlazar: se copia, el blob sigue en el almacén.
+            descriptor, ruta_copia = tempfile.mkstemp(prefix=DescargaEnCurso.PREFIJO, suffix=".tmp", dir=os.path.dirname(archivo_eml_completo))
+            os.close(descriptor)
+            shutil.copyfile(ruta_temporal, ruta_copia)
+            os.replace(ruta_copia, archivo_eml_completo)
+            registrar_escritura_pendiente(archivo_eml_completo)
+        else:
+            os.replace(ruta_temporal, archivo_eml_completo) # Renombrado atómico: el .eml nunca queda a medio escribir.
+            registrar_escritura_pendiente(archivo_eml_completo) # Se sincroniza con el disco al final del ciclo.
+        registrar_evento(logging.INFO, 'email_file_saved_successfully', "Email file saved successfully at '{path}'.", path=archivo_eml_completo)
+    except Exception as e:
+        logging.error(LANG_MESSAGES.get('error_saving_eml_file', "ERROR: Could not save .eml file '{path}'. Details: {e}. Metadata for this email will not be registered.").format(path=archivo_eml_completo, e=e))
+        return None # Retorna None si el archivo no se pudo guardar, indicando un fallo.
+    return metadatos
+
+# --- Almacén de contenido (blob_store) ---
+# La clave es el SHA256 de los bytes crudos del correo, así que un blob solo se comparte entre copias
+# idénticas byte a byte: cada .eml enlazado es exactamente lo que entregó el servidor de esa cuenta.
+BLOQUEO_BLOBS = threading.Lock() # Protege ESTADISTICAS_BLOBS y la creación de blobs cuando varias cuentas guardan la misma copia.
+ESTADISTICAS_BLOBS = {"nuevos": 0, "reutilizados": 0, "bytes_ahorrados": 0} # Del ciclo actual; ver reportar_ahorro_blobs().
+
+def obtener_ruta_blob(clave, extension=""):
+    return os.path.join(BLOBS_DIR, clave[:2], f"{clave}.eml{extension}")
+
+def enlazar_atomico(origen, destino):
+    """
+    Crea `destino` como enlace duro de `origen`, reemplazándolo si ya existía.
+    """
+    # Mismo prefijo que las descargas para que limpiar_descargas_incompletas() lo elimine tras una interrupción.
+    enlace_temporal = os.path.join(os.path.dirname(destino), f"{DescargaEnCurso.PREFIJO}enlace-{os.getpid()}-{threading.get_ident()}.tmp")
+    os.link(origen, enlace_temporal)
+    try:
+        os.replace(enlace_temporal, destino)
+    except OSError:
+        os.remove(enlace_temporal)
+        raise
+
+def guardar_en_almacen_blobs(ruta_temporal, clave, destino, extension=""):
+    """
+    Guarda un correo descargado en el almacén de contenido y lo enlaza en `destino`.
+    Si el blob ya existe, solo se crea el enlace (`ruta_temporal` es entonces el propio blob, o un
+    archivo temporal que se descarta si el correo superaba blob_buffer_kb). Retorna True si el correo quedó enlazado, o False si el sistema de archivos no admite
+    enlaces duros (el llamador guarda entonces el archivo normalmente).
+    """
+    ruta_blob = obtener_ruta_blob(clave, extension) # La extensión del códec: la clave es la del contenido sin comprimir.
+    with BLOQUEO_BLOBS:
+        reutilizado = os.path.exists(ruta_blob)
+        try:
+            if not reutilizado:
+                os.makedirs(os.path.dirname(ruta_blob), exist_ok=True)
+                os.replace(ruta_temporal, ruta_blob)
+                registrar_escritura_pendiente(ruta_blob)
+            enlazar_atomico(ruta_blob, destino)
+        except OSError as e:
+            logging.warning(LANG_MESSAGES.get('blob_link_failed', "WARNING: Could not link '{path}' into the blob store; saving it as a regular file. Details: {e}").format(path=destino, e=e))
+            if not reutilizado and os.path.exists(ruta_blob) and not os.path.exists(ruta_temporal):
+                os.replace(ruta_blob, ruta_temporal) # Deja el correo donde el llamador lo espera.
+            return False
+        if reutilizado:
+            ESTADISTICAS_BLOBS["reutilizados"] += 1
+            ESTADISTICAS_BLOBS["bytes_ahorrados"] += os.path.getsize(ruta_blob)
+        else:
+            ESTADISTICAS_BLOBS["nuevos"] += 1
+    registrar_escritura_pendiente(destino) # Sincroniza la entrada de directorio del enlace.
+    return True
+
+def reportar_ahorro_blobs():
+    """
+    Registra el ahorro del almacén de contenido en el ciclo y reinicia los contadores.
+    """
+    with BLOQUEO_BLOBS:
+        estadisticas = dict(ESTADISTICAS_BLOBS)
+        ESTADISTICAS_BLOBS.update(nuevos=0, reutilizados=0, bytes_ahorrados=0)
+    if not estadisticas["nuevos"] and not estadisticas["reutilizados"]:
+        return
+    logging.info(LANG_MESSAGES.get('blob_dedup_summary', "Blob store: {new} new email(s), {reused} duplicate(s) linked, {saved_kb} KB saved this cycle.").format(
+        new=estadisticas["nuevos"], reused=estadisticas["reutilizados"], saved_kb=estadisticas["bytes_ahorrados"] // 1024))
+    print(LANG_MESSAGES.get('blob_dedup_summary', "  Almacén de contenido: {new} correo(s) nuevo(s), {reused} duplicado(s) enlazado(s), {saved_kb} KB ahorrados en este ciclo.").format(
+        new=estadisticas["nuevos"], reused=estadisticas["reutilizados"], saved_kb=estadisticas["bytes_ahorrados"] // 1024))
+
+def fsync_directorio(ruta_directorio):
+    """
+    Sincroniza con el disco la entrada de directorio (necesario para que un renombrado sea durable).
+    En sistemas que no permiten abrir directorios (Windows) no hace nada.
+    """
+    try:
+        descriptor = os.open(ruta_directorio, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
+
+def escribir_archivo_atomico(ruta, escribir, modo='w'):
+    """
+    Escribe un archivo de forma segura ante cortes: `escribir(f)` escribe en un temporal del mismo
+    directorio, que se sincroniza con fsync y se renombra sobre `ruta`. Un corte durante la escritura
+    deja intacta la versión anterior.
+    """
+    directorio = os.path.dirname(ruta)
+    os.makedirs(directorio, exist_ok=True)
+    descriptor, ruta_temporal = tempfile.mkstemp(prefix="." + os.path.basename(ruta) + ".", suffix=".tmp", dir=directorio)
+    try:
+        with os.fdopen(descriptor, modo, **({'encoding': 'utf-8'} if 'b' not in modo else {})) as f:
+            escribir(f)
+            f.flush()
+            if SETTINGS["fsync"]:
+                os.fsync(f.fileno())
+        os.replace(ruta_temporal, ruta)
+    except BaseException:
+        try:
+            os.remove(ruta_temporal)
+        except OSError:
+            pass
+        raise
+    if SETTINGS["fsync"]:
+        fsync_directorio(directorio)
+
+def registrar_escritura_pendiente(ruta):
+    """
+    Anota un archivo escrito en este ciclo para sincronizarlo en lote con sincronizar_escrituras_pendientes().
+    """
+    with BLOQUEO_ESCRITURAS:
+        ESCRITURAS_PENDIENTES.add(ruta)
+
+def sincronizar_escrituras_pendientes():
+    """
+    Hace fsync de los .eml escritos en el ciclo y de sus directorios, una sola vez por archivo y
+    directorio. Se llama antes de registrar los metadatos, para que los metadatos nunca apunten
+    a un archivo que aún no está en disco.
+    """
+    with BLOQUEO_ESCRITURAS:
+        rutas = list(ESCRITURAS_PENDIENTES)
+        ESCRITURAS_PENDIENTES.clear()
+    if not SETTINGS["fsync"] or not rutas:
+        return
+    for ruta in rutas:
+        try:
+            with open(ruta, 'rb') as f:
+                os.fsync(f.fileno())
+        except OSError as e:
+            logging.warning(LANG_MESSAGES.get('fsync_failed', "WARNING: Could not sync '{path}' to disk. Details: {e}").format(path=ruta, e=e))
+    for directorio in {os.path.dirname(ruta) for ruta in rutas}:
+        fsync_directorio(directorio)
+    logging.debug(f"{len(rutas)} file(s) synced to disk.")
+
+def leer_bloque_encabezados_eml(ruta_eml):
+    """
+    Retorna los bytes del bloque de encabezados de un archivo .eml (hasta la primera línea vacía).
+    """
+    bloque = []
+    with abrir_eml(ruta_eml) as f:
+        for linea in f:
+            if linea in (b'\r\n', b'\n'):
+                break
+            bloque.append(linea)
+    return b''.join(bloque)
+
+def leer_encabezados_eml(ruta_eml):
+    """
+    Lee y parsea solo el bloque de encabezados de un archivo .eml.
+    """
+    return BytesParser(policy=policy.default).parsebytes(leer_bloque_encabezados_eml(ruta_eml), headersonly=True)
+
+def comprobar_hash_encabezados_crudos():
+    """
+    Modo --check-header-hash: compara obtener_hash_encabezados_crudos() con el cálculo basado en el
+    parser sobre todos los .eml en disco, para confirmar que los hashes guardados siguen siendo válidos.
+    Retorna el número de diferencias.
+    """
+    bloques = []
+    for _, ruta_eml, _, _, _ in listar_archivos_eml():
+        bloque = leer_bloque_encabezados_eml(ruta_eml)
+        bloques.append((ruta_eml, bloque, re.split(rb'\r\n|\r|\n', bloque)))
+    diferencias = 0
+    tiempo_parser = tiempo_crudo = 0.0
+    for ruta_eml, bloque, lineas in bloques:
+        inicio = time.perf_counter()
+        esperado = obtener_hash_encabezados(BytesParser(policy=policy.default).parsebytes(bloque))
+        tiempo_parser += time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        obtenido = obtener_hash_encabezados_crudos(lineas)
+        tiempo_crudo += time.perf_counter() - inicio
+        if esperado != obtenido:
+            diferencias += 1
+            logging.error(LANG_MESSAGES.get('header_hash_mismatch', "Header hash mismatch for '{filename}': parser {expected}..., fast path {actual}...").format(filename=ruta_eml, expected=esperado[:10], actual=obtenido[:10]))
+    resumen = LANG_MESSAGES.get('header_hash_check_summary', "Header hash check: {total} file(s), {mismatches} mismatch(es). Parser {parser_ms:.1f} ms, fast path {fast_ms:.1f} ms.").format(
+        total=len(bloques), mismatches=diferencias, parser_ms=tiempo_parser * 1000, fast_ms=tiempo_crudo * 1000)
+    logging.info(resumen)
+    print(f"  {resumen}")
+    return diferencias
+
+def configurar_proceso_auxiliar(configuracion, idioma):
+    """
+    Aplica en un proceso de un pool el idioma, la configuración y el registro del proceso principal,
+    que no se cargan al importar el módulo en los procesos "spawn"/"forkserver" (ES_PROCESO_AUXILIAR).
+    """
+    global ZONA_HORARIA_DESTINO, SELECTED_LANG_CODE, LANG_MESSAGES
+    SELECTED_LANG_CODE = idioma
+    LANG_MESSAGES = MESSAGES[idioma]
+    SETTINGS.update(configuracion)
+    SETTINGS["log_background"] = False # Los procesos de un pool terminan sin ejecutar atexit: nadie vaciaría la cola.
+    logging.basicConfig(level=logging.INFO, format=FORMATO_REGISTRO) # Sin efecto con "fork" (ya hay handlers).
+    configurar_registro()
+    ZONA_HORARIA_DESTINO = resolver_zona_horaria(SETTINGS["timezone"])
+
+REGLAS_REINDEXADO = None # Reglas de spam compiladas por el proceso principal para _metadatos_de_archivo_eml.
+
+def _iniciar_proceso_reindexado(reglas, configuracion=None, idioma=None):
+    """
+    Inicializador de los procesos del reindexado: reciben las reglas de spam ya compiladas y, en un
+    proceso del pool, la configuración y el idioma del proceso principal.
+    """
+    global REGLAS_REINDEXADO
+    if configuracion is not None:
+        configurar_proceso_auxiliar(configuracion, idioma)
+    REGLAS_REINDEXADO = reglas
+
+def _metadatos_de_archivo_eml(argumentos):
+    """
+    Trabajo de un proceso del reindexado: genera los metadatos de un .eml en disco.
+    Retorna (metadatos, None) o (None, descripción del error).
+    """
+    user_email, ruta_eml = argumentos
+    try:
+        msg = leer_encabezados_eml(ruta_eml)
+        metadatos = guardar_correo_y_obtener_metadata(
+            user_email, None, msg, obtener_hash_encabezados(msg), *REGLAS_REINDEXADO, archivo_existente=ruta_eml)
+        return metadatos, None
+    except Exception as e:
+        return None, str(e)
+    finally:
+        REGISTRO_FECHAS_CRUDAS.vaciar() # Los procesos del pool terminan sin ejecutar atexit.
+
+def listar_archivos_eml():
+    """
+    Retorna [(user_email, ruta_eml, ruta_relativa, mtime_ns, tamaño)] de los .eml en EMAILS_BASE_DIR,
+    ordenados por cuenta y nombre.
+    """
+    archivos = []
+    if not os.path.isdir(EMAILS_BASE_DIR):
+        return archivos
+    for user_email in sorted(os.listdir(EMAILS_BASE_DIR)):
+        user_dir = os.path.join(EMAILS_BASE_DIR, user_email)
+        if not os.path.isdir(user_dir):
+            continue
+        with os.scandir(user_dir) as entradas:
+            for entrada in sorted(entradas, key=lambda e: e.name):
+                if entrada.name.endswith(EXTENSIONES_EML) and entrada.is_file():
+                    estado = entrada.stat()
+                    archivos.append((user_email, entrada.path, os.path.relpath(entrada.path, EMAILS_BASE_DIR), estado.st_mtime_ns, estado.st_size))
+    return archivos
+
+def cargar_estado_reindexado(firma_reglas):
+    """
+    Carga el estado del último reindexado: {ruta_relativa: {"mtime_ns", "size", "metadata"}}.
+    Si las reglas de spam cambiaron desde entonces (`firma_reglas`), retorna {}: todos se vuelven a analizar.
+    """
+    try:
+        with open(REINDEX_STATE_FILE, 'r', encoding='utf-8') as f:
+            estado = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    if not isinstance(estado, dict) or estado.get("spam_rules") != firma_reglas:
+        return {}
+    return estado.get("files", {})
+
+def mapa_inodos_blobs():
+    """
+    Retorna {(st_dev, st_ino): clave} de los archivos de BLOBS_DIR, para reconocer los .eml que son
+    enlaces a un blob.
+    """
+    mapa = {}
+    if not os.path.isdir(BLOBS_DIR):
+        return mapa
+    for subdirectorio in os.scandir(BLOBS_DIR):
+        if subdirectorio.is_dir():
+            for entrada in os.scandir(subdirectorio.path):
+                if entrada.is_file():
+                    estado = os.stat(entrada.path)
+                    mapa[(estado.st_dev, estado.st_ino)] = entrada.name.split(".", 1)[0]
+    return mapa
+
+def reconstruir_metadatos_desde_eml(procesos=None):
+    """
+    Regenera los metadatos a partir de los archivos .eml guardados en EMAILS_BASE_DIR.
+    Los archivos cuyo mtime y tamaño no cambiaron desde el último reindexado reutilizan sus
+    metadatos; los demás se parsean en paralelo con un pool de procesos.
+    El hash se calcula con los encabezados del archivo, que son los mismos que devuelve TOP.
+    """
+    logging.info(LANG_MESSAGES.get('extracting_metadata_from_eml', "Extracting metadata from found .eml files..."))
+    print(f"  {LANG_MESSAGES.get('extracting_metadata_from_eml', 'Extracting metadata from found .eml files...')}")
+    reglas = load_spam_config()
+    firma_reglas = json.loads(json.dumps(REGLAS_SPAM_COMPILADAS[0])) # Lista de listas, igual que en el archivo de estado.
+    estado_previo = cargar_estado_reindexado(firma_reglas)
+    archivos = listar_archivos_eml()
+    logging.info(LANG_MESSAGES.get('found_eml_files', "Found {count} .eml file(s).").format(count=len(archivos)))
+    estado_nuevo = {}
+    pendientes = []
+    for user_email, ruta_eml, ruta_relativa, mtime_ns, tamano in archivos:
+        previo = estado_previo.get(ruta_relativa)
+        if previo and previo.get("mtime_ns") == mtime_ns and previo.get("size") == tamano and previo.get("metadata"):
+            estado_nuevo[ruta_relativa] = previo
+        else:
+            pendientes.append((user_email, ruta_eml, ruta_relativa, mtime_ns, tamano))
+
+    procesos = procesos or SETTINGS["reindex_workers"] or os.cpu_count() or 1
+    trabajos = [(user_email, ruta_eml) for user_email, ruta_eml, _, _, _ in pendientes]
+    fallidos = 0
+    if procesos > 1 and len(trabajos) > 1:
+        REGISTRO_FECHAS_CRUDAS.vaciar() # Que los procesos hijos no hereden líneas pendientes.
+        with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_proceso_reindexado, initargs=(reglas, dict(SETTINGS), SELECTED_LANG_CODE)) as executor:
+            resultados = list(executor.map(_metadatos_de_archivo_eml, trabajos, chunksize=max(1, min(256, len(trabajos) // (procesos * 4)))))
+    else:
+        _iniciar_proceso_reindexado(reglas)
+        resultados = [_metadatos_de_archivo_eml(trabajo) for trabajo in trabajos]
+    inodos_blobs = mapa_inodos_blobs()
+    for (_, ruta_eml, ruta_relativa, mtime_ns, tamano), (metadatos, error) in zip(pendientes, resultados):
+        if metadatos:
+            if inodos_blobs:
+                estado = os.stat(ruta_eml)
+                clave_blob = inodos_blobs.get((estado.st_dev, estado.st_ino))
+                if clave_blob:
+                    metadatos["blob"] = clave_blob # El .eml es un enlace a ese blob del almacén de contenido.
+            estado_nuevo[ruta_relativa] = {"mtime_ns": mtime_ns, "size": tamano, "metadata": metadatos}
+        else:
+            fallidos += 1
+            logging.error(LANG_MESSAGES.get('metadata_extraction_failed', "Failed to extract metadata for '{filename}'. Check logs for details.").format(filename=ruta_eml) + f" Details: {error}")
+
+    try:
+        escribir_archivo_atomico(REINDEX_STATE_FILE, lambda f: json.dump({"spam_rules": firma_reglas, "files": estado_nuevo}, f, ensure_ascii=False))
+    except Exception as e:
+        logging.error(LANG_MESSAGES.get('error_saving_metadata', "Error saving metadata to '{path}': {error}").format(path=REINDEX_STATE_FILE, error=e))
+    logging.info(LANG_MESSAGES.get('reindex_summary', "Reindex: {total} .eml file(s), {unchanged} unchanged, {parsed} parsed with {workers} process(es), {failed} failed.").format(
+        total=len(archivos), unchanged=len(archivos) - len(pendientes), parsed=len(pendientes) - fallidos, workers=procesos, failed=fallidos))
+    return [estado_nuevo[ruta_relativa]["metadata"] for _, _, ruta_relativa, _, _ in archivos if ruta_relativa in estado_nuevo]
+
+def reindexar(procesos=None):
+    """
+    Modo --reindex: reconstruye el almacén de metadatos configurado a partir de los .eml en disco.
+    """
+    almacen = crear_almacen_metadatos()
+    registros = reconstruir_metadatos_desde_eml(procesos)
+    almacen.reemplazar(registros)
+    if almacen.nombre != "json" and SETTINGS["export_viewer_json"]:
+        almacen.exportar_json()
+    almacen.cerrar()
+    print(f"  {LANG_MESSAGES.get('reindex_finished', 'Metadata store rebuilt with {count} record(s).').format(count=len(registros))}")
+
+def recuperar_metadatos_corruptos():
+    """
+    Aparta el emails_metadata.json ilegible y reconstruye los metadatos desde los .eml en disco,
+    para no tener que volver a descargar los buzones completos.
+    """
+    ruta_corrupta = f"{METADATA_FILE}.corrupt-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    try:
+        os.replace(METADATA_FILE, ruta_corrupta)
+    except OSError:
+        ruta_corrupta = METADATA_FILE
+    logging.warning(LANG_MESSAGES.get('metadata_recovering_from_eml', "Metadata file was unreadable (kept as '{path}'). Rebuilding metadata from the .eml files on disk...").format(path=ruta_corrupta))
+    registros = reconstruir_metadatos_desde_eml()
+    try:
+        guardar_metadatos_consolidados(registros)
+    except Exception:
+        pass # Ya registrado; los registros reconstruidos sirven igual para este ciclo y se guardan con el siguiente agregar().
+    return registros
+
+def cargar_metadatos_existentes():
+    """
+    Carga los metadatos de correos electrónicos existentes desde el archivo JSON.
+    Retorna una lista de metadatos y un set de hashes de correos existentes.
+    """
+    all_emails_metadata = []
+    existing_hashes = set()
+    logging.info(LANG_MESSAGES.get('loading_existing_metadata', "Attempting to load existing metadata from '{path}'...").format(path=METADATA_FILE))
+    if os.path.exists(METADATA_FILE):
+        try:
+            with open(METADATA_FILE, 'r', encoding='utf-8') as f:
                 data = json.load(f) # Carga el contenido JSON del archivo.
                 if isinstance(data, dict) and "emails" in data and isinstance(data["emails"], list):
                     all_emails_metadata = data["emails"]
@@ -761,42 +2453,1373 @@ def cargar_metadatos_existentes():
                     logging.warning(LANG_MESSAGES.get('metadata_file_bad_format', "WARNING: Metadata file '{path}' does not have the expected format. Proceeding as if it's a new file.").format(path=METADATA_FILE))
                     pass
         except json.JSONDecodeError:
-            logging.error(LANG_MESSAGES.get('json_decode_error_metadata', "ERROR: Could not decode JSON file '{path}'. File might be corrupt or empty. Proceeding as if it's a new file.").format(path=METADATA_FILE))
-            pass
+            logging.error(LANG_MESSAGES.get('json_decode_error_metadata', "ERROR: Could not decode JSON file '{path}'. File might be corrupt or empty.").format(path=METADATA_FILE))
+            all_emails_metadata = recuperar_metadatos_corruptos()
+            existing_hashes = {email_entry["hash"] for email_entry in all_emails_metadata}
         except Exception as e:
             logging.error(LANG_MESSAGES.get('unexpected_error_loading_metadata', "ERROR: Unexpected error loading metadata from '{path}'. Details: {e}. Proceeding as if it's a new file.").format(path=METADATA_FILE, e=e))
             pass
     else:
-        logging.info(LANG_MESSAGES.get('metadata_file_not_found', "Metadata file '{path}' not found. A new one will be created after the verification cycle.").format(path=METADATA_FILE))
-        pass
-    return all_emails_metadata, existing_hashes
+        logging.info(LANG_MESSAGES.get('metadata_file_not_found', "Metadata file '{path}' not found. A new one will be created after the verification cycle.").format(path=METADATA_FILE))
+        pass
+    return all_emails_metadata, existing_hashes
+
+def guardar_metadatos_consolidados(all_emails_metadata):
+    """
+    Guarda la lista consolidada de metadatos de correos electrónicos en un archivo JSON.
+    Si no se puede escribir, vuelve a lanzar la excepción: quien llama no debe dar los registros por guardados.
+    """
+    logging.info(LANG_MESSAGES.get('saving_metadata_records', "Saving {count} metadata records to '{path}'...").format(count=len(all_emails_metadata), path=METADATA_FILE))
+    try:
+        escribir_archivo_atomico(METADATA_FILE, lambda f: json.dump({"emails": all_emails_metadata, "total_emails": len(all_emails_metadata)}, f, ensure_ascii=False, indent=2))
+        logging.info(LANG_MESSAGES.get('metadata_saved_successfully', "Metadata saved successfully to '{path}'.").format(path=METADATA_FILE))
+        print(f"  {LANG_MESSAGES.get('metadata_saved_successfully', 'Metadata updated and saved to {path}.').format(path=METADATA_FILE)}")
+    except Exception as e:
+        logging.error(LANG_MESSAGES.get('error_saving_metadata', "Error saving metadata to '{path}': {error}").format(path=METADATA_FILE, error=e))
+        print(f"  [ERROR] {LANG_MESSAGES.get('error_saving_consolidated_metadata', 'Could not save consolidated metadata: {error}').format(error=e)}")
+        raise
+
+# --- Índice compacto de hashes ("dedup_index": "compact") ---
+class IndiceHashesCompacto:
+    """
+    Conjunto de hashes SHA-256 guardados como 32 bytes en una tabla de direccionamiento abierto
+    dentro de un archivo mapeado en memoria, con un filtro de Bloom opcional delante de la tabla.
+    Sustituye al set de cadenas hexadecimales (~150 bytes por hash) en los almacenes jsonl y sqlite.
+
+    Formato del archivo: encabezado, filtro de Bloom y tabla. Un hueco con ceros está libre.
+    La firma del encabezado identifica el estado del almacén con el que coincide el índice; si no
+    coincide al abrirlo (p. ej. tras un corte entre el almacén y el índice), se reconstruye.
+    Los hashes agregados durante el ciclo quedan en memoria hasta consolidar(), de modo que
+    liberar_hashes() pueda retirarlos; los ya consolidados no se pueden retirar.
+    """
+    MAGICO = b"P3HASH01"
+    FORMATO_ENCABEZADO = "<8sQQQI" # mágico, capacidad, cantidad, bits del filtro de Bloom, funciones del filtro.
+    POSICION_FIRMA = 64
+    TAMANO_FIRMA = 64
+    TAMANO_ENCABEZADO = 128
+    TAMANO_HASH = 32
+    HUECO_VACIO = bytes(TAMANO_HASH)
+    CARGA_MAXIMA = 0.75
+    CAPACIDAD_MINIMA = 1024
+
+    def __init__(self, ruta, archivo, mapa):
+        self.ruta = ruta
+        self.archivo = archivo
+        self.mapa = mapa
+        _, self.capacidad, self.cantidad, self.bits_bloom, self.funciones_bloom = struct.unpack_from(self.FORMATO_ENCABEZADO, mapa, 0)
+        self.inicio_tabla = self.TAMANO_ENCABEZADO + self.bits_bloom // 8
+        self.mascara = self.capacidad - 1
+        self.pendientes = set()
+
+    @classmethod
+    def abrir(cls, ruta, firma):
+        """
+        Mapea un índice existente. Retorna None si no existe, está dañado o su firma no coincide.
+        """
+        try:
+            archivo = open(ruta, 'r+b')
+        except OSError:
+            return None
+        try:
+            mapa = mmap.mmap(archivo.fileno(), 0)
+        except (OSError, ValueError):
+            archivo.close()
+            return None
+        if len(mapa) < cls.TAMANO_ENCABEZADO or mapa[:8] != cls.MAGICO:
+            mapa.close()
+            archivo.close()
+            return None
+        indice = cls(ruta, archivo, mapa)
+        if (not indice.capacidad or indice.capacidad & indice.mascara or indice.bits_bloom % 8
+                or len(mapa) != indice.inicio_tabla + indice.capacidad * cls.TAMANO_HASH or indice.firma() != firma):
+            indice.cerrar()
+            return None
+        return indice
+
+    @staticmethod
+    def empaquetar(hashes):
+        """
+        Convierte un iterable de hashes hexadecimales en digests de 32 bytes consecutivos.
+        """
+        digests = bytearray()
+        for hash_correo in hashes:
+            digests += bytes.fromhex(hash_correo)
+        return digests
+
+    @classmethod
+    def construir(cls, ruta, digests, firma):
+        """
+        Crea el índice a partir de digests empaquetados y lo coloca en ruta de forma atómica.
+        """
+        cantidad = len(digests) // cls.TAMANO_HASH
+        capacidad = cls.CAPACIDAD_MINIMA
+        while capacidad * cls.CARGA_MAXIMA < cantidad * 1.25: # Margen para crecer varios ciclos sin reconstruir.
+            capacidad *= 2
+        bits_por_hash = max(0, SETTINGS["dedup_bloom_bits_per_hash"])
+        bits_bloom = -(-int(capacidad * cls.CARGA_MAXIMA * bits_por_hash) // 8) * 8
+        funciones_bloom = max(1, round(bits_por_hash * math.log(2))) if bits_bloom else 0
+        tamano = cls.TAMANO_ENCABEZADO + bits_bloom // 8 + capacidad * cls.TAMANO_HASH
+        directorio = os.path.dirname(ruta) or "."
+        descriptor, ruta_temporal = tempfile.mkstemp(prefix=f".{os.path.basename(ruta)}.", suffix=".tmp", dir=directorio)
+        try:
+            with os.fdopen(descriptor, 'r+b') as archivo:
+                archivo.truncate(tamano)
+                with mmap.mmap(archivo.fileno(), tamano) as mapa:
+                    struct.pack_into(cls.FORMATO_ENCABEZADO, mapa, 0, cls.MAGICO, capacidad, 0, bits_bloom, funciones_bloom)
+                    indice = cls(ruta_temporal, None, mapa)
+                    for inicio in range(0, len(digests), cls.TAMANO_HASH):
+                        indice._insertar(bytes(digests[inicio:inicio + cls.TAMANO_HASH]))
+                    indice._escribir_encabezado(firma)
+                    mapa.flush()
+                if SETTINGS["fsync"]:
+                    os.fsync(archivo.fileno())
+            os.replace(ruta_temporal, ruta)
+        except BaseException:
+            try:
+                os.remove(ruta_temporal)
+            except OSError:
+                pass
+            raise
+        logging.info(LANG_MESSAGES.get('dedup_index_built', "Compact dedup index '{path}' built with {count} hash(es).").format(path=ruta, count=indice.cantidad))
+        return cls.abrir(ruta, firma)
+
+    def firma(self):
+        return bytes(self.mapa[self.POSICION_FIRMA:self.POSICION_FIRMA + self.TAMANO_FIRMA]).rstrip(b"\0").decode('utf-8', errors='replace')
+
+    def _escribir_encabezado(self, firma):
+        struct.pack_into(self.FORMATO_ENCABEZADO, self.mapa, 0, self.MAGICO, self.capacidad, self.cantidad, self.bits_bloom, self.funciones_bloom)
+        self.mapa[self.POSICION_FIRMA:self.POSICION_FIRMA + self.TAMANO_FIRMA] = firma.encode('utf-8')[:self.TAMANO_FIRMA].ljust(self.TAMANO_FIRMA, b"\0")
+
+    def _bits_bloom(self, digest):
+        # Doble hashing sobre dos fragmentos del digest, que ya es uniforme.
+        h1 = int.from_bytes(digest[8:16], 'little')
+        h2 = int.from_bytes(digest[16:24], 'little') | 1
+        return [(h1 + i * h2) % self.bits_bloom for i in range(self.funciones_bloom)]
+
+    def _buscar(self, digest):
+        """
+        Retorna (encontrado, desplazamiento del hueco que ocupa o que ocuparía el digest).
+        """
+        mapa = self.mapa
+        posicion = int.from_bytes(digest[:8], 'little') & self.mascara
+        while True:
+            desplazamiento = self.inicio_tabla + posicion * self.TAMANO_HASH
+            hueco = mapa[desplazamiento:desplazamiento + self.TAMANO_HASH]
+            if hueco == digest:
+                return True, desplazamiento
+            if hueco == self.HUECO_VACIO:
+                return False, desplazamiento
+            posicion = (posicion + 1) & self.mascara
+
+    def _insertar(self, digest):
+        encontrado, desplazamiento = self._buscar(digest)
+        if encontrado:
+            return
+        self.mapa[desplazamiento:desplazamiento + self.TAMANO_HASH] = digest
+        if self.bits_bloom:
+            for bit in self._bits_bloom(digest):
+                self.mapa[self.TAMANO_ENCABEZADO + (bit >> 3)] |= 1 << (bit & 7)
+        self.cantidad += 1
+
+    def __contains__(self, hash_correo):
+        if hash_correo in self.pendientes:
+            return True
+        try:
+            digest = bytes.fromhex(hash_correo)
+        except ValueError:
+            return False
+        if len(digest) != self.TAMANO_HASH:
+            return False
+        if self.bits_bloom:
+            base = self.TAMANO_ENCABEZADO
+            for bit in self._bits_bloom(digest):
+                if not self.mapa[base + (bit >> 3)] & (1 << (bit & 7)):
+                    return False
+        return self._buscar(digest)[0]
+
+    def __len__(self):
+        return self.cantidad + len(self.pendientes)
+
+    def add(self, hash_correo):
+        self.pendientes.add(hash_correo)
+
+    def update(self, hashes):
+        self.pendientes.update(hashes)
+
+    def discard(self, hash_correo):
+        self.pendientes.discard(hash_correo)
+
+    def consolidar(self, firma):
+        """
+        Pasa los hashes pendientes al archivo y registra la firma del almacén ya actualizado.
+        Si la tabla supera la carga máxima, se reconstruye con el doble de capacidad.
+        Retorna el índice a usar en adelante (el mismo objeto o uno nuevo).
+        """
+        if not self.pendientes and self.firma() == firma:
+            return self
+        nuevos = [bytes.fromhex(hash_correo) for hash_correo in self.pendientes]
+        if (self.cantidad + len(nuevos)) > self.capacidad * self.CARGA_MAXIMA:
+            digests = bytearray()
+            for desplazamiento in range(self.inicio_tabla, len(self.mapa), self.TAMANO_HASH):
+                hueco = self.mapa[desplazamiento:desplazamiento + self.TAMANO_HASH]
+                if hueco != self.HUECO_VACIO:
+                    digests += hueco
+            for digest in nuevos:
+                digests += digest
+            self.cerrar() # En Windows no se puede reemplazar un archivo mapeado.
+            return self.construir(self.ruta, digests, firma)
+        self._escribir_encabezado("") # Si el proceso se interrumpe a mitad, el índice no coincidirá con el almacén.
+        self.mapa.flush()
+        for digest in nuevos:
+            self._insertar(digest)
+        self._escribir_encabezado(firma)
+        self.mapa.flush()
+        self.pendientes.clear()
+        return self
+
+    def cerrar(self):
+        if self.mapa is not None:
+            self.mapa.close()
+            self.mapa = None
+        if self.archivo is not None:
+            self.archivo.close()
+            self.archivo = None
+
+def obtener_ruta_indice_hashes(ruta_almacen):
+    return f"{ruta_almacen}.hashes"
+
+def crear_conjunto_hashes(ruta_almacen, hashes, firma):
+    """
+    Crea el conjunto de hashes de un almacén: un set o, con "dedup_index": "compact",
+    un IndiceHashesCompacto persistido junto al almacén.
+    """
+    if SETTINGS["dedup_index"] != "compact":
+        return set(hashes)
+    digests = IndiceHashesCompacto.empaquetar(hashes)
+    try:
+        return IndiceHashesCompacto.construir(obtener_ruta_indice_hashes(ruta_almacen), digests, firma)
+    except OSError as e:
+        logging.error(LANG_MESSAGES.get('dedup_index_error', "Could not use the compact dedup index for '{path}': {error}. Using an in-memory set.").format(path=ruta_almacen, error=e))
+        return {digests[inicio:inicio + IndiceHashesCompacto.TAMANO_HASH].hex() for inicio in range(0, len(digests), IndiceHashesCompacto.TAMANO_HASH)}
+
+def abrir_conjunto_hashes(ruta_almacen, firma):
+    """
+    Retorna el índice compacto persistido si coincide con la firma del almacén, o None.
+    """
+    if SETTINGS["dedup_index"] != "compact":
+        return None
+    return IndiceHashesCompacto.abrir(obtener_ruta_indice_hashes(ruta_almacen), firma)
+
+def consolidar_conjunto_hashes(hashes, firma):
+    """
+    Persiste los hashes agregados a un índice compacto. Retorna el conjunto a usar en adelante.
+    """
+    if not isinstance(hashes, IndiceHashesCompacto):
+        return hashes
+    try:
+        return hashes.consolidar(firma)
+    except OSError as e:
+        logging.error(LANG_MESSAGES.get('dedup_index_error', "Could not use the compact dedup index for '{path}': {error}. Using an in-memory set.").format(path=hashes.ruta, error=e))
+        return None # El almacén reconstruirá el conjunto en el próximo ciclo.
+
+def cerrar_conjunto_hashes(hashes):
+    if isinstance(hashes, IndiceHashesCompacto):
+        hashes.cerrar()
+
+# --- Almacenes de metadatos (backend configurable con "metadata_backend" en settings.json) ---
+class AlmacenMetadatos:
+    """
+    Interfaz común de los almacenes de metadatos.
+    cargar_hashes() retorna el set de hashes registrados (se reutiliza entre ciclos si nadie más
+    modificó el almacén), agregar() persiste solo los registros nuevos (y lanza una excepción si no
+    pudo hacerlo) y exportar_json() genera emails_metadata.json con la estructura que espera MailEML Viewer.
+    """
+    nombre = ""
+
+    def cargar_hashes(self):
+        raise NotImplementedError
+
+    def agregar(self, registros):
+        raise NotImplementedError
+
+    def iterar_registros(self):
+        raise NotImplementedError
+
+    def reemplazar(self, registros):
+        """
+        Sustituye todo el contenido del almacén (usado por el reindexado).
+        """
+        raise NotImplementedError
+
+    def total(self):
+        raise NotImplementedError
+
+    def cerrar(self):
+        pass
+
+    def importar_json_heredado(self):
+        """
+        Importa una sola vez el emails_metadata.json existente si el almacén está vacío.
+        """
+        if self.total() > 0 or not os.path.exists(METADATA_FILE):
+            return
+        registros, _ = cargar_metadatos_existentes()
+        if registros:
+            self.agregar(registros)
+            logging.info(LANG_MESSAGES.get('metadata_imported_from_json', "{count} record(s) imported from '{path}' into the '{backend}' metadata store.").format(count=len(registros), path=METADATA_FILE, backend=self.nombre))
+
+    def exportar_json(self, ruta=METADATA_FILE):
+        """
+        Escribe los registros en formato {"emails": [...], "total_emails": n} registro por registro,
+        sin cargar todo el almacén en memoria.
+        """
+        total = 0
+        def escribir(f):
+            nonlocal total
+            f.write('{"emails": [')
+            for registro in self.iterar_registros():
+                f.write(",\n  " if total else "\n  ")
+                f.write(json.dumps(registro, ensure_ascii=False))
+                total += 1
+            f.write(f'\n], "total_emails": {total}}}\n')
+        try:
+            escribir_archivo_atomico(ruta, escribir)
+            logging.info(LANG_MESSAGES.get('metadata_exported', "{count} metadata record(s) exported to '{path}'.").format(count=total, path=ruta))
+        except Exception as e:
+            logging.error(LANG_MESSAGES.get('error_saving_metadata', "Error saving metadata to '{path}': {error}").format(path=ruta, error=e))
+
+class AlmacenMetadatosJSON(AlmacenMetadatos):
+    """
+    Almacén original: todo emails_metadata.json en memoria. Se recarga en cada ciclo y solo
+    se reescribe cuando hay registros nuevos.
+    """
+    nombre = "json"
+
+    def __init__(self):
+        self.registros = []
+
+    def cargar_hashes(self):
+        self.registros, existing_hashes = cargar_metadatos_existentes()
+        return existing_hashes
+
+    def agregar(self, registros):
+        if registros:
+            guardar_metadatos_consolidados(self.registros + list(registros))
+            self.registros.extend(registros)
+
+    def iterar_registros(self):
+        return iter(self.registros)
+
+    def reemplazar(self, registros):
+        registros = list(registros)
+        guardar_metadatos_consolidados(registros)
+        self.registros = registros
+
+    def total(self):
+        return len(self.registros)
+
+    def exportar_json(self, ruta=METADATA_FILE):
+        if ruta != METADATA_FILE:
+            super().exportar_json(ruta)
+
+class AlmacenMetadatosJSONL(AlmacenMetadatos):
+    """
+    Registro de solo-anexado (un registro JSON por línea) con compactación periódica.
+    Agregar registros cuesta solo la escritura de las líneas nuevas.
+    """
+    nombre = "jsonl"
+
+    def __init__(self, ruta=METADATA_LOG_FILE):
+        self.ruta = ruta
+        self.hashes = None
+        self.lineas = 0 # Líneas del archivo, incluidas las duplicadas o ilegibles.
+        self.firma = None # (mtime, tamaño) tras la última lectura o escritura propia.
+
+    def _firma_actual(self):
+        try:
+            estado = os.stat(self.ruta)
+            return estado.st_mtime_ns, estado.st_size
+        except FileNotFoundError:
+            return None
+
+    def _termina_sin_salto_de_linea(self):
+        try:
+            with open(self.ruta, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) != b"\n"
+        except OSError:
+            return False # Archivo inexistente o vacío.
+
+    def cargar_hashes(self):
+        firma = self._firma_actual()
+        if self.hashes is not None and firma == self.firma:
+            return self.hashes # Nadie modificó el archivo desde el ciclo anterior.
+        cerrar_conjunto_hashes(self.hashes)
+        self.firma = firma
+        self.hashes = abrir_conjunto_hashes(self.ruta, str(firma))
+        if self.hashes is not None:
+            self.lineas = len(self.hashes) # El índice persistido coincide con el archivo actual.
+        else:
+            self.lineas = 0
+            def hashes_del_registro():
+                for registro in self.iterar_registros():
+                    self.lineas += 1
+                    if "hash" in registro:
+                        yield registro["hash"]
+            self.hashes = crear_conjunto_hashes(self.ruta, hashes_del_registro(), str(firma))
+        logging.info(LANG_MESSAGES.get('existing_metadata_loaded', "Existing metadata loaded successfully. Found {count} records.").format(count=len(self.hashes)))
+        return self.hashes
+
+    def agregar(self, registros):
+        if not registros:
+            return
+        if self.hashes is None:
+            self.cargar_hashes()
+        try:
+            with open(self.ruta, 'a', encoding='utf-8') as f:
+                if self._termina_sin_salto_de_linea():
+                    f.write("\n") # Aísla una última línea truncada para no corromper el primer registro nuevo.
+                for registro in registros:
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                f.flush()
+                if SETTINGS["fsync"]:
+                    os.fsync(f.fileno())
+        except BaseException:
+            # El conjunto en memoria incluye los hashes reservados en el ciclo, que no llegaron al archivo:
+            # el siguiente cargar_hashes() lo vuelve a leer para que los diarios se recuperen.
+            cerrar_conjunto_hashes(self.hashes)
+            self.hashes = None
+            raise
+        # Solo tras una escritura completa: si falló, los hashes no deben darse por registrados.
+        self.hashes.update(registro["hash"] for registro in registros)
+        self.lineas += len(registros)
+        self.firma = self._firma_actual()
+        if self.lineas > len(self.hashes) * SETTINGS["jsonl_compaction_ratio"]:
+            self.compactar()
+        else:
+            self.hashes = consolidar_conjunto_hashes(self.hashes, str(self.firma))
+
+    def iterar_registros(self):
+        if not os.path.exists(self.ruta):
+            return
+        with open(self.ruta, 'r', encoding='utf-8') as f:
+            for numero_linea, linea in enumerate(f, 1):
+                if not linea.strip():
+                    continue
+                try:
+                    yield json.loads(linea)
+                except json.JSONDecodeError:
+                    # Una línea truncada (p. ej. por un corte durante la escritura) no invalida el resto del registro.
+                    logging.warning(LANG_MESSAGES.get('metadata_log_bad_line', "WARNING: Ignoring unreadable line {line_num} in '{path}'.").format(line_num=numero_linea, path=self.ruta))
+
+    def reemplazar(self, registros):
+        escribir_archivo_atomico(self.ruta, lambda f: f.writelines(json.dumps(registro, ensure_ascii=False) + "\n" for registro in registros))
+        self.lineas = len(registros)
+        self.firma = self._firma_actual()
+        cerrar_conjunto_hashes(self.hashes)
+        self.hashes = crear_conjunto_hashes(self.ruta, (registro["hash"] for registro in registros), str(self.firma))
+
+    def compactar(self):
+        """
+        Reescribe el registro dejando una sola línea por hash (la última) y sin líneas ilegibles.
+        """
+        ultimos = {}
+        for registro in self.iterar_registros():
+            if "hash" in registro:
+                ultimos[registro["hash"]] = registro
+        escribir_archivo_atomico(self.ruta, lambda f: f.writelines(json.dumps(registro, ensure_ascii=False) + "\n" for registro in ultimos.values()))
+        self.lineas = len(ultimos)
+        self.firma = self._firma_actual()
+        cerrar_conjunto_hashes(self.hashes)
+        self.hashes = crear_conjunto_hashes(self.ruta, ultimos, str(self.firma))
+        logging.info(LANG_MESSAGES.get('metadata_log_compacted', "Metadata log '{path}' compacted to {count} record(s).").format(path=self.ruta, count=len(ultimos)))
+
+    def total(self):
+        return len(self.cargar_hashes())
+
+    def cerrar(self):
+        cerrar_conjunto_hashes(self.hashes)
+        self.hashes = None
+
+class AlmacenMetadatosSQLite(AlmacenMetadatos):
+    """
+    Almacén SQLite con índice único sobre el hash. Los registros nuevos se insertan en una
+    sola transacción por ciclo.
+    """
+    nombre = "sqlite"
+
+    def __init__(self, ruta=METADATA_DB_FILE):
+        self.ruta = ruta
+        self.conexion = sqlite3.connect(ruta)
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.execute(f"PRAGMA synchronous={'FULL' if SETTINGS['fsync'] else 'NORMAL'}")
+        self.conexion.execute(
+            "CREATE TABLE IF NOT EXISTS emails ("
+            " id INTEGER PRIMARY KEY,"
+            " hash TEXT NOT NULL UNIQUE,"
+            " recipient TEXT,"
+            " fecha_iso TEXT,"
+            " registro TEXT NOT NULL)")
+        self.conexion.commit()
+        self.hashes = None
+        self.version_datos = None
+
+    def _version_actual(self):
+        # data_version solo cambia cuando otra conexión modifica la base de datos.
+        return self.conexion.execute("PRAGMA data_version").fetchone()[0]
+
+    def _firma_persistente(self):
+        # Identifica el contenido entre ejecuciones para reutilizar el índice compacto de hashes.
+        total, ultimo_id = self.conexion.execute("SELECT COUNT(*), MAX(id) FROM emails").fetchone()
+        return f"{total}:{ultimo_id}"
+
+    def cargar_hashes(self):
+        version = self._version_actual()
+        if self.hashes is not None and version == self.version_datos:
+            return self.hashes
+        cerrar_conjunto_hashes(self.hashes)
+        firma = self._firma_persistente()
+        self.hashes = abrir_conjunto_hashes(self.ruta, firma)
+        if self.hashes is None:
+            self.hashes = crear_conjunto_hashes(self.ruta, (fila[0] for fila in self.conexion.execute("SELECT hash FROM emails")), firma)
+        self.version_datos = version
+        logging.info(LANG_MESSAGES.get('existing_metadata_loaded', "Existing metadata loaded successfully. Found {count} records.").format(count=len(self.hashes)))
+        return self.hashes
+
+    def agregar(self, registros):
+        if not registros:
+            return
+        try:
+            with self.conexion:
+                self.conexion.executemany(
+                    "INSERT OR IGNORE INTO emails (hash, recipient, fecha_iso, registro) VALUES (?, ?, ?, ?)",
+                    [(r["hash"], r.get("recipient"), r.get("fecha_iso"), json.dumps(r, ensure_ascii=False)) for r in registros])
+        except BaseException:
+            # Los hashes reservados en el ciclo no llegaron a la base de datos (ver AlmacenMetadatosJSONL.agregar).
+            cerrar_conjunto_hashes(self.hashes)
+            self.hashes = None
+            raise
+        if self.hashes is not None:
+            self.hashes.update(r["hash"] for r in registros)
+            self.hashes = consolidar_conjunto_hashes(self.hashes, self._firma_persistente())
+
+    def iterar_registros(self):
+        for (registro,) in self.conexion.execute("SELECT registro FROM emails ORDER BY id"):
+            yield json.loads(registro)
+
+    def reemplazar(self, registros):
+        with self.conexion:
+            self.conexion.execute("DELETE FROM emails")
+            self.conexion.executemany(
+                "INSERT OR IGNORE INTO emails (hash, recipient, fecha_iso, registro) VALUES (?, ?, ?, ?)",
+                [(r["hash"], r.get("recipient"), r.get("fecha_iso"), json.dumps(r, ensure_ascii=False)) for r in registros])
+        cerrar_conjunto_hashes(self.hashes)
+        self.hashes = None
+        try:
+            os.remove(obtener_ruta_indice_hashes(self.ruta)) # Los id se reinician y la firma podría repetirse.
+        except FileNotFoundError:
+            pass
+
+    def total(self):
+        return self.conexion.execute("SELECT COUNT(*) FROM emails").fetchone()[0]
+
+    def cerrar(self):
+        cerrar_conjunto_hashes(self.hashes)
+        self.hashes = None
+        self.conexion.close()
+
+def crear_almacen_metadatos():
+    """
+    Crea el almacén de metadatos indicado por "metadata_backend" en settings.json.
+    Los almacenes jsonl y sqlite importan emails_metadata.json la primera vez que se usan.
+    """
+    backend = SETTINGS["metadata_backend"]
+    if backend == "sqlite":
+        almacen = AlmacenMetadatosSQLite()
+    elif backend == "jsonl":
+        almacen = AlmacenMetadatosJSONL()
+    else:
+        if SETTINGS["dedup_index"] == "compact":
+            logging.warning(LANG_MESSAGES.get('dedup_index_requires_store', "The compact dedup index requires the 'jsonl' or 'sqlite' metadata backend. Using an in-memory set."))
+        return AlmacenMetadatosJSON()
+    almacen.importar_json_heredado()
+    return almacen
+
+def obtener_ruta_indice_uidl(user_email):
+    """
+    Retorna la ruta del archivo de índice UIDL de una cuenta.
+    """
+    return os.path.join(UIDL_INDEX_DIR, f"{user_email}.json")
+
+def cargar_indice_uidl(user_email):
+    """
+    Carga el índice UIDL persistido de una cuenta: un diccionario {uid: hash} con los
+    mensajes del servidor que ya fueron verificados en ciclos anteriores.
+    Retorna un diccionario vacío si el índice no existe o no se puede leer.
+    """
+    ruta_indice = obtener_ruta_indice_uidl(user_email)
+    if not os.path.exists(ruta_indice):
+        return {}
+    try:
+        with open(ruta_indice, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict) and isinstance(data.get("uids"), dict):
+            logging.info(LANG_MESSAGES.get('uidl_index_loaded', "UIDL index for '{user}' loaded: {count} known UID(s).").format(user=user_email, count=len(data["uids"])))
+            return data["uids"]
+        raise ValueError("unexpected format")
+    except Exception as e:
+        logging.warning(LANG_MESSAGES.get('uidl_index_load_error', "WARNING: Could not read UIDL index '{path}'. Details: {e}. Falling back to a full header check for this cycle.").format(path=ruta_indice, e=e))
+        return {}
+
+def guardar_indice_uidl(user_email, indice_uidl):
+    """
+    Guarda el índice UIDL de una cuenta.
+    """
+    ruta_indice = obtener_ruta_indice_uidl(user_email)
+    try:
+        escribir_archivo_atomico(ruta_indice, lambda f: json.dump({"uids": indice_uidl}, f, ensure_ascii=False))
+    except Exception as e:
+        logging.error(LANG_MESSAGES.get('uidl_index_save_error', "ERROR: Could not save UIDL index '{path}'. Details: {e}").format(path=ruta_indice, e=e))
+        pass
+
+# Índices UIDL de las cuentas que terminaron en el ciclo en curso. Se guardan después de registrar sus
+# metadatos en el almacén: un UID guardado antes que su registro haría que el correo no se volviera a
+# descargar ni registrar si el proceso se interrumpe en medio (los puntos de control guardan el índice
+# justo después de su diario, que sí tiene los registros).
+INDICES_UIDL_PENDIENTES = {}
+BLOQUEO_INDICES_UIDL = threading.Lock()
+
+def programar_guardado_indice_uidl(user_email, indice_uidl):
+    with BLOQUEO_INDICES_UIDL:
+        INDICES_UIDL_PENDIENTES[user_email] = indice_uidl
+
+def guardar_indices_uidl_pendientes():
+    """
+    Guarda los índices UIDL programados en el ciclo; se llama cuando el almacén ya tiene sus registros.
+    """
+    with BLOQUEO_INDICES_UIDL:
+        pendientes = dict(INDICES_UIDL_PENDIENTES)
+        INDICES_UIDL_PENDIENTES.clear()
+    for user_email, indice_uidl in pendientes.items():
+        guardar_indice_uidl(user_email, indice_uidl)
+
+def descartar_indices_uidl_pendientes():
+    """
+    Descarta los índices UIDL programados sin guardarlos, porque el almacén no registró sus correos.
+    Esos correos se vuelven a verificar en el siguiente ciclo, después de recuperar los diarios.
+    """
+    with BLOQUEO_INDICES_UIDL:
+        INDICES_UIDL_PENDIENTES.clear()
+
+class RegistroCorreosOmitidos:
+    """
+    Correos que la política de encabezados decidió no descargar (ver evaluar_politica_encabezados).
+    Cada omisión se anexa como una línea JSON a SKIPPED_MESSAGES_FILE y su hash se trata como ya
+    procesado, para que el correo no se vuelva a evaluar en cada ciclo. El archivo se vuelve a leer
+    si cambia fuera del script (por ejemplo, al borrar líneas para que un correo se reevalúe).
+    """
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.hashes = set()
+        self.firma = None # firma_archivo() de la última lectura o escritura; None = aún no se leyó.
+        self.bloqueo = threading.Lock()
+
+    def _actualizar(self):
+        firma = firma_archivo(self.ruta)
+        if self.firma is not None and firma == self.firma:
+            return
+        self.hashes = set()
+        try:
+            with open(self.ruta, 'r', encoding='utf-8') as f:
+                for linea in f:
+                    try:
+                        self.hashes.add(json.loads(linea)["hash"])
+                    except (ValueError, KeyError, TypeError):
+                        continue # Línea truncada por una interrupción.
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(LANG_MESSAGES.get('skipped_registry_error', "ERROR: Could not read or write skipped messages registry '{path}'. Details: {e}").format(path=self.ruta, e=e))
+        self.firma = firma
+
+    def contiene(self, hash_correo):
+        with self.bloqueo:
+            self._actualizar()
+            return hash_correo in self.hashes
+
+    def registrar(self, registro):
+        """
+        Anexa el registro de un correo omitido (diccionario con al menos "hash").
+        """
+        with self.bloqueo:
+            self._actualizar()
+            self.hashes.add(registro["hash"])
+            try:
+                with open(self.ruta, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            except OSError as e:
+                logging.error(LANG_MESSAGES.get('skipped_registry_error', "ERROR: Could not read or write skipped messages registry '{path}'. Details: {e}").format(path=self.ruta, e=e))
+            self.firma = firma_archivo(self.ruta)
+
+REGISTRO_CORREOS_OMITIDOS = RegistroCorreosOmitidos(SKIPPED_MESSAGES_FILE)
+
+def obtener_ruta_punto_control(user_email):
+    """
+    Retorna la ruta del diario de puntos de control de una cuenta.
+    """
+    return os.path.join(CHECKPOINT_DIR, f"{user_email}.jsonl")
+
+class PuntoDeControlCuenta:
+    """
+    Progreso de una cuenta durante el ciclo. Cada checkpoint_every_messages correos o
+    checkpoint_every_seconds segundos (y al terminar la cuenta) sincroniza con el disco los .eml
+    escritos, anexa sus metadatos al diario de la cuenta en CHECKPOINT_DIR y guarda el índice UIDL.
+    El almacén solo se actualiza al final del ciclo; si el proceso se interrumpe antes,
+    recuperar_puntos_de_control() registra los correos del diario al empezar el siguiente ciclo.
+    """
+    def __init__(self, user, indice_uidl):
+        self.user = user
+        self.indice_uidl = indice_uidl
+        self.ruta = obtener_ruta_punto_control(user)
+        self.pendientes = []
+        self.ultimo_guardado = time.monotonic()
+        self.activo = SETTINGS["checkpoint_every_messages"] > 0 or SETTINGS["checkpoint_every_seconds"] > 0
+
+    def anotar(self, metadatos):
+        """
+        Añade los metadatos de un correo guardado y crea un punto de control si toca.
+        """
+        if not self.activo:
+            return
+        self.pendientes.append(metadatos)
+        cada_mensajes = SETTINGS["checkpoint_every_messages"]
+        cada_segundos = SETTINGS["checkpoint_every_seconds"]
+        if (cada_mensajes > 0 and len(self.pendientes) >= cada_mensajes) or (cada_segundos > 0 and time.monotonic() - self.ultimo_guardado >= cada_segundos):
+            self.guardar()
+
+    def guardar(self):
+        self.ultimo_guardado = time.monotonic()
+        if not self.pendientes:
+            return
+        sincronizar_escrituras_pendientes() # El diario nunca apunta a un .eml que aún no está en disco.
+        try:
+            with open(self.ruta, 'a', encoding='utf-8') as f:
+                for registro in self.pendientes:
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                f.flush()
+                if SETTINGS["fsync"]:
+                    os.fsync(f.fileno())
+        except OSError as e:
+            logging.error(LANG_MESSAGES.get('checkpoint_save_error', "ERROR: Could not save checkpoint '{path}'. Details: {e}").format(path=self.ruta, e=e))
+            return # Los pendientes se reintentan en el siguiente punto de control.
+        if self.indice_uidl is not None:
+            guardar_indice_uidl(self.user, self.indice_uidl)
+        logging.info(LANG_MESSAGES.get('checkpoint_saved', "Checkpoint for '{user}': {count} email(s) recorded.").format(user=self.user, count=len(self.pendientes)))
+        self.pendientes = []
+
+def listar_puntos_de_control():
+    """
+    Retorna las rutas de los diarios de puntos de control existentes.
+    """
+    try:
+        return [os.path.join(CHECKPOINT_DIR, nombre) for nombre in os.listdir(CHECKPOINT_DIR) if nombre.endswith(".jsonl")]
+    except FileNotFoundError:
+        return []
+
+def recuperar_puntos_de_control(almacen_metadatos):
+    """
+    Registra en el almacén los correos de los diarios que dejó un ciclo interrumpido (solo los
+    que aún no estaban registrados) y elimina los diarios.
+    """
+    rutas = listar_puntos_de_control()
+    if not rutas:
+        return
+    existing_hashes = almacen_metadatos.cargar_hashes()
+    registros = {}
+    for ruta in rutas:
+        try:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                for linea in f:
+                    try:
+                        registro = json.loads(linea)
+                    except ValueError:
+                        continue # Última línea truncada por la interrupción.
+                    if isinstance(registro, dict) and "hash" in registro and registro["hash"] not in existing_hashes:
+                        registros[registro["hash"]] = registro
+        except OSError as e:
+            logging.error(LANG_MESSAGES.get('checkpoint_read_error', "ERROR: Could not read checkpoint '{path}'. Details: {e}").format(path=ruta, e=e))
+            return # Se reintenta en el próximo ciclo sin perder el diario.
+    try:
+        almacen_metadatos.agregar(list(registros.values()))
+    except Exception as e:
+        logging.error(LANG_MESSAGES.get('checkpoint_store_error', "ERROR: Could not record the checkpointed emails in the metadata store. The checkpoints are kept for the next cycle. Details: {e}").format(e=e))
+        return
+    if registros and SETTINGS["export_viewer_json"]:
+        almacen_metadatos.exportar_json()
+    descartar_puntos_de_control(rutas)
+    logging.info(LANG_MESSAGES.get('checkpoint_recovered', "{count} email(s) from an interrupted cycle recovered from checkpoints.").format(count=len(registros)))
+    print(LANG_MESSAGES.get('checkpoint_recovered', "  {count} correo(s) de un ciclo interrumpido recuperado(s) de los puntos de control.").format(count=len(registros)))
+
+def guardar_diario_del_ciclo(registros):
+    """
+    Anexa los registros de un ciclo cuyo almacén no se pudo actualizar al diario CYCLE_CHECKPOINT_NAME,
+    para que recuperar_puntos_de_control() los registre en el siguiente ciclo aunque los puntos de
+    control por cuenta estén desactivados (los repetidos en otros diarios se registran una sola vez).
+    """
+    ruta = obtener_ruta_punto_control(CYCLE_CHECKPOINT_NAME)
+    sincronizar_escrituras_pendientes()
+    try:
+        with open(ruta, 'a', encoding='utf-8') as f:
+            for registro in registros:
+                f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            f.flush()
+            if SETTINGS["fsync"]:
+                os.fsync(f.fileno())
+    except OSError as e:
+        logging.error(LANG_MESSAGES.get('checkpoint_save_error', "ERROR: Could not save checkpoint '{path}'. Details: {e}").format(path=ruta, e=e))
+
+def descartar_puntos_de_control(rutas=None):
+    """
+    Elimina los diarios de puntos de control una vez que sus correos están en el almacén.
+    """
+    for ruta in listar_puntos_de_control() if rutas is None else rutas:
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+def obtener_uidl_servidor(servidor_pop, user):
+    """
+    Envía un único comando UIDL y retorna un diccionario {numero_mensaje: uid}.
+    Retorna None si el servidor no soporta UIDL, para usar la verificación por hash de encabezados.
+    """
+    try:
+        _, lineas_uidl, _ = servidor_pop.uidl()
+    except poplib.error_proto:
+        logging.info(LANG_MESSAGES.get('uidl_not_supported', "Server for '{user}' does not support UIDL. Using header hash verification.").format(user=user))
+        return None
+    return parsear_lineas_uidl(lineas_uidl)
+
+def parsear_lineas_uidl(lineas_uidl):
+    """
+    Convierte las líneas de la respuesta UIDL ("numero uid") en un diccionario {numero_mensaje: uid}.
+    """
+    mapa_uidl = {}
+    for linea in lineas_uidl:
+        partes = linea.decode('utf-8', errors='replace').split()
+        if len(partes) >= 2 and partes[0].isdigit():
+            mapa_uidl[int(partes[0])] = partes[1]
+    return mapa_uidl
+
+def obtener_tamanos_servidor(servidor_pop, user):
+    """
+    Envía un único comando LIST y retorna un diccionario {numero_mensaje: tamaño en bytes}.
+    Retorna un diccionario vacío si el servidor no responde a LIST (la política de tamaño no se aplica).
+    """
+    try:
+        _, lineas_list, _ = servidor_pop.list()
+    except poplib.error_proto as e:
+        logging.warning(LANG_MESSAGES.get('list_not_supported', "WARNING: LIST failed for '{user}'; message size limits are not applied this cycle. Details: {e}").format(user=user, e=e))
+        return {}
+    return parsear_lineas_list(lineas_list)
+
+def parsear_lineas_list(lineas_list):
+    """
+    Convierte las líneas de la respuesta LIST ("numero tamaño") en un diccionario {numero_mensaje: tamaño}.
+    """
+    tamanos = {}
+    for linea in lineas_list:
+        partes = linea.split()
+        if len(partes) >= 2 and partes[0].isdigit() and partes[1].isdigit():
+            tamanos[int(partes[0])] = int(partes[1])
+    return tamanos
+
+def obtener_ventana_pipelining(servidor_pop, user):
+    """
+    Consulta CAPA y retorna cuántos comandos pueden quedar pendientes en el socket.
+    Retorna 1 (modo paso a paso) si el servidor no anuncia PIPELINING (RFC 2449).
+    """
+    try:
+        capacidades = servidor_pop.capa()
+    except poplib.error_proto:
+        capacidades = {}
+    return calcular_ventana_pipelining(capacidades, user)
+
+def calcular_ventana_pipelining(capacidades, user):
+    """
+    Retorna la ventana de pipelining a usar según las capacidades anunciadas por el servidor.
+    """
+    if "PIPELINING" in capacidades and SETTINGS["pipelining_window"] > 1:
+        logging.info(LANG_MESSAGES.get('pipelining_enabled', "Server for '{user}' supports PIPELINING. Sending up to {window} TOP/RETR command(s) at a time.").format(user=user, window=SETTINGS["pipelining_window"]))
+        return SETTINGS["pipelining_window"]
+    logging.info(LANG_MESSAGES.get('pipelining_not_supported', "Server for '{user}' does not announce PIPELINING. Using one command at a time.").format(user=user))
+    return 1
+
+def iterar_respuestas_multilinea(servidor_pop, comandos, ventana, crear_destino=None):
+    """
+    Envía los comandos multilínea (TOP/RETR) manteniendo hasta `ventana` pendientes en el socket
+    y lee las respuestas en el mismo orden en que se enviaron.
+    `comandos` es una lista de tuplas (clave, comando). Genera tuplas (clave, lineas, error) donde
+    `error` es la excepción poplib.error_proto de una respuesta -ERR, o None si la respuesta fue +OK.
+    Si se indica `crear_destino(clave)`, las líneas de cada respuesta se escriben en el objeto que
+    retorna (p. ej. DescargaEnCurso) a medida que llegan, y ese objeto se genera en lugar de la lista.
+    Con ventana=1 equivale al modo paso a paso de servidor_pop.top()/retr().
+    """
+    pendientes = [] # Claves de los comandos enviados cuyas respuestas aún no se han leído.
+    siguiente = 0
+    while siguiente < len(comandos) or pendientes:
+        lote = comandos[siguiente:siguiente + ventana - len(pendientes)]
+        if lote:
+            # Se envía el lote completo en una sola escritura para que viaje en el menor número de paquetes.
+            servidor_pop.sock.sendall(b''.join(comando.encode(servidor_pop.encoding) + poplib.CRLF for _, comando in lote))
+            pendientes.extend(clave for clave, _ in lote)
+            siguiente += len(lote)
+        clave = pendientes.pop(0)
+        try:
+            if crear_destino is None:
+                _, lineas, _ = servidor_pop._getlongresp()
+            else:
+                servidor_pop._getresp()
+                lineas = leer_lineas_a_destino(servidor_pop._getline, crear_destino(clave))
+        except poplib.error_proto as e:
+            yield clave, None, e # Un -ERR no tiene cuerpo, así que las respuestas siguientes siguen alineadas.
+            continue
+        yield clave, lineas, None
+
+def leer_lineas_a_destino(leer_linea, destino):
+    """
+    Lee las líneas de una respuesta multilínea hasta el "." final y las escribe en `destino`,
+    quitando el punto de relleno (byte-stuffing). Si la lectura falla, el destino se descarta.
+    """
+    try:
+        while True:
+            linea, _ = leer_linea()
+            if linea == b'.':
+                break
+            if linea.startswith(b'..'):
+                linea = linea[1:]
+            destino.escribir_linea(linea)
+        destino.cerrar()
+    except BaseException:
+        destino.descartar()
+        raise
+    return destino
+
+def registrar_error_pop_mensaje(num, user, e):
+    """
+    Registra un error de protocolo POP3 al procesar un correo. El correo se omite en este ciclo.
+    """
+    MEDIDOR_FASES.contar("errors", 1, user, "pop3_protocol")
+    logging.error(LANG_MESSAGES.get('pop3_error_processing_email', "POP3 protocol error processing email #{num}: {error}. Skipping this email.").format(num=num, error=e) + f" for '{user}'.")
+    print(LANG_MESSAGES.get('pop3_error_processing_email', f"    [ERROR] Fallo de POP3 al procesar correo #{num}: {e}. Omitiendo este correo.").format(num=num, error=e))
+
+def registrar_error_inesperado_mensaje(num, user, e):
+    """
+    Registra un error inesperado al procesar un correo. El correo se omite en este ciclo.
+    """
+    MEDIDOR_FASES.contar("errors", 1, user, type(e).__name__)
+    logging.error(LANG_MESSAGES.get('unexpected_error_processing_email', "Unexpected error processing email #{num}: {error}. Skipping this email.").format(num=num, error=e) + f" for '{user}'.")
+    print(LANG_MESSAGES.get('unexpected_error_processing_email', f"    [ERROR] Error inesperado al procesar correo #{num}: {e}. Omitiendo este correo.").format(num=num, error=e))
+
+def preparar_mensajes_a_verificar(user, count, mapa_uidl):
+    """
+    Determina qué mensajes del buzón deben verificarse con TOP.
+    Con UIDL retorna el índice UIDL podado y los números de mensaje cuyo UID no se conoce;
+    sin UIDL (mapa_uidl es None) retorna (None, todos los mensajes del buzón).
+    """
+    if mapa_uidl is None:
+        return None, range(1, count + 1)
+    indice_uidl_previo = cargar_indice_uidl(user)
+    # Solo se conservan los UID que siguen en el servidor para que el índice no crezca sin límite.
+    indice_uidl = {uid: indice_uidl_previo[uid] for uid in mapa_uidl.values() if uid in indice_uidl_previo}
+    mensajes_a_verificar = [num for num in sorted(mapa_uidl) if mapa_uidl[num] not in indice_uidl]
+    MEDIDOR_FASES.contar("messages", count - len(mensajes_a_verificar), user, "known")
+    logging.info(LANG_MESSAGES.get('uidl_sync_summary', "UIDL sync for '{user}': {new} new UID(s) out of {total} message(s).").format(user=user, new=len(mensajes_a_verificar), total=count))
+    return indice_uidl, mensajes_a_verificar
+
+def verificar_encabezados_mensaje(num, count, user, header_bytes, existing_hashes, indice_uidl, mapa_uidl):
+    """
+    Calcula el hash de los encabezados obtenidos con TOP y lo reserva si el correo es nuevo.
+    Retorna el hash si el correo debe descargarse, o None si ya estaba registrado u omitido.
+    """
+    registrar_evento(logging.INFO, 'processing_email_num', "Processing email #{current}/{total}...", sufijo=" for '{user}'.", current=num, total=count, user=user)
+    mostrar('processing_email_num', "    Procesando correo #{current}/{total}...", current=num, total=count)
+    hash_correo = obtener_hash_encabezados_crudos(header_bytes)
+    registrar_evento(logging.DEBUG, 'calculated_headers_hash', "Calculated headers hash: {hash}...", hash=hash_correo[:10])
+    if REGISTRO_CORREOS_OMITIDOS.contiene(hash_correo):
+        registrar_evento(logging.INFO, 'email_previously_skipped', "Email #{num} (hash {hash}...) was skipped by the header policy in a previous cycle for '{user}'. Skipping.", num=num, hash=hash_correo[:10], user=user)
+        if indice_uidl is not None:
+            indice_uidl[mapa_uidl[num]] = hash_correo
+        MEDIDOR_FASES.contar("messages", 1, user, "known")
+        return None
+    reservado = reservar_hash(existing_hashes, hash_correo)
+    if reservado is None:
+        # Sin anotar el UID: si la otra cuenta no llega a guardarlo, el siguiente ciclo lo descarga esta.
+        registrar_evento(logging.INFO, 'email_reserved_by_other_account', "Email #{num} (hash {hash}...) is being downloaded by another account. '{user}' will check it again in the next cycle.", num=num, hash=hash_correo[:10], user=user)
+        return None
+    if not reservado:
+        registrar_evento(logging.INFO, 'email_already_downloaded', "Email #{num} (hash {hash}...) has already been downloaded for '{user}'. Skipping.", num=num, hash=hash_correo[:10], user=user)
+        mostrar('email_already_exists', "      Correo #{num} ya existe en el registro. Omitiendo.", num=num)
+        if indice_uidl is not None:
+            indice_uidl[mapa_uidl[num]] = hash_correo # Ya no se volverá a pedir TOP para este UID.
+        MEDIDOR_FASES.contar("messages", 1, user, "known")
+        return None
+    registrar_evento(logging.INFO, 'email_is_new', "Email #{num} (hash {hash}...) is new for '{user}'. Downloading full body.", num=num, hash=hash_correo[:10], user=user)
+    return hash_correo
+
+@lru_cache(maxsize=8)
+def _parsear_horario_valle(franja):
+    """
+    Convierte "HH:MM-HH:MM" en (inicio, fin) como objetos time. Retorna None si la franja está vacía o no es válida.
+    """
+    if not franja:
+        return None
+    try:
+        inicio, fin = (datetime.strptime(parte.strip(), "%H:%M").time() for parte in franja.split("-"))
+    except ValueError:
+        logging.warning(LANG_MESSAGES.get('invalid_setting_value', "Invalid value for setting '{key}' in settings.json: {value!r}. Using default {default!r}.").format(key="off_peak_hours", value=franja, default=""))
+        return None
+    return inicio, fin
+
+def en_horario_valle(ahora=None):
+    """
+    Indica si la hora local está dentro de off_peak_hours. La franja puede cruzar la medianoche ("22:00-06:00").
+    """
+    franja = _parsear_horario_valle(SETTINGS["off_peak_hours"])
+    if franja is None:
+        return False
+    inicio, fin = franja
+    hora = (ahora or datetime.now()).time()
+    if inicio <= fin:
+        return inicio <= hora < fin
+    return hora >= inicio or hora < fin
+
+def necesita_tamanos_list():
+    """
+    Indica si alguna opción usa los tamaños de LIST (límite de tamaño, orden por tamaño o presupuesto por ciclo).
+    """
+    return SETTINGS["max_message_size_kb"] > 0 or SETTINGS["download_order"] == "smallest_first" or SETTINGS["download_budget_kb_per_cycle"] > 0
+
+def planificar_descargas(mensajes_nuevos, tamanos, user):
+    """
+    Ordena los correos nuevos (numero, hash) según download_order y aplica download_budget_kb_per_cycle.
+    Retorna los que se descargan en este ciclo; los que no caben en el presupuesto se aplazan al
+    próximo (no se registran, así que se vuelven a verificar). El primero siempre se descarga, para
+    que un correo mayor que el presupuesto no quede bloqueado.
+    """
+    orden = SETTINGS["download_order"]
+    if orden == "smallest_first":
+        mensajes = sorted(mensajes_nuevos, key=lambda mensaje: (tamanos.get(mensaje[0], 0), mensaje[0]))
+    elif orden == "newest_first":
+        mensajes = sorted(mensajes_nuevos, key=lambda mensaje: mensaje[0], reverse=True) # POP3 numera del más antiguo al más reciente.
+    else:
+        mensajes = list(mensajes_nuevos)
+    presupuesto = SETTINGS["download_budget_kb_per_cycle"] * 1024
+    if presupuesto <= 0 or not tamanos:
+        return mensajes
+    planificados = []
+    bytes_planificados = 0
+    for num, hash_correo in mensajes:
+        tamano = tamanos.get(num, 0)
+        if planificados and bytes_planificados + tamano > presupuesto:
+            continue # Un correo más pequeño que venga después todavía puede caber.
+        planificados.append((num, hash_correo))
+        bytes_planificados += tamano
+    if len(planificados) < len(mensajes):
+        logging.info(LANG_MESSAGES.get('download_budget_reached', "Download budget reached for '{user}': {scheduled} email(s) ({kb} KB) this cycle, {deferred} deferred to the next one.").format(
+            user=user, scheduled=len(planificados), kb=bytes_planificados // 1024, deferred=len(mensajes) - len(planificados)))
+        print(LANG_MESSAGES.get('download_budget_reached', "  Presupuesto de descarga alcanzado para '{user}': {scheduled} correo(s) ({kb} KB) en este ciclo, {deferred} aplazado(s) al siguiente.").format(
+            user=user, scheduled=len(planificados), kb=bytes_planificados // 1024, deferred=len(mensajes) - len(planificados)))
+    return planificados
+
+def politica_encabezados_activa():
+    """
+    Indica si alguna regla de la política previa a RETR está activada en settings.json.
+    """
+    return SETTINGS["skip_blacklisted_senders"] or SETTINGS["skip_spam_score_above"] > 0 or SETTINGS["max_message_size_kb"] > 0
+
+def _texto_encabezado(msg, nombre):
+    """
+    Retorna el valor de un encabezado como texto, o "" si falta o no se puede interpretar.
+    """
+    try:
+        return str(msg.get(nombre, ''))
+    except Exception:
+        return ''
+
+def evaluar_politica_encabezados(header_bytes, tamano, mail_whitelist, mail_blacklist):
+    """
+    Política previa a RETR: decide con los encabezados de TOP y el tamaño de LIST si un correo nuevo
+    se descarga. Los encabezados solo se analizan si alguna regla los necesita; un remitente en la
+    lista blanca siempre se descarga (salvo por tamaño). Los correos aplazados por tamaño se
+    descargan dentro de off_peak_hours.
+    Retorna (accion, motivo, msg): accion es "download", "skip" o "defer", y msg son los encabezados
+    analizados o None.
+    """
+    limite = SETTINGS["max_message_size_kb"] * 1024
+    if limite > 0 and tamano is not None and tamano > limite:
+        if SETTINGS["size_limit_action"] == "skip":
+            return "skip", "size", None
+        if not en_horario_valle():
+            return "defer", "size", None
+    umbral = SETTINGS["skip_spam_score_above"]
+    if not SETTINGS["skip_blacklisted_senders"] and umbral <= 0:
+        return "download", None, None
+    msg = BytesParser(policy=policy.default).parsebytes(b"\r\n".join(header_bytes), headersonly=True)
+    remitente = parseaddr(_texto_encabezado(msg, 'From'))[1].lower()
+    if mail_whitelist and mail_whitelist.coincide(remitente):
+        return "download", None, msg
+    if SETTINGS["skip_blacklisted_senders"] and mail_blacklist and mail_blacklist.coincide(remitente):
+        return "skip", "blacklisted_sender", msg
+    if umbral > 0:
+        score = extraer_score_spam(msg)
+        if score is not None and score > umbral:
+            return "skip", "spam_score", msg
+    return "download", None, msg
+
+def aplicar_politica_encabezados(num, user, header_bytes, hash_correo, tamano, indice_uidl, mapa_uidl, mail_whitelist, mail_blacklist):
+    """
+    Aplica la política previa a RETR a un correo nuevo. Retorna True si debe descargarse.
+    Un correo omitido queda en REGISTRO_CORREOS_OMITIDOS y en el índice UIDL para no reevaluarse;
+    uno aplazado no se registra y se vuelve a evaluar en el próximo ciclo.
+    """
+    if not politica_encabezados_activa():
+        return True
+    accion, motivo, msg = evaluar_politica_encabezados(header_bytes, tamano, mail_whitelist, mail_blacklist)
+    if accion == "download":
+        return True
+    MEDIDOR_FASES.contar("messages", 1, user, "deferred" if accion == "defer" else "skipped")
+    if accion == "defer":
+        registrar_evento(logging.INFO, 'email_deferred_by_policy', "Email #{num} (hash {hash}...) deferred for '{user}': {reason}.", num=num, hash=hash_correo[:10], user=user, reason=motivo)
+        mostrar('email_deferred_by_policy', "      Correo #{num} aplazado: {reason}.", num=num, hash=hash_correo[:10], user=user, reason=motivo)
+        return False
+    if msg is None:
+        msg = BytesParser(policy=policy.default).parsebytes(b"\r\n".join(header_bytes), headersonly=True)
+    REGISTRO_CORREOS_OMITIDOS.registrar({
+        "hash": hash_correo,
+        "user": user,
+        "uid": mapa_uidl[num] if mapa_uidl else None,
+        "reason": motivo, # "size", "blacklisted_sender" o "spam_score".
+        "sender": _texto_encabezado(msg, 'From'),
+        "subject": _texto_encabezado(msg, 'Subject'),
+        "message_id": _texto_encabezado(msg, 'Message-ID'),
+        "size": tamano, # Tamaño según LIST, o None si no se consultó.
+        "spam_score": extraer_score_spam(msg),
+        "skipped_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    })
+    if indice_uidl is not None:
+        indice_uidl[mapa_uidl[num]] = hash_correo # Ya no se volverá a pedir TOP para este UID.
+    registrar_evento(logging.INFO, 'email_skipped_by_policy', "Email #{num} (hash {hash}...) skipped without downloading for '{user}': {reason}.", num=num, hash=hash_correo[:10], user=user, reason=motivo)
+    mostrar('email_skipped_by_policy', "      Correo #{num} omitido sin descargar: {reason}.", num=num, hash=hash_correo[:10], user=user, reason=motivo)
+    return False
+
+def registrar_correo_descargado(num, user, descarga, hash_correo, indice_uidl, mapa_uidl, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist, metadatos_analizados=None):
+    """
+    Mueve a su nombre definitivo un correo descargado con RETR (DescargaEnCurso) y registra su UID.
+    Con `metadatos_analizados` (generados por la etapa de análisis) solo se mueve el archivo.
+    Retorna sus metadatos, o None si no se pudo guardar.
+    """
+    try:
+        if metadatos_analizados is None:
+            with MEDIDOR_FASES.medir("parse", user):
+                msg = descarga.obtener_encabezados()
+                registrar_evento(logging.DEBUG, 'email_body_downloaded', "Email body downloaded and parsed.")
+                metadatos_analizados = guardar_correo_y_obtener_metadata(
+                    user, descarga.ruta_temporal, msg, hash_correo, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist,
+                    compresion=descarga.codec, mover=False)
+        with MEDIDOR_FASES.medir("write", user):
+            metadatos_correo = mover_correo_descargado(descarga.ruta_temporal, metadatos_analizados, descarga.clave_contenido()) if metadatos_analizados else None
+    finally:
+        descarga.descartar() # Sin efecto si el archivo ya se movió a su nombre definitivo.
+    if metadatos_correo:
+        MEDIDOR_FASES.contar("messages", 1, user, "new")
+        if indice_uidl is not None:
+            indice_uidl[mapa_uidl[num]] = metadatos_correo["hash"]
+        registrar_evento(logging.INFO, 'email_processed_saved_metadata_obtained', "Email #{num} processed, saved, and metadata obtained successfully.", num=num)
+        mostrar('email_saved_metadata_registered', "      Correo #{num} guardado y metadatos registrados.", num=num)
+    else:
+        logging.error(LANG_MESSAGES.get('error_getting_or_saving_metadata', "ERROR: Could not get or save metadata for email #{num}. Hash will not be registered.").format(num=num))
+        print(LANG_MESSAGES.get('email_save_metadata_failed', f"      [ERROR] No se pudo guardar el correo #{num} o sus metadatos.").format(num=num))
+    return metadatos_correo
 
-def guardar_metadatos_consolidados(all_emails_metadata):
+# --- Etapas de análisis y escritura de las descargas (parse_pipeline) ---
+POOL_ANALISIS = None # Pool de procesos de la etapa de análisis; se crea la primera vez que se usa y se reutiliza entre ciclos.
+BLOQUEO_POOL_ANALISIS = threading.Lock()
+
+def _iniciar_proceso_analisis(configuracion, idioma):
     """
-    Guarda la lista consolidada de metadatos de correos electrónicos en un archivo JSON.
+    Inicializador de los procesos del pool de análisis.
     """
-    logging.info(LANG_MESSAGES.get('saving_metadata_records', "Saving {count} metadata records to '{path}'...").format(count=len(all_emails_metadata), path=METADATA_FILE))
+    configurar_proceso_auxiliar(configuracion, idioma)
+
+def obtener_pool_analisis():
+    """
+    Retorna el pool de procesos de la etapa de análisis, o None si parse_pipeline está desactivado.
+    Los procesos se crean con "forkserver" (o "spawn") porque las cuentas se procesan en hilos.
+    """
+    global POOL_ANALISIS
+    if not SETTINGS["parse_pipeline"]:
+        return None
+    with BLOQUEO_POOL_ANALISIS:
+        if POOL_ANALISIS is None:
+            metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            POOL_ANALISIS = ProcessPoolExecutor(
+                max_workers=SETTINGS["parse_workers"] or os.cpu_count() or 1, mp_context=multiprocessing.get_context(metodo),
+                initializer=_iniciar_proceso_analisis, initargs=(dict(SETTINGS), SELECTED_LANG_CODE))
+        return POOL_ANALISIS
+
+def descartar_pool_analisis(pool):
+    """
+    Cierra un pool que dejó de funcionar (p. ej. un proceso murió); el siguiente ciclo crea otro.
+    """
+    global POOL_ANALISIS
+    with BLOQUEO_POOL_ANALISIS:
+        if POOL_ANALISIS is pool:
+            POOL_ANALISIS = None
+    logging.warning(LANG_MESSAGES.get('parse_pool_broken', "WARNING: The parse process pool stopped working. Remaining emails are processed inline."))
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def cerrar_pool_analisis():
+    if POOL_ANALISIS is not None:
+        POOL_ANALISIS.shutdown(cancel_futures=True)
+
+atexit.register(cerrar_pool_analisis)
+
+def _analizar_descarga(argumentos):
+    """
+    Trabajo de un proceso de la etapa de análisis: genera los metadatos de un correo descargado que
+    sigue en su archivo temporal, sin moverlo. Las reglas de spam se cargan en cada proceso (y solo se
+    recompilan si cambian sus archivos). Retorna (metadatos, None, mediciones) o (None, descripción del
+    error, mediciones), donde mediciones son las fases ("parse", "date") de MEDIDOR_FASES.extraer().
+    """
+    user, ruta_temporal, encabezados, hash_correo, compresion = argumentos
     try:
-        os.makedirs(os.path.dirname(METADATA_FILE), exist_ok=True) # Asegura que el directorio de destino exista.
-        with open(METADATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump({"emails": all_emails_metadata, "total_emails": len(all_emails_metadata)}, f, ensure_ascii=False, indent=2)
-        logging.info(LANG_MESSAGES.get('metadata_saved_successfully', "Metadata saved successfully to '{path}'.").format(path=METADATA_FILE))
-        print(f"  {LANG_MESSAGES.get('metadata_saved_successfully', 'Metadata updated and saved to {path}.').format(path=METADATA_FILE)}")
+        with MEDIDOR_FASES.medir("parse", user):
+            msg = BytesParser(policy=policy.default).parsebytes(encabezados, headersonly=True)
+            metadatos = guardar_correo_y_obtener_metadata(user, ruta_temporal, msg, hash_correo, *load_spam_config(), compresion=compresion, mover=False)
+        return metadatos, None, MEDIDOR_FASES.extraer()
     except Exception as e:
-        logging.error(LANG_MESSAGES.get('error_saving_metadata', "Error saving metadata to '{path}': {error}").format(path=METADATA_FILE, error=e))
-        print(f"  [ERROR] {LANG_MESSAGES.get('error_saving_consolidated_metadata', 'Could not save consolidated metadata: {error}').format(error=e)}")
-        pass
+        return None, str(e), MEDIDOR_FASES.extraer()
+    finally:
+        REGISTRO_FECHAS_CRUDAS.vaciar() # Los procesos del pool terminan sin ejecutar atexit.
+
+class EtapasDescarga:
+    """
+    Etapas de análisis y escritura de los correos que descarga una cuenta (fase 2).
+    Con parse_pipeline, cada correo recibido (ya en su archivo temporal) pasa al pool de procesos, que
+    parsea sus encabezados y genera sus metadatos (fecha, direcciones, reglas sobre el cuerpo) mientras
+    la conexión sigue recibiendo los siguientes. La escritura (mover el .eml, registrar el UID y llamar
+    a `al_guardar` con los metadatos) se hace en el hilo de la cuenta, en el orden de descarga.
+    Como mucho hay parse_queue_size correos en análisis; con la cola llena, la descarga espera al más
+    antiguo. Sin parse_pipeline cada correo se procesa en línea.
+    """
+    def __init__(self, user, indice_uidl, mapa_uidl, reglas, al_guardar):
+        self.user = user
+        self.indice_uidl = indice_uidl
+        self.mapa_uidl = mapa_uidl
+        self.reglas = reglas # (mail_whitelist, mail_blacklist, word_whitelist, word_blacklist) para el modo en línea.
+        self.al_guardar = al_guardar
+        self.pool = obtener_pool_analisis()
+        self.limite = max(1, SETTINGS["parse_queue_size"])
+        self.en_analisis = deque() # (num, descarga, hash, futuro) en orden de descarga.
 
-def procesar_cuenta(account, all_emails_metadata, existing_hashes, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist):
+    def agregar(self, num, descarga, hash_correo):
+        """
+        Recibe un correo descargado y escribe los que ya terminaron su análisis.
+        """
+        futuro = None
+        if self.pool is not None:
+            try:
+                futuro = self.pool.submit(_analizar_descarga, (self.user, descarga.ruta_temporal, bytes(descarga.encabezados), hash_correo, descarga.codec))
+            except (BrokenProcessPool, RuntimeError): # RuntimeError: el pool ya se cerró.
+                self._descartar_pool()
+        if futuro is None:
+            self._escribir(num, descarga, hash_correo, None)
+            return
+        self.en_analisis.append((num, descarga, hash_correo, futuro))
+        while self.en_analisis and (len(self.en_analisis) >= self.limite or self.en_analisis[0][3].done()):
+            self._escribir(*self.en_analisis.popleft())
+
+    def vaciar(self):
+        """
+        Espera y escribe todos los correos que siguen en análisis.
+        """
+        while self.en_analisis:
+            self._escribir(*self.en_analisis.popleft())
+
+    def _descartar_pool(self):
+        if self.pool is not None:
+            descartar_pool_analisis(self.pool)
+            self.pool = None
+
+    def _escribir(self, num, descarga, hash_correo, futuro):
+        try:
+            metadatos = None
+            if futuro is not None:
+                try:
+                    with MEDIDOR_FASES.medir("parse_wait", self.user):
+                        metadatos, error, mediciones = futuro.result()
+                except BrokenProcessPool:
+                    self._descartar_pool() # Este correo se analiza en línea.
+                else:
+                    MEDIDOR_FASES.combinar(*mediciones)
+                    if error:
+                        raise RuntimeError(error)
+            metadatos_correo = registrar_correo_descargado(
+                num, self.user, descarga, hash_correo, self.indice_uidl, self.mapa_uidl, *self.reglas, metadatos_analizados=metadatos)
+            if metadatos_correo:
+                self.al_guardar(metadatos_correo)
+        except Exception as e:
+            descarga.descartar()
+            registrar_error_inesperado_mensaje(num, self.user, e)
+
+def reservar_hash(existing_hashes, hash_correo):
+    """
+    Comprueba y registra un hash en una sola operación protegida por un candado, para que
+    dos cuentas procesadas en paralelo no descarguen el mismo correo.
+    Retorna True si lo reservó, False si el hash ya estaba registrado, o None si lo reservó otra
+    cuenta que aún no guarda el correo (puede aplazarlo o fallar y liberarlo con liberar_hashes).
+    """
+    with BLOQUEO_HASHES:
+        if hash_correo in HASHES_EN_CURSO:
+            return None
+        if hash_correo in existing_hashes:
+            return False
+        existing_hashes.add(hash_correo)
+        HASHES_EN_CURSO.add(hash_correo)
+        return True
+
+def confirmar_hash(hash_correo):
+    """
+    Marca como guardado el correo de un hash reservado: las demás cuentas ya pueden darlo por conocido.
+    """
+    with BLOQUEO_HASHES:
+        HASHES_EN_CURSO.discard(hash_correo)
+
+def liberar_hashes(existing_hashes, hashes):
+    """
+    Retira de existing_hashes los hashes reservados cuyos correos no llegaron a guardarse.
+    """
+    with BLOQUEO_HASHES:
+        for hash_correo in hashes:
+            existing_hashes.discard(hash_correo)
+            HASHES_EN_CURSO.discard(hash_correo)
+
+def procesar_cuenta(account, existing_hashes, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist):
     """
     Procesa una cuenta de correo POP3: se conecta, autentica, descarga nuevos correos
     y guarda sus metadatos.
+    Retorna la lista de metadatos de los correos nuevos de la cuenta, para que el ciclo
+    principal la combine con las de las demás cuentas.
     """
     user = account["user"]
     password = account["password"]
     server = account["server"]
     port = account["port"]
     servidor_pop = None # Inicializa la variable para asegurar que esté definida.
+    inicio_cuenta = time.perf_counter()
+    nuevos_metadatos = [] # Metadatos de los correos descargados en esta llamada.
+    hashes_reservados = set() # Hashes reservados en existing_hashes cuya descarga aún no termina.
     logging.info(LANG_MESSAGES.get('starting_account_processing', "Starting account processing: '{user}' on {server}:{port}.").format(user=user, server=server, port=port))
     print(LANG_MESSAGES.get('processing_account', "\n  >>> Procesando cuenta: {user} <<<").format(user=user))
 
@@ -804,13 +3827,13 @@ def procesar_cuenta(account, all_emails_metadata, existing_hashes, mail_whitelis
         logging.info(LANG_MESSAGES.get('connecting_to_server', "Connecting to {server}:{port}...").format(server=server, port=port))
         print(LANG_MESSAGES.get('connecting_to_server', "  Conectando a {server}:{port}...").format(server=server, port=port))
         if port == 995:
-            servidor_pop = poplib.POP3_SSL(server, port=port, timeout=30)
+            servidor_pop = poplib.POP3_SSL(server, port=port, timeout=30, context=crear_contexto_tls())
             logging.info(LANG_MESSAGES.get('ssl_connection_established', "SSL connection established with {server}:{port}.").format(server=server, port=port))
         else:
             servidor_pop = poplib.POP3(server, port=port, timeout=30)
             logging.info(LANG_MESSAGES.get('non_secure_connection_established', "Non-secure connection established with {server}:{port}. Attempting to start TLS...").format(server=server, port=port))
             try:
-                servidor_pop.starttls() # Intenta actualizar la conexión a TLS.
+                servidor_pop.stls(context=crear_contexto_tls()) # Intenta actualizar la conexión a TLS.
                 logging.info(LANG_MESSAGES.get('tls_started_successfully', "TLS started successfully."))
             except poplib.error_proto as e:
                 logging.warning(LANG_MESSAGES.get('warning_tls_not_started', "WARNING: Could not start TLS for account '{user}'. Connection might not be secure. Details: {e}").format(user=user, e=e))
@@ -827,6 +3850,7 @@ def procesar_cuenta(account, all_emails_metadata, existing_hashes, mail_whitelis
             logging.info(LANG_MESSAGES.get('auth_successful', "Authentication successful for '{user}'.").format(user=user))
             print(LANG_MESSAGES.get('auth_successful', "  Autenticación exitosa para '{user}'.").format(user=user))
         except poplib.error_proto as e:
+            MEDIDOR_FASES.contar("errors", 1, user, "authentication")
             logging.error(LANG_MESSAGES.get('auth_failed', "Authentication failed for {user}. Please check credentials.").format(user=user) + f" Details: {e}")
             print(LANG_MESSAGES.get('auth_failed', "  [ERROR] Falló la autenticación para {user}. Verifique sus credenciales.").format(user=user))
             if servidor_pop: # Asegura cerrar la conexión si se estableció.
@@ -834,8 +3858,9 @@ def procesar_cuenta(account, all_emails_metadata, existing_hashes, mail_whitelis
                     servidor_pop.quit()
                 except Exception:
                     pass
-            return # Sale de la función si la autenticación falla.
+            return nuevos_metadatos # Sale de la función si la autenticación falla.
         except Exception as e:
+            MEDIDOR_FASES.contar("errors", 1, user, "authentication")
             logging.error(LANG_MESSAGES.get('auth_failed_unexpected', "Authentication failed for {user} due to an unexpected error.").format(user=user) + f" Details: {e}")
             print(LANG_MESSAGES.get('auth_failed_unexpected', "  [ERROR] Falló la autenticación para {user} debido a un error inesperado.").format(user=user))
             if servidor_pop:
@@ -843,7 +3868,7 @@ def procesar_cuenta(account, all_emails_metadata, existing_hashes, mail_whitelis
                     servidor_pop.quit()
                 except Exception:
                     pass
-            return
+            return nuevos_metadatos
         
         logging.info(LANG_MESSAGES.get('getting_mailbox_status', "Getting mailbox status for '{user}'...").format(user=user))
         try:
@@ -851,6 +3876,7 @@ def procesar_cuenta(account, all_emails_metadata, existing_hashes, mail_whitelis
             logging.info(LANG_MESSAGES.get('mailbox_status_info', "Mailbox for '{user}': {count} email(s) with a total size of {total_size} bytes.").format(user=user, count=count, total_size=total_size))
             print(LANG_MESSAGES.get('mailbox_status', "  Buzón de '{user}': {count} correo(s) en total.").format(user=user, count=count))
         except poplib.error_proto as e:
+            MEDIDOR_FASES.contar("errors", 1, user, "mailbox_status")
             logging.error(LANG_MESSAGES.get('mailbox_status_error', "Could not get mailbox status for {user}.").format(user=user) + f" Details: {e}")
             print(LANG_MESSAGES.get('mailbox_status_error', "  [ERROR] No se pudo obtener el estado del buzón para {user}.").format(user=user))
             if servidor_pop:
@@ -858,8 +3884,9 @@ def procesar_cuenta(account, all_emails_metadata, existing_hashes, mail_whitelis
                     servidor_pop.quit()
                 except Exception:
                     pass
-            return
+            return nuevos_metadatos
         except Exception as e:
+            MEDIDOR_FASES.contar("errors", 1, user, "mailbox_status")
             logging.error(LANG_MESSAGES.get('mailbox_status_error_unexpected', "Unexpected error getting mailbox status for {user}.").format(user=user) + f" Details: {e}")
             print(LANG_MESSAGES.get('mailbox_status_error_unexpected', "  [ERROR] Error inesperado al obtener el estado del buzón para {user}.").format(user=user))
             if servidor_pop:
@@ -867,53 +3894,77 @@ def procesar_cuenta(account, all_emails_metadata, existing_hashes, mail_whitelis
                     servidor_pop.quit()
                 except Exception:
                     pass
-            return
+            return nuevos_metadatos
         
+        MEDIDOR_FASES.registrar("connect", time.perf_counter() - inicio_cuenta, user) # Conexión, TLS, autenticación y STAT.
         directorio_guardado_usuario = crear_estructura_directorios_usuario(user)
+        limpiar_descargas_incompletas(directorio_guardado_usuario)
+        inicio_listado = time.perf_counter()
         if count == 0:
             logging.info(LANG_MESSAGES.get('no_new_emails', "No new emails in mailbox for '{user}'.").format(user=user))
             print(LANG_MESSAGES.get('no_new_emails', "  No hay correos nuevos en el buzón para '{user}'.").format(user=user))
             pass
-        for i in range(1, count + 1):
-            logging.info(LANG_MESSAGES.get('processing_email_num', "Processing email #{current}/{total}...").format(current=i, total=count) + f" for '{user}'.")
-            print(LANG_MESSAGES.get('processing_email_num', "    Procesando correo #{current}/{total}...").format(current=i, total=count))
+
+        # Con UIDL basta un comando por ciclo para saber qué mensajes ya se verificaron;
+        # sin UIDL se recorre todo el buzón con TOP y el hash de encabezados.
+        mapa_uidl = obtener_uidl_servidor(servidor_pop, user) if count > 0 else None
+        indice_uidl, mensajes_a_verificar = preparar_mensajes_a_verificar(user, count, mapa_uidl)
+        punto_control = PuntoDeControlCuenta(user, indice_uidl)
+        progreso = ProgresoCuenta(user, len(mensajes_a_verificar))
+        ventana = obtener_ventana_pipelining(servidor_pop, user) if mensajes_a_verificar else 1
+        # Tamaños de LIST para la política previa a RETR y la planificación; un único comando y solo si alguna opción los usa.
+        tamanos = obtener_tamanos_servidor(servidor_pop, user) if mensajes_a_verificar and necesita_tamanos_list() else {}
+        MEDIDOR_FASES.registrar("list", time.perf_counter() - inicio_listado, user) # UIDL, índice UIDL, CAPA y LIST.
+
+        # Fase 1: TOP de los mensajes a verificar para calcular el hash de encabezados.
+        mensajes_nuevos = [] # Tuplas (numero_mensaje, hash) que se descargarán en la fase 2.
+        comandos_top = [(i, f"TOP {i} 0") for i in mensajes_a_verificar]
+        for i, header_bytes, error_pop in MEDIDOR_FASES.medir_iteracion("top", iterar_respuestas_multilinea(servidor_pop, comandos_top, ventana), user):
+            progreso.anotar(verificados=1)
             try:
-                _, header_bytes, _ = servidor_pop.top(i, 0)
-                headers_raw = b'\r\n'.join(header_bytes)
-                msg_headers = BytesParser(policy=policy.default).parsebytes(headers_raw)
-                hash_correo = obtener_hash_encabezados(msg_headers)
-                logging.debug(LANG_MESSAGES.get('calculated_headers_hash', "Calculated headers hash: {hash}...").format(hash=hash_correo[:10]))
-                if hash_correo in existing_hashes:
-                    logging.info(LANG_MESSAGES.get('email_already_downloaded', "Email #{num} (hash {hash}...) has already been downloaded for '{user}'. Skipping.").format(num=i, hash=hash_correo[:10], user=user))
-                    print(LANG_MESSAGES.get('email_already_exists', f"      Correo #{i} ya existe en el registro. Omitiendo.").format(num=i))
-                    continue # Pasa al siguiente correo sin descargarlo de nuevo.
-                else:
-                    logging.info(LANG_MESSAGES.get('email_is_new', "Email #{num} (hash {hash}...) is new for '{user}'. Downloading full body.").format(num=i, hash=hash_correo[:10], user=user))
-                    print(LANG_MESSAGES.get('downloading_new_email', f"      Descargando correo nuevo #{i}...").format(num=i))
-                    pass
-                _, msg_bytes, _ = servidor_pop.retr(i)
-                msg = BytesParser(policy=policy.default).parsebytes(b'\r\n'.join(msg_bytes))
-                logging.debug(LANG_MESSAGES.get('email_body_downloaded', "Email body downloaded and parsed."))
-                metadatos_correo = guardar_correo_y_obtener_metadata(
-                    user, msg_bytes, msg, hash_correo, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist)
-                if metadatos_correo:
-                    all_emails_metadata.append(metadatos_correo) # Añade los metadatos a la lista global.
-                    existing_hashes.add(metadatos_correo["hash"]) # Añade el hash para futuras verificaciones.
-                    logging.info(LANG_MESSAGES.get('email_processed_saved_metadata_obtained', "Email #{num} processed, saved, and metadata obtained successfully.").format(num=i))
-                    print(LANG_MESSAGES.get('email_saved_metadata_registered', f"      Correo #{i} guardado y metadatos registrados.").format(num=i))
-                else:
-                    logging.error(LANG_MESSAGES.get('error_getting_or_saving_metadata', "ERROR: Could not get or save metadata for email #{num}. Hash will not be registered.").format(num=i))
-                    print(LANG_MESSAGES.get('email_save_metadata_failed', f"      [ERROR] No se pudo guardar el correo #{i} o sus metadatos.").format(num=i))
-                    pass
+                if error_pop:
+                    raise error_pop
+                with MEDIDOR_FASES.medir("headers", user):
+                    hash_correo = verificar_encabezados_mensaje(i, count, user, header_bytes, existing_hashes, indice_uidl, mapa_uidl)
+                    if hash_correo:
+                        hashes_reservados.add(hash_correo) # Un correo omitido o aplazado libera su hash al terminar la cuenta.
+                        if aplicar_politica_encabezados(i, user, header_bytes, hash_correo, tamanos.get(i), indice_uidl, mapa_uidl, mail_whitelist, mail_blacklist):
+                            mensajes_nuevos.append((i, hash_correo))
+            except poplib.error_proto as e:
+                registrar_error_pop_mensaje(i, user, e)
+            except Exception as e:
+                registrar_error_inesperado_mensaje(i, user, e)
+
+        # Fase 2: RETR de los mensajes nuevos, en el orden y hasta el presupuesto configurados.
+        mensajes_nuevos = planificar_descargas(mensajes_nuevos, tamanos, user)
+        hashes_nuevos = dict(mensajes_nuevos)
+        comandos_retr = [(i, f"RETR {i}") for i, _ in mensajes_nuevos]
+        crear_descarga = lambda _: DescargaEnCurso(directorio_guardado_usuario)
+        def al_guardar(metadatos_correo):
+            nuevos_metadatos.append(metadatos_correo) # El ciclo principal los combina con los de las demás cuentas.
+            hashes_reservados.discard(metadatos_correo["hash"]) # El hash queda registrado para futuras verificaciones.
+            confirmar_hash(metadatos_correo["hash"])
+            punto_control.anotar(metadatos_correo)
+            progreso.anotar(descargados=1)
+        etapas = EtapasDescarga(user, indice_uidl, mapa_uidl, (mail_whitelist, mail_blacklist, word_whitelist, word_blacklist), al_guardar)
+        respuestas_retr = iterar_respuestas_multilinea(servidor_pop, comandos_retr, ventana, crear_descarga)
+        for i, descarga, error_pop in MEDIDOR_FASES.medir_iteracion("retr", respuestas_retr, user):
+            mostrar('downloading_new_email', "      Descargando correo nuevo #{num}...", num=i)
+            try:
+                if error_pop:
+                    raise error_pop
+                MEDIDOR_FASES.contar("retr_bytes", descarga.bytes_recibidos, user)
+                etapas.agregar(i, descarga, hashes_nuevos[i]) # Se analiza mientras llega el siguiente (con parse_pipeline).
             except poplib.error_proto as e:
-                logging.error(LANG_MESSAGES.get('pop3_error_processing_email', "POP3 protocol error processing email #{num}: {error}. Skipping this email.").format(num=i, error=e) + f" for '{user}'.")
-                print(LANG_MESSAGES.get('pop3_error_processing_email', f"    [ERROR] Fallo de POP3 al procesar correo #{i}: {e}. Omitiendo este correo.").format(num=i, error=e))
-                continue # Continúa con el siguiente correo si hay un error de protocolo.
+                registrar_error_pop_mensaje(i, user, e)
             except Exception as e:
-                logging.error(LANG_MESSAGES.get('unexpected_error_processing_email', "Unexpected error processing email #{num}: {error}. Skipping this email.").format(num=i, error=e) + f" for '{user}'.")
-                print(LANG_MESSAGES.get('unexpected_error_processing_email', f"    [ERROR] Error inesperado al procesar correo #{i}: {e}. Omitiendo este correo.").format(num=i, error=e))
-                continue # Continúa con el siguiente correo si hay un error general.
+                registrar_error_inesperado_mensaje(i, user, e)
+        etapas.vaciar()
+        progreso.terminar()
         
+        punto_control.guardar() # Un fallo antes del final del ciclo ya no afecta a esta cuenta.
+        if indice_uidl is not None:
+            programar_guardado_indice_uidl(user, indice_uidl) # Se guarda cuando el almacén tenga los registros.
         logging.info(LANG_MESSAGES.get('finished_processing_emails', "Finished processing emails for account '{user}'. Closing connection.").format(user=user))
         if servidor_pop:
             try:
@@ -925,6 +3976,7 @@ def procesar_cuenta(account, all_emails_metadata, existing_hashes, mail_whitelis
                 print(LANG_MESSAGES.get('pop3_connection_close_error', f"  [WARNING] Error al cerrar la conexión para {user}.").format(user=user))
                 pass
     except Exception as e:
+        MEDIDOR_FASES.contar("errors", 1, user, type(e).__name__)
         logging.critical(LANG_MESSAGES.get('critical_account_processing_error', "CRITICAL ERROR: General failure processing account {user}: {error}. Moving to next account if applicable.").format(user=user, error=e))
         print(LANG_MESSAGES.get('critical_account_processing_error', f"  [CRITICAL ERROR] Fallo general al procesar la cuenta {user}: {e}. Pasando a la siguiente cuenta (si aplica).").format(user=user, error=e))
         if servidor_pop:
@@ -932,6 +3984,1030 @@ def procesar_cuenta(account, all_emails_metadata, existing_hashes, mail_whitelis
                 servidor_pop.quit()
             except Exception:
                 pass # Ignora errores al intentar cerrar la conexión si ya hay un error crítico.
+    finally:
+        # Los correos que no se pudieron guardar liberan su hash para reintentarse en otra cuenta o ciclo.
+        liberar_hashes(existing_hashes, hashes_reservados)
+        REGISTRO_FECHAS_CRUDAS.vaciar()
+    return nuevos_metadatos
+
+def procesar_cuenta_con_limite(account, semaforos_servidor, existing_hashes, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist):
+    """
+    Ejecuta procesar_cuenta respetando el límite de conexiones simultáneas al servidor de la cuenta.
+    """
+    with semaforos_servidor[account["server"].lower()]:
+        if PERFIL_ACTIVO is not None:
+            return PERFIL_ACTIVO.perfilar_hilo(procesar_cuenta, account, existing_hashes, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist)
+        return procesar_cuenta(account, existing_hashes, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist)
+
+def procesar_cuentas(accounts, all_emails_metadata, existing_hashes, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist):
+    """
+    Procesa las cuentas en paralelo con un número limitado de hilos y de conexiones por servidor.
+    Los metadatos nuevos de cada cuenta se añaden a all_emails_metadata desde este hilo
+    a medida que terminan las cuentas.
+    """
+    max_workers = max(1, SETTINGS["max_concurrent_accounts"])
+    max_por_servidor = max(1, SETTINGS["max_connections_per_server"])
+    semaforos_servidor = {account["server"].lower(): threading.BoundedSemaphore(max_por_servidor) for account in accounts}
+    logging.info(LANG_MESSAGES.get('concurrent_processing_started', "Processing {count} account(s) with up to {workers} at a time ({per_server} per server).").format(count=len(accounts), workers=max_workers, per_server=max_por_servidor))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cuenta") as executor:
+        futuros = {
+            executor.submit(procesar_cuenta_con_limite, account, semaforos_servidor, existing_hashes, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist): account
+            for account in accounts
+        }
+        for futuro in as_completed(futuros):
+            user = futuros[futuro]["user"]
+            try:
+                all_emails_metadata.extend(futuro.result())
+            except Exception as e:
+                MEDIDOR_FASES.contar("errors", 1, user, type(e).__name__)
+                logging.critical(LANG_MESSAGES.get('critical_account_processing_error', "CRITICAL ERROR: General failure processing account {user}: {error}. Moving to next account if applicable.").format(user=user, error=e))
+
+def crear_contexto_tls():
+    """
+    Contexto TLS de las conexiones POP3S y STLS, el mismo para los dos transportes.
+    Sin "tls_verify" es el contexto que poplib usa por defecto (cifrado, sin verificar el certificado).
+    """
+    if SETTINGS["tls_verify"]:
+        return ssl.create_default_context()
+    return ssl._create_unverified_context()
+
+# --- Transporte asyncio (alternativa a poplib para cientos de buzones en un solo hilo) ---
+class ClientePOP3Asincrono:
+    """
+    Cliente POP3/POP3S mínimo sobre asyncio, con STLS y pipelining de comandos.
+    Las respuestas -ERR se señalan con poplib.error_proto, igual que en poplib, para
+    compartir el manejo de errores con el transporte por hilos.
+    """
+    LIMITE_LINEA = 64 * 1024 # Límite de longitud de línea del StreamReader.
+    LOTE_ESCRITURA = 256 * 1024 # Bytes de una respuesta que se acumulan antes de escribirlos desde un hilo.
+
+    def __init__(self, server, port, timeout=30):
+        self.server = server
+        self.port = port
+        self.timeout = timeout # Segundos máximos por operación, como el timeout de poplib.
+        self.reader = None
+        self.writer = None
+
+    async def conectar(self, usar_ssl):
+        """
+        Abre la conexión (con SSL directo si usar_ssl) y lee el saludo del servidor.
+        """
+        contexto_ssl = crear_contexto_tls() if usar_ssl else None
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.server, self.port, ssl=contexto_ssl, limit=self.LIMITE_LINEA), self.timeout)
+        return await self._leer_respuesta()
+
+    async def stls(self):
+        """
+        Actualiza la conexión a TLS con el comando STLS (RFC 2595).
+        """
+        await self.comando("STLS")
+        await asyncio.wait_for(self.writer.start_tls(crear_contexto_tls(), server_hostname=self.server), self.timeout)
+
+    async def _leer_linea(self):
+        linea = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not linea:
+            raise ConnectionError(f"Connection closed by {self.server}:{self.port}")
+        return linea[:-2] if linea.endswith(b'\r\n') else linea[:-1]
+
+    async def _leer_respuesta(self):
+        respuesta = await self._leer_linea()
+        if not respuesta.startswith(b'+'):
+            raise poplib.error_proto(respuesta)
+        return respuesta
+
+    async def _leer_respuesta_multilinea(self):
+        respuesta = await self._leer_respuesta()
+        lineas = []
+        while True:
+            linea = await self._leer_linea()
+            if linea == b'.':
+                break
+            if linea.startswith(b'..'):
+                linea = linea[1:] # Elimina el punto de relleno (byte-stuffing).
+            lineas.append(linea)
+        return respuesta, lineas
+
+    async def _leer_lineas_a_destino(self, crear_destino, clave):
+        """
+        Equivalente asíncrono de leer_lineas_a_destino para el cuerpo de una respuesta +OK.
+        El destino se crea y se escribe desde un hilo auxiliar, en lotes de LOTE_ESCRITURA bytes,
+        para que el disco (y la compresión) no bloqueen el bucle de eventos.
+        """
+        destino = None
+        escritura = None
+        def escribir(lineas, final):
+            nonlocal destino
+            if destino is None:
+                destino = crear_destino(clave)
+            for linea in lineas:
+                destino.escribir_linea(linea)
+            if final:
+                destino.cerrar()
+        async def escribir_en_hilo(lineas, final=False):
+            nonlocal escritura
+            escritura = asyncio.ensure_future(asyncio.to_thread(escribir, lineas, final))
+            await asyncio.shield(escritura)
+        lote, tamano_lote = [], 0
+        try:
+            while True:
+                linea = await self._leer_linea()
+                if linea == b'.':
+                    break
+                if linea.startswith(b'..'):
+                    linea = linea[1:]
+                lote.append(linea)
+                tamano_lote += len(linea)
+                if tamano_lote >= self.LOTE_ESCRITURA:
+                    await escribir_en_hilo(lote)
+                    lote, tamano_lote = [], 0
+            await escribir_en_hilo(lote, final=True)
+        except BaseException:
+            if escritura is not None and not escritura.done():
+                await asyncio.wait([escritura]) # No descartar el archivo mientras el hilo aún escribe en él.
+            if destino is not None:
+                destino.descartar()
+            raise
+        return destino
+
+    async def _enviar(self, comandos):
+        self.writer.write(b''.join(comando.encode('utf-8') + b'\r\n' for comando in comandos))
+        await self.writer.drain()
+
+    async def comando(self, comando):
+        await self._enviar([comando])
+        return await self._leer_respuesta()
+
+    async def comando_multilinea(self, comando):
+        await self._enviar([comando])
+        return await self._leer_respuesta_multilinea()
+
+    async def capa(self):
+        """
+        Retorna las capacidades del servidor con el mismo formato que poplib.POP3.capa().
+        """
+        _, lineas = await self.comando_multilinea("CAPA")
+        capacidades = {}
+        for linea in lineas:
+            partes = linea.decode('ascii', errors='replace').split()
+            if partes:
+                capacidades[partes[0]] = partes[1:]
+        return capacidades
+
+    async def iterar_respuestas_multilinea(self, comandos, ventana, crear_destino=None):
+        """
+        Equivalente asíncrono de iterar_respuestas_multilinea: mantiene hasta `ventana`
+        comandos pendientes y genera (clave, lineas, error) en el orden de envío.
+        """
+        pendientes = deque()
+        siguiente = 0
+        while siguiente < len(comandos) or pendientes:
+            lote = comandos[siguiente:siguiente + ventana - len(pendientes)]
+            if lote:
+                await self._enviar([comando for _, comando in lote])
+                pendientes.extend(clave for clave, _ in lote)
+                siguiente += len(lote)
+            clave = pendientes.popleft()
+            try:
+                if crear_destino is None:
+                    _, lineas = await self._leer_respuesta_multilinea()
+                else:
+                    # El destino se crea después de leer el estado, para no dejar temporales ante un -ERR.
+                    await self._leer_respuesta()
+                    lineas = await self._leer_lineas_a_destino(crear_destino, clave)
+            except poplib.error_proto as e:
+                yield clave, None, e
+                continue
+            yield clave, lineas, None
+
+    async def cerrar(self, enviar_quit=True):
+        """
+        Envía QUIT (opcional) y cierra el socket.
+        """
+        if self.writer is None:
+            return
+        try:
+            if enviar_quit:
+                await self.comando("QUIT")
+        finally:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+            self.writer = None
+
+async def procesar_cuenta_async(account, existing_hashes, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist):
+    """
+    Versión asíncrona de procesar_cuenta sobre ClientePOP3Asincrono.
+    El parseo y guardado de cada correo se ejecuta en un hilo auxiliar para no bloquear el bucle de eventos.
+    Retorna la lista de metadatos de los correos nuevos de la cuenta.
+    """
+    user = account["user"]
+    server = account["server"]
+    port = account["port"]
+    cliente = ClientePOP3Asincrono(server, port, timeout=30)
+    inicio_cuenta = time.perf_counter()
+    nuevos_metadatos = []
+    hashes_reservados = set()
+    logging.info(LANG_MESSAGES.get('starting_account_processing', "Starting account processing: '{user}' on {server}:{port}.").format(user=user, server=server, port=port))
+    print(LANG_MESSAGES.get('processing_account', "\n  >>> Procesando cuenta: {user} <<<").format(user=user))
+    etapas = punto_control = progreso = None
+    indice_uidl = None
+    tarea_en_hilo = None
+    cuenta_terminada = False
+    limite_cuenta = asyncio.timeout(SETTINGS["account_timeout_seconds"])
+
+    async def en_hilo(funcion, *argumentos):
+        # Si la cuenta se cancela, el hilo sigue hasta terminar; la limpieza lo espera antes de vaciar las etapas.
+        nonlocal tarea_en_hilo
+        tarea_en_hilo = asyncio.ensure_future(asyncio.to_thread(funcion, *argumentos))
+        return await asyncio.shield(tarea_en_hilo)
+
+    try:
+        async with limite_cuenta:
+            logging.info(LANG_MESSAGES.get('connecting_to_server', "Connecting to {server}:{port}...").format(server=server, port=port))
+            if port == 995:
+                await cliente.conectar(usar_ssl=True)
+                logging.info(LANG_MESSAGES.get('ssl_connection_established', "SSL connection established with {server}:{port}.").format(server=server, port=port))
+            else:
+                await cliente.conectar(usar_ssl=False)
+                logging.info(LANG_MESSAGES.get('non_secure_connection_established', "Non-secure connection established with {server}:{port}. Attempting to start TLS...").format(server=server, port=port))
+                try:
+                    await cliente.stls()
+                    logging.info(LANG_MESSAGES.get('tls_started_successfully', "TLS started successfully."))
+                except poplib.error_proto as e:
+                    logging.warning(LANG_MESSAGES.get('warning_tls_not_started', "WARNING: Could not start TLS for account '{user}'. Connection might not be secure. Details: {e}").format(user=user, e=e))
+
+            logging.info(LANG_MESSAGES.get('authenticating_user', "Authenticating user '{user}'...").format(user=user))
+            try:
+                await cliente.comando(f"USER {user}")
+                await cliente.comando(f"PASS {account['password']}")
+                logging.info(LANG_MESSAGES.get('auth_successful', "Authentication successful for '{user}'.").format(user=user))
+            except poplib.error_proto as e:
+                MEDIDOR_FASES.contar("errors", 1, user, "authentication")
+                logging.error(LANG_MESSAGES.get('auth_failed', "Authentication failed for {user}. Please check credentials.").format(user=user) + f" Details: {e}")
+                print(LANG_MESSAGES.get('auth_failed', "  [ERROR] Falló la autenticación para {user}. Verifique sus credenciales.").format(user=user))
+                return nuevos_metadatos
+
+            respuesta_stat = await cliente.comando("STAT")
+            count, total_size = (int(valor) for valor in respuesta_stat.split()[1:3])
+            logging.info(LANG_MESSAGES.get('mailbox_status_info', "Mailbox for '{user}': {count} email(s) with a total size of {total_size} bytes.").format(user=user, count=count, total_size=total_size))
+            print(LANG_MESSAGES.get('mailbox_status', "  Buzón de '{user}': {count} correo(s) en total.").format(user=user, count=count))
+
+            MEDIDOR_FASES.registrar("connect", time.perf_counter() - inicio_cuenta, user) # Conexión, TLS, autenticación y STAT.
+            directorio_guardado_usuario = await asyncio.to_thread(crear_estructura_directorios_usuario, user)
+            await asyncio.to_thread(limpiar_descargas_incompletas, directorio_guardado_usuario)
+            inicio_listado = time.perf_counter()
+            if count == 0:
+                logging.info(LANG_MESSAGES.get('no_new_emails', "No new emails in mailbox for '{user}'.").format(user=user))
+
+            mapa_uidl = None
+            if count > 0:
+                try:
+                    _, lineas_uidl = await cliente.comando_multilinea("UIDL")
+                    mapa_uidl = parsear_lineas_uidl(lineas_uidl)
+                except poplib.error_proto:
+                    logging.info(LANG_MESSAGES.get('uidl_not_supported', "Server for '{user}' does not support UIDL. Using header hash verification.").format(user=user))
+            indice_uidl, mensajes_a_verificar = await asyncio.to_thread(preparar_mensajes_a_verificar, user, count, mapa_uidl) # Lee el índice UIDL.
+            punto_control = PuntoDeControlCuenta(user, indice_uidl)
+            progreso = ProgresoCuenta(user, len(mensajes_a_verificar))
+            ventana = 1
+            if mensajes_a_verificar:
+                try:
+                    capacidades = await cliente.capa()
+                except poplib.error_proto:
+                    capacidades = {}
+                ventana = calcular_ventana_pipelining(capacidades, user)
+            tamanos = {}
+            if mensajes_a_verificar and necesita_tamanos_list():
+                try:
+                    _, lineas_list = await cliente.comando_multilinea("LIST")
+                    tamanos = parsear_lineas_list(lineas_list)
+                except poplib.error_proto as e:
+                    logging.warning(LANG_MESSAGES.get('list_not_supported', "WARNING: LIST failed for '{user}'; message size limits are not applied this cycle. Details: {e}").format(user=user, e=e))
+            MEDIDOR_FASES.registrar("list", time.perf_counter() - inicio_listado, user)
+
+            mensajes_nuevos = []
+            comandos_top = [(i, f"TOP {i} 0") for i in mensajes_a_verificar]
+            async for i, header_bytes, error_pop in MEDIDOR_FASES.medir_iteracion_async("top", cliente.iterar_respuestas_multilinea(comandos_top, ventana), user):
+                progreso.anotar(verificados=1)
+                try:
+                    if error_pop:
+                        raise error_pop
+                    with MEDIDOR_FASES.medir("headers", user):
+                        hash_correo = verificar_encabezados_mensaje(i, count, user, header_bytes, existing_hashes, indice_uidl, mapa_uidl)
+                        if hash_correo:
+                            hashes_reservados.add(hash_correo) # Un correo omitido o aplazado libera su hash al terminar la cuenta.
+                            # Una omisión se anexa a SKIPPED_MESSAGES_FILE, así que la política se evalúa en un hilo.
+                            if not politica_encabezados_activa() or await asyncio.to_thread(
+                                    aplicar_politica_encabezados, i, user, header_bytes, hash_correo, tamanos.get(i), indice_uidl, mapa_uidl, mail_whitelist, mail_blacklist):
+                                mensajes_nuevos.append((i, hash_correo))
+                except poplib.error_proto as e:
+                    registrar_error_pop_mensaje(i, user, e)
+                except Exception as e:
+                    registrar_error_inesperado_mensaje(i, user, e)
+
+            mensajes_nuevos = planificar_descargas(mensajes_nuevos, tamanos, user)
+            hashes_nuevos = dict(mensajes_nuevos)
+            comandos_retr = [(i, f"RETR {i}") for i, _ in mensajes_nuevos]
+            crear_descarga = lambda _: DescargaEnCurso(directorio_guardado_usuario)
+            def al_guardar(metadatos_correo):
+                nuevos_metadatos.append(metadatos_correo)
+                hashes_reservados.discard(metadatos_correo["hash"])
+                confirmar_hash(metadatos_correo["hash"])
+                punto_control.anotar(metadatos_correo)
+                progreso.anotar(descargados=1)
+            etapas = EtapasDescarga(user, indice_uidl, mapa_uidl, (mail_whitelist, mail_blacklist, word_whitelist, word_blacklist), al_guardar)
+            respuestas_retr = cliente.iterar_respuestas_multilinea(comandos_retr, ventana, crear_descarga)
+            async for i, descarga, error_pop in MEDIDOR_FASES.medir_iteracion_async("retr", respuestas_retr, user):
+                try:
+                    if error_pop:
+                        raise error_pop
+                    MEDIDOR_FASES.contar("retr_bytes", descarga.bytes_recibidos, user)
+                    await en_hilo(etapas.agregar, i, descarga, hashes_nuevos[i]) # Puede esperar al análisis o hacer fsync.
+                except poplib.error_proto as e:
+                    registrar_error_pop_mensaje(i, user, e)
+                except Exception as e:
+                    registrar_error_inesperado_mensaje(i, user, e)
+            await en_hilo(etapas.vaciar)
+            progreso.terminar()
+
+            await asyncio.to_thread(punto_control.guardar)
+            if indice_uidl is not None:
+                programar_guardado_indice_uidl(user, indice_uidl)
+            cuenta_terminada = True
+            logging.info(LANG_MESSAGES.get('finished_processing_emails', "Finished processing emails for account '{user}'. Closing connection.").format(user=user))
+            await cliente.cerrar()
+            logging.info(LANG_MESSAGES.get('pop3_connection_closed_successfully', "POP3 connection closed successfully."))
+    except Exception as e:
+        if isinstance(e, TimeoutError) and limite_cuenta.expired(): # No un TimeoutError de una lectura del socket.
+            MEDIDOR_FASES.contar("errors", 1, user, "account_timeout")
+            logging.error(LANG_MESSAGES.get('account_timeout', "Account '{user}' exceeded the {seconds} second limit for this cycle and was cancelled.").format(user=user, seconds=SETTINGS["account_timeout_seconds"]))
+        else:
+            MEDIDOR_FASES.contar("errors", 1, user, type(e).__name__)
+            logging.critical(LANG_MESSAGES.get('critical_account_processing_error', "CRITICAL ERROR: General failure processing account {user}: {error}. Moving to next account if applicable.").format(user=user, error=e))
+    finally:
+        if not cuenta_terminada and punto_control is not None:
+            # Cuenta interrumpida: los correos ya guardados conservan sus metadatos (punto de control y resultado).
+            try:
+                if tarea_en_hilo is not None:
+                    await asyncio.wait([tarea_en_hilo])
+                if etapas is not None:
+                    await asyncio.to_thread(etapas.vaciar)
+                    progreso.terminar()
+                await asyncio.to_thread(punto_control.guardar)
+                if indice_uidl is not None:
+                    programar_guardado_indice_uidl(user, indice_uidl)
+            except Exception as e:
+                logging.error(LANG_MESSAGES.get('interrupted_account_flush_error', "ERROR: Could not record the emails already saved for '{user}' after the interruption. Details: {e}").format(user=user, e=e))
+        liberar_hashes(existing_hashes, hashes_reservados)
+        REGISTRO_FECHAS_CRUDAS.vaciar()
+        try:
+            await cliente.cerrar(enviar_quit=False)
+        except Exception:
+            pass
+    return nuevos_metadatos
+
+async def procesar_cuentas_async(accounts, all_emails_metadata, existing_hashes, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist):
+    """
+    Procesa todas las cuentas desde un único bucle de eventos, con los mismos límites de
+    concurrencia que procesar_cuentas y un tiempo máximo por cuenta (account_timeout_seconds).
+    """
+    max_concurrentes = max(1, SETTINGS["max_concurrent_accounts"])
+    max_por_servidor = max(1, SETTINGS["max_connections_per_server"])
+    limite_global = asyncio.Semaphore(max_concurrentes)
+    semaforos_servidor = {account["server"].lower(): asyncio.Semaphore(max_por_servidor) for account in accounts}
+    logging.info(LANG_MESSAGES.get('concurrent_processing_started', "Processing {count} account(s) with up to {workers} at a time ({per_server} per server).").format(count=len(accounts), workers=max_concurrentes, per_server=max_por_servidor))
+
+    async def procesar_con_limite(account):
+        # Primero el límite del servidor, para no ocupar un cupo global mientras se espera al servidor.
+        async with semaforos_servidor[account["server"].lower()]:
+            async with limite_global:
+                return await procesar_cuenta_async(account, existing_hashes, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist)
+
+    resultados = await asyncio.gather(*(procesar_con_limite(account) for account in accounts), return_exceptions=True)
+    for account, resultado in zip(accounts, resultados):
+        if isinstance(resultado, BaseException):
+            MEDIDOR_FASES.contar("errors", 1, account["user"], type(resultado).__name__)
+            logging.critical(LANG_MESSAGES.get('critical_account_processing_error', "CRITICAL ERROR: General failure processing account {user}: {error}. Moving to next account if applicable.").format(user=account["user"], error=resultado))
+        else:
+            all_emails_metadata.extend(resultado)
+
+def ejecutar_ciclo(almacen_metadatos):
+    """
+    Ejecuta un ciclo de verificación: carga cuentas y filtros, procesa todas las cuentas
+    y registra los metadatos nuevos en el almacén.
+    """
+    accounts = parse_accounts()
+    if not accounts:
+        print(LANG_MESSAGES.get('no_valid_accounts', "No se encontraron cuentas válidas. Esperando el próximo ciclo."))
+        logging.warning(LANG_MESSAGES.get('no_valid_accounts', "No valid accounts found. Waiting for next cycle."))
+        return
+    recuperar_puntos_de_control(almacen_metadatos) # Correos de un ciclo anterior interrumpido.
+    descartar_indices_uidl_pendientes() # De un ciclo interrumpido antes de actualizar el almacén.
+    existing_hashes = almacen_metadatos.cargar_hashes()
+    nuevos_metadatos = [] # Solo los metadatos nuevos de este ciclo; los anteriores ya están en el almacén.
+    # Reglas compiladas; solo se recompilan si cambió spam_config.json o alguna lista de FILTERS_DIR.
+    mail_whitelist, mail_blacklist, word_whitelist, word_blacklist = load_spam_config()
+    print(f"  {LANG_MESSAGES.get('filters_loaded', 'Filter lists loaded successfully.')}")
+
+    if SETTINGS["transport"] == "asyncio":
+        asyncio.run(procesar_cuentas_async(accounts, nuevos_metadatos, existing_hashes, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist))
+    else:
+        procesar_cuentas(accounts, nuevos_metadatos, existing_hashes, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist)
+    with MEDIDOR_FASES.medir("fsync"):
+        sincronizar_escrituras_pendientes() # Un fsync por archivo al final del ciclo en lugar de uno por correo durante la descarga.
+    REGISTRO_FECHAS_CRUDAS.vaciar()
+    reportar_ahorro_blobs()
+    with MEDIDOR_FASES.medir("store"):
+        try:
+            almacen_metadatos.agregar(nuevos_metadatos)
+        except Exception as e:
+            logging.error(LANG_MESSAGES.get('metadata_store_write_error', "ERROR: Could not record {count} new email(s) in the '{backend}' metadata store. They are kept in the checkpoints and will be recorded in the next cycle. Details: {e}").format(count=len(nuevos_metadatos), backend=almacen_metadatos.nombre, e=e))
+            guardar_diario_del_ciclo(nuevos_metadatos)
+            descartar_indices_uidl_pendientes()
+            return # Los diarios se conservan hasta que el almacén confirme la escritura.
+        guardar_indices_uidl_pendientes()
+        descartar_puntos_de_control() # Sus correos ya están en el almacén.
+        if nuevos_metadatos and SETTINGS["export_viewer_json"]:
+            almacen_metadatos.exportar_json()
+
+# --- Perfil de ciclos (--profile y archivo profile_cycle.txt) ---
+PERFIL_ACTIVO = None # PerfilCiclos del ciclo en curso, si se está perfilando.
+
+class PerfilCiclos:
+    """
+    Perfil de CPU (cProfile) y de memoria (tracemalloc) de uno o varios ciclos. Al terminar escribe en
+    LOG_DIR_SCRIPT profile_<fecha>.prof (para pstats, snakeviz...) y profile_<fecha>.txt con las
+    funciones más costosas y los puntos del código que más memoria asignaron durante los ciclos.
+    Desde Python 3.12 cProfile mide todos los hilos; en versiones anteriores solo el que lo activa, así
+    que cada hilo de cuenta usa su propio perfil (perfilar_hilo) y se combinan al final.
+    """
+    TODOS_LOS_HILOS = sys.version_info >= (3, 12)
+    MAXIMO_LINEAS = 40 # Funciones y puntos de asignación que se listan en el informe de texto.
+
+    def __init__(self, ciclos):
+        self.ciclos = max(1, ciclos)
+        self.ciclos_medidos = 0
+        self.segundos = 0.0
+        self.perfil = cProfile.Profile()
+        self.perfiles_hilos = []
+        self.bloqueo = threading.Lock()
+        self.tracemalloc_previo = tracemalloc.is_tracing()
+        if not self.tracemalloc_previo:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self.instantanea_inicial = tracemalloc.take_snapshot()
+        logging.info(LANG_MESSAGES.get('profile_started', "Profiling the next {cycles} cycle(s) with cProfile and tracemalloc.").format(cycles=self.ciclos))
+        print(LANG_MESSAGES.get('profile_started', "Profiling the next {cycles} cycle(s) with cProfile and tracemalloc.").format(cycles=self.ciclos))
+
+    def ejecutar_ciclo(self, funcion, *argumentos):
+        global PERFIL_ACTIVO
+        PERFIL_ACTIVO = self
+        inicio = time.perf_counter()
+        try:
+            return self.perfil.runcall(funcion, *argumentos)
+        finally:
+            self.segundos += time.perf_counter() - inicio
+            self.ciclos_medidos += 1
+            PERFIL_ACTIVO = None
+
+    def perfilar_hilo(self, funcion, *argumentos):
+        """
+        Ejecuta `funcion` en un hilo de trabajo del ciclo, con su propio perfil si cProfile no mide todos los hilos.
+        """
+        if self.TODOS_LOS_HILOS:
+            return funcion(*argumentos)
+        perfil = cProfile.Profile()
+        try:
+            return perfil.runcall(funcion, *argumentos)
+        finally:
+            with self.bloqueo:
+                self.perfiles_hilos.append(perfil)
+
+    def terminado(self):
+        return self.ciclos_medidos >= self.ciclos
+
+    def escribir_informe(self):
+        """
+        Escribe los archivos del perfil y detiene tracemalloc si lo inició este perfil. Retorna la ruta base.
+        """
+        instantanea = tracemalloc.take_snapshot()
+        actual, pico = tracemalloc.get_traced_memory()
+        if not self.tracemalloc_previo:
+            tracemalloc.stop()
+        ruta_base = os.path.join(LOG_DIR_SCRIPT, f"profile_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}")
+        estadisticas = pstats.Stats(self.perfil)
+        with self.bloqueo:
+            if self.perfiles_hilos:
+                estadisticas.add(*self.perfiles_hilos)
+        estadisticas.dump_stats(ruta_base + ".prof")
+
+        texto = io.StringIO()
+        estadisticas.stream = texto
+        texto.write(f"Profiled cycles: {self.ciclos_medidos}, {self.segundos:.2f} s\n")
+        texto.write(f"Python {sys.version.split()[0]}, {'all threads' if self.TODOS_LOS_HILOS else 'main and account threads'} profiled\n")
+        texto.write(f"Traced memory: {actual / 1048576:.1f} MB at the end, {pico / 1048576:.1f} MB peak\n\n")
+        estadisticas.sort_stats("cumulative").print_stats(self.MAXIMO_LINEAS)
+        estadisticas.sort_stats("tottime").print_stats(self.MAXIMO_LINEAS)
+        filtros = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+        diferencias = instantanea.filter_traces(filtros).compare_to(self.instantanea_inicial.filter_traces(filtros), 'lineno')
+        texto.write(f"Top {self.MAXIMO_LINEAS} allocation sites (memory still held, change during the profiled cycles):\n")
+        for diferencia in diferencias[:self.MAXIMO_LINEAS]:
+            texto.write(f"  {diferencia}\n")
+        escribir_archivo_atomico(ruta_base + ".txt", lambda f: f.write(texto.getvalue()))
+        logging.info(LANG_MESSAGES.get('profile_saved', "Profile saved to '{path}.txt' and '{path}.prof'.").format(path=ruta_base))
+        print(LANG_MESSAGES.get('profile_saved', "Profile saved to '{path}.txt' and '{path}.prof'.").format(path=ruta_base))
+        return ruta_base
+
+def leer_solicitud_perfil():
+    """
+    Si existe PROFILE_TRIGGER_FILE_PATH, lo elimina y retorna el número de ciclos que pide su contenido
+    (1 si está vacío). Retorna 0 si no hay solicitud.
+    """
+    try:
+        with open(PROFILE_TRIGGER_FILE_PATH, 'r', encoding='utf-8') as f:
+            contenido = f.read().strip()
+    except FileNotFoundError:
+        return 0
+    except OSError as e:
+        logging.warning(LANG_MESSAGES.get('profile_trigger_unreadable', "WARNING: Could not read '{path}': {error}").format(path=PROFILE_TRIGGER_FILE_PATH, error=e))
+        return 0
+    try:
+        os.remove(PROFILE_TRIGGER_FILE_PATH)
+    except OSError as e:
+        logging.warning(LANG_MESSAGES.get('trigger_file_delete_failed', "Could not delete trigger file '{path}': {error}").format(path=PROFILE_TRIGGER_FILE_PATH, error=e))
+    try:
+        return max(1, int(contenido)) if contenido else 1
+    except ValueError:
+        logging.warning(LANG_MESSAGES.get('profile_trigger_invalid', "WARNING: '{path}' should contain a number of cycles; profiling 1 cycle.").format(path=PROFILE_TRIGGER_FILE_PATH))
+        return 1
+
+def perfilar_ciclos(ciclos):
+    """
+    Modo --profile: ejecuta `ciclos` ciclos seguidos con el perfil activo, escribe el informe y termina.
+    """
+    almacen_metadatos = crear_almacen_metadatos()
+    perfil = PerfilCiclos(ciclos)
+    try:
+        while not perfil.terminado():
+            perfil.ejecutar_ciclo(ejecutar_ciclo, almacen_metadatos)
+    finally:
+        perfil.escribir_informe()
+        almacen_metadatos.cerrar()
+
+# --- Exportación de métricas (formato de texto de Prometheus) ---
+METRICAS_CONTADORES = { # Contador de MEDIDOR_FASES -> (métrica, etiqueta de `detalle`, descripción)
+    "retr_bytes": ("pop3_downloader_downloaded_bytes_total", None, "Bytes received in RETR responses."),
+    "messages": ("pop3_downloader_messages_total", "result", "Messages by result: new (downloaded), known (seen in a previous cycle), skipped or deferred by the header policy."),
+    "errors": ("pop3_downloader_errors_total", "type", "Errors by type."),
+}
+
+def _escapar_etiqueta(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _etiquetas(**etiquetas):
+    pares = [f'{nombre}="{_escapar_etiqueta(valor)}"' for nombre, valor in etiquetas.items() if valor != ""]
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+def formatear_metricas():
+    """
+    Retorna las métricas de MEDIDOR_FASES en el formato de texto de Prometheus: un histograma del
+    tiempo de cada fase por cuenta, los contadores de METRICAS_CONTADORES y los indicadores del ciclo.
+    """
+    fases, contadores, indicadores = MEDIDOR_FASES.copiar()
+    lineas = [
+        "# HELP pop3_downloader_phase_seconds Time spent in each phase of the download cycle.",
+        "# TYPE pop3_downloader_phase_seconds histogram",
+    ]
+    for (fase, cuenta), (mediciones, segundos, cubetas) in sorted(fases.items()):
+        acumulado = 0
+        for limite, cantidad in zip((*MedidorFases.CUBETAS, "+Inf"), cubetas):
+            acumulado += cantidad
+            lineas.append(f"pop3_downloader_phase_seconds_bucket{_etiquetas(phase=fase, account=cuenta, le=limite)} {acumulado}")
+        lineas.append(f"pop3_downloader_phase_seconds_sum{_etiquetas(phase=fase, account=cuenta)} {segundos:.6f}")
+        lineas.append(f"pop3_downloader_phase_seconds_count{_etiquetas(phase=fase, account=cuenta)} {mediciones}")
+    for nombre, (metrica, etiqueta, descripcion) in METRICAS_CONTADORES.items():
+        lineas += [f"# HELP {metrica} {descripcion}", f"# TYPE {metrica} counter"]
+        for (nombre_contador, cuenta, detalle), valor in sorted(contadores.items()):
+            if nombre_contador == nombre:
+                lineas.append(f"{metrica}{_etiquetas(account=cuenta, **({etiqueta: detalle} if etiqueta else {}))} {valor}")
+    lineas += [
+        "# HELP pop3_downloader_last_cycle_timestamp_seconds Unix time at which the last cycle finished.",
+        "# TYPE pop3_downloader_last_cycle_timestamp_seconds gauge",
+        f"pop3_downloader_last_cycle_timestamp_seconds {indicadores.get('last_cycle_timestamp', 0):.3f}",
+    ]
+    return "\n".join(lineas) + "\n"
+
+def escribir_archivo_metricas():
+    """
+    Escribe METRICS_FILE si metrics_file está activado (un recolector como el "textfile" de
+    node_exporter puede leerlo en cualquier momento: se reemplaza de forma atómica).
+    """
+    if not SETTINGS["metrics_file"]:
+        return
+    try:
+        escribir_archivo_atomico(METRICS_FILE, lambda f: f.write(formatear_metricas()))
+        os.chmod(METRICS_FILE, 0o644) # Legible por un recolector que se ejecute con otro usuario.
+    except OSError as e:
+        logging.warning(LANG_MESSAGES.get('metrics_write_failed', "WARNING: Could not write the metrics file '{path}': {error}").format(path=METRICS_FILE, error=e))
+
+def _escribir_metricas_periodicamente():
+    while True:
+        time.sleep(max(1, SETTINGS["metrics_interval"]))
+        escribir_archivo_metricas()
+
+class ManejadorMetricas(http.server.BaseHTTPRequestHandler):
+    """
+    Responde GET /metrics con formatear_metricas().
+    """
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        cuerpo = formatear_metricas().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *argumentos):
+        pass # Cada consulta del recolector no se registra.
+
+def iniciar_exportacion_metricas():
+    """
+    Inicia, según la configuración, la escritura periódica de METRICS_FILE y el endpoint HTTP local.
+    """
+    if SETTINGS["metrics_file"]:
+        threading.Thread(target=_escribir_metricas_periodicamente, name="metricas", daemon=True).start()
+    if SETTINGS["metrics_port"]:
+        try:
+            servidor = http.server.ThreadingHTTPServer(("127.0.0.1", SETTINGS["metrics_port"]), ManejadorMetricas)
+        except OSError as e:
+            logging.error(LANG_MESSAGES.get('metrics_endpoint_failed', "Could not start the metrics endpoint on port {port}: {error}").format(port=SETTINGS["metrics_port"], error=e))
+            return
+        servidor.daemon_threads = True
+        threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+        logging.info(LANG_MESSAGES.get('metrics_endpoint_started', "Metrics available at http://127.0.0.1:{port}/metrics").format(port=SETTINGS["metrics_port"]))
+
+# --- Servidor POP3 de prueba y banco de pruebas de rendimiento ---
+BENCHMARK_PREDETERMINADO = {
+    "accounts": 2, # Buzones del servidor de prueba (bench0@bench.example, bench1@bench.example...).
+    "messages": 500, # Correos por buzón.
+    "size_kb": 20, # Mediana del tamaño de los correos, en KB.
+    "size_spread": 1.0, # Dispersión (sigma) de la distribución log-normal de tamaños; 0 = todos del mismo tamaño.
+    "attachment_ratio": 0.3, # Proporción de correos con un adjunto binario (base64).
+    "latency_ms": 0, # Retardo de cada respuesta desde que llega su comando, como el tiempo de ida y vuelta de la red.
+    "uidl": True, # Ofrece UIDL; sin él, cada ciclo verifica el buzón completo con TOP.
+    "pipelining": True, # Anuncia PIPELINING en CAPA.
+    "certfile": "", # Certificado PEM para ofrecer STLS (y POP3S directo si port es 995).
+    "keyfile": "", # Clave del certificado, si no está incluida en certfile.
+    "host": "127.0.0.1",
+    "port": 0, # 0 = un puerto libre.
+    "seed": 1, # Semilla de los buzones sintéticos; la misma semilla genera los mismos correos.
+    "cycles": 2, # Ciclos medidos: el primero descarga todo y los siguientes solo verifican.
+    "settings": {}, # Opciones de settings.json para el proceso medido, p. ej. {"transport": "asyncio"}.
+}
+
+PALABRAS_SINTETICAS = (
+    "the", "report", "meeting", "invoice", "project", "update", "please", "review", "attached", "schedule",
+    "customer", "order", "delivery", "account", "balance", "thanks", "regards", "team", "budget", "quarter",
+    "proposal", "contract", "approval", "status", "request", "support", "ticket", "release", "server", "backup",
+)
+
+def cargar_especificacion_banco(ruta=None):
+    """
+    Retorna BENCHMARK_PREDETERMINADO combinado con las claves del archivo JSON `ruta` (si se indica).
+    """
+    especificacion = dict(BENCHMARK_PREDETERMINADO)
+    if ruta:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            especificacion.update(json.load(f))
+    return especificacion
+
+def _texto_sintetico(rng, tamano):
+    lineas = []
+    total = 0
+    while total < tamano:
+        linea = " ".join(rng.choices(PALABRAS_SINTETICAS, k=10))
+        lineas.append(linea)
+        total += len(linea) + 2
+    return "\r\n".join(lineas).encode('ascii')
+
+def generar_buzon_sintetico(usuario, especificacion):
+    """
+    Genera los correos sintéticos (bytes con CRLF, sin relleno de puntos) del buzón de `usuario`.
+    Los tamaños siguen una distribución log-normal con mediana size_kb; una proporción attachment_ratio
+    lleva un adjunto binario en base64, que ocupa la mayor parte del correo.
+    """
+    rng = random.Random(f"{especificacion['seed']}:{usuario}")
+    mediana = max(1, especificacion["size_kb"]) * 1024
+    correos = []
+    for n in range(especificacion["messages"]):
+        tamano = max(512, int(rng.lognormvariate(math.log(mediana), especificacion["size_spread"])))
+        fecha = format_datetime(datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=rng.randrange(525600)))
+        remitente = rng.randrange(100)
+        encabezados = (
+            f"Return-Path: <sender{remitente}@bench.example>\r\n"
+            f"Received: from mx.bench.example by pop.bench.example; {fecha}\r\n"
+            f"From: Sender {remitente} <sender{remitente}@bench.example>\r\n"
+            f"To: {usuario}\r\n"
+            f"Subject: Benchmark message {n} from sender {remitente}\r\n"
+            f"Date: {fecha}\r\n"
+            f"Message-ID: <{n}.{especificacion['seed']}.{usuario}>\r\n"
+            "MIME-Version: 1.0\r\n"
+        ).encode('ascii')
+        if rng.random() < especificacion["attachment_ratio"]:
+            frontera = f"bench-{n}".encode('ascii')
+            texto = _texto_sintetico(rng, min(2048, tamano // 4))
+            adjunto = base64.encodebytes(rng.randbytes(max(0, tamano - len(texto)) * 3 // 4)).replace(b"\n", b"\r\n")
+            cuerpo = (b'Content-Type: multipart/mixed; boundary="' + frontera + b'"\r\n\r\n'
+                      b"--" + frontera + b"\r\nContent-Type: text/plain; charset=us-ascii\r\n\r\n" + texto + b"\r\n"
+                      b"--" + frontera + b"\r\nContent-Type: application/octet-stream\r\n"
+                      b'Content-Disposition: attachment; filename="data.bin"\r\nContent-Transfer-Encoding: base64\r\n\r\n'
+                      + adjunto + b"--" + frontera + b"--")
+        else:
+            cuerpo = b"Content-Type: text/plain; charset=us-ascii\r\n\r\n" + _texto_sintetico(rng, tamano)
+        correos.append(encabezados + cuerpo)
+    return correos
+
+def _respuesta_multilinea(lineas):
+    return b"".join((b"." + linea if linea.startswith(b".") else linea) + b"\r\n" for linea in lineas) + b".\r\n"
+
+class ServidorPOP3Prueba(socketserver.ThreadingTCPServer):
+    """
+    Servidor POP3 local con buzones sintéticos en memoria, para medir el rendimiento sin un proveedor real.
+    Acepta cualquier contraseña y ofrece UIDL, PIPELINING y STLS según la especificación
+    (ver BENCHMARK_PREDETERMINADO). Cuenta los bytes que envía.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, especificacion):
+        self.especificacion = especificacion
+        self.buzones = {} # usuario -> [(uid, respuesta RETR, respuesta TOP n 0, tamaño, correo)]
+        for k in range(especificacion["accounts"]):
+            usuario = f"bench{k}@bench.example"
+            self.buzones[usuario] = [
+                (hashlib.sha1(correo).hexdigest(), _respuesta_multilinea(correo.split(b"\r\n")),
+                 _respuesta_multilinea(correo.split(b"\r\n\r\n", 1)[0].split(b"\r\n") + [b""]), len(correo), correo)
+                for correo in generar_buzon_sintetico(usuario, especificacion)]
+        self.contexto_tls = None
+        if especificacion["certfile"]:
+            self.contexto_tls = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.contexto_tls.load_cert_chain(especificacion["certfile"], especificacion["keyfile"] or None)
+        self.bloqueo = threading.Lock()
+        self.bytes_enviados = 0
+        super().__init__((especificacion["host"], especificacion["port"]), ManejadorPOP3Prueba)
+
+    def tamano_total(self):
+        return sum(mensaje[3] for buzon in self.buzones.values() for mensaje in buzon)
+
+    def lineas_cuentas(self):
+        """
+        Líneas de accounts.txt para conectarse a este servidor.
+        """
+        host, puerto = self.server_address[:2]
+        return [f"{usuario}:bench@{host}:{puerto}" for usuario in self.buzones]
+
+class ManejadorPOP3Prueba(socketserver.BaseRequestHandler):
+    """
+    Sesión POP3 del servidor de prueba. Un hilo lee los comandos y anota cuándo llegó cada uno, para que
+    la latencia configurada se cuente desde la llegada (los comandos en pipelining esperan en paralelo).
+    """
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # Respuestas cortas sin esperar al ACK (algoritmo de Nagle).
+        self.tls = False
+        if self.server.contexto_tls and self.server.server_address[1] == 995:
+            self.request = self.server.contexto_tls.wrap_socket(self.request, server_side=True)
+            self.tls = True
+        self.lector = self.request.makefile('rb')
+        self.comandos = queue.Queue()
+        self.tls_listo = threading.Event() # El lector espera a que termine STLS antes de seguir leyendo.
+
+    def _leer_comandos(self):
+        try:
+            while True:
+                linea = self.lector.readline()
+                self.comandos.put((time.monotonic(), linea))
+                if not linea or linea[:4].upper() == b"QUIT":
+                    return
+                if linea[:4].upper() == b"STLS":
+                    self.tls_listo.wait()
+                    self.tls_listo.clear()
+        except (OSError, ValueError):
+            self.comandos.put((time.monotonic(), b""))
+
+    def _responder(self, llegada, datos):
+        espera = llegada + self.server.especificacion["latency_ms"] / 1000 - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        self.request.sendall(datos)
+        with self.server.bloqueo:
+            self.server.bytes_enviados += len(datos)
+
+    def handle(self):
+        especificacion = self.server.especificacion
+        threading.Thread(target=self._leer_comandos, daemon=True).start()
+        self._responder(time.monotonic(), b"+OK POP3 test server ready\r\n")
+        usuario = None
+        buzon = None
+        borrados = set()
+        while True:
+            llegada, linea = self.comandos.get()
+            if not linea:
+                return
+            partes = linea.split()
+            comando = partes[0].upper().decode('ascii', 'replace') if partes else ""
+            argumentos = partes[1:]
+            try:
+                numero = int(argumentos[0]) if argumentos and comando in ("LIST", "UIDL", "TOP", "RETR", "DELE") else None
+            except ValueError:
+                numero = 0
+            if numero is not None and (buzon is None or not 1 <= numero <= len(buzon) or numero in borrados):
+                respuesta = b"-ERR no such message\r\n"
+            elif comando == "CAPA":
+                capacidades = [b"USER", b"TOP"]
+                capacidades += [b"UIDL"] if especificacion["uidl"] else []
+                capacidades += [b"PIPELINING"] if especificacion["pipelining"] else []
+                capacidades += [b"STLS"] if self.server.contexto_tls and not self.tls else []
+                respuesta = b"+OK\r\n" + _respuesta_multilinea(capacidades)
+            elif comando == "STLS":
+                if not self.server.contexto_tls or self.tls:
+                    respuesta = b"-ERR STLS not available\r\n"
+                    self.tls_listo.set() # El lector sigue en texto plano.
+                else:
+                    self._responder(llegada, b"+OK begin TLS\r\n")
+                    try:
+                        self.request = self.server.contexto_tls.wrap_socket(self.request, server_side=True)
+                    except (OSError, ssl.SSLError):
+                        return
+                    self.tls = True
+                    self.lector = self.request.makefile('rb')
+                    self.tls_listo.set()
+                    continue
+            elif comando == "QUIT":
+                self._responder(llegada, b"+OK bye\r\n")
+                return
+            elif comando == "USER" and argumentos:
+                usuario = argumentos[0].decode('utf-8', 'replace')
+                respuesta = b"+OK\r\n"
+            elif comando == "PASS":
+                buzon = self.server.buzones.get(usuario)
+                respuesta = b"+OK mailbox ready\r\n" if buzon is not None else b"-ERR [AUTH] unknown user\r\n"
+            elif buzon is None:
+                respuesta = b"-ERR not authenticated\r\n"
+            elif comando == "STAT":
+                activos = [mensaje for n, mensaje in enumerate(buzon, 1) if n not in borrados]
+                respuesta = f"+OK {len(activos)} {sum(mensaje[3] for mensaje in activos)}\r\n".encode('ascii')
+            elif comando in ("LIST", "UIDL") and (comando == "LIST" or especificacion["uidl"]):
+                valor = (lambda mensaje: mensaje[3]) if comando == "LIST" else (lambda mensaje: mensaje[0])
+                if numero is not None:
+                    respuesta = f"+OK {numero} {valor(buzon[numero - 1])}\r\n".encode('ascii')
+                else:
+                    respuesta = b"+OK\r\n" + _respuesta_multilinea([f"{n} {valor(mensaje)}".encode('ascii') for n, mensaje in enumerate(buzon, 1) if n not in borrados])
+            elif comando == "RETR" and numero:
+                respuesta = b"+OK\r\n" + buzon[numero - 1][1]
+            elif comando == "TOP" and numero and len(argumentos) == 2 and argumentos[1].isdigit():
+                lineas_cuerpo = int(argumentos[1])
+                if lineas_cuerpo == 0:
+                    respuesta = b"+OK\r\n" + buzon[numero - 1][2]
+                else:
+                    encabezados, cuerpo = buzon[numero - 1][4].split(b"\r\n\r\n", 1)
+                    respuesta = b"+OK\r\n" + _respuesta_multilinea(encabezados.split(b"\r\n") + [b""] + cuerpo.split(b"\r\n")[:lineas_cuerpo])
+            elif comando == "DELE" and numero:
+                borrados.add(numero)
+                respuesta = b"+OK deleted\r\n"
+            elif comando == "RSET":
+                borrados.clear()
+                respuesta = b"+OK\r\n"
+            elif comando == "NOOP":
+                respuesta = b"+OK\r\n"
+            else:
+                respuesta = b"-ERR unknown command\r\n"
+            try:
+                self._responder(llegada, respuesta)
+            except OSError:
+                return
+
+def iniciar_servidor_pop3_prueba(especificacion):
+    """
+    Crea el servidor de prueba y lo atiende en un hilo de fondo.
+    """
+    servidor = ServidorPOP3Prueba(especificacion)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+def servir_pop3_prueba(ruta_especificacion=None):
+    """
+    Modo --test-server: atiende el servidor de prueba hasta Ctrl+C, para apuntar accounts.txt (u otro cliente) a él.
+    """
+    servidor = iniciar_servidor_pop3_prueba(cargar_especificacion_banco(ruta_especificacion))
+    host, puerto = servidor.server_address[:2]
+    print(LANG_MESSAGES.get('test_server_listening', "Test POP3 server listening on {host}:{port}: {accounts} mailbox(es), {mb:.1f} MB. Any password is accepted.").format(
+        host=host, port=puerto, accounts=len(servidor.buzones), mb=servidor.tamano_total() / 1048576))
+    print(LANG_MESSAGES.get('test_server_accounts', "accounts.txt lines:"))
+    for linea in servidor.lineas_cuentas():
+        print(f"  {linea}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+def _memoria_maxima_mb(uso):
+    # ru_maxrss está en KB en Linux y en bytes en macOS.
+    return uso.ru_maxrss / (1048576 if sys.platform == "darwin" else 1024)
+
+def medir_ciclos_banco(ciclos, ruta_resultados):
+    """
+    Proceso medido del banco de pruebas: ejecuta `ciclos` ciclos con los datos (accounts.txt, settings.json)
+    que preparó ejecutar_banco_pruebas y guarda en `ruta_resultados` el tiempo, la CPU, la memoria máxima
+    y el resumen de MEDIDOR_FASES de cada uno.
+    """
+    crear_directorios_necesarios()
+    almacen_metadatos = crear_almacen_metadatos()
+    resultados = []
+    for _ in range(ciclos):
+        MEDIDOR_FASES.reiniciar()
+        total_anterior = almacen_metadatos.total()
+        inicio, cpu_inicio = time.perf_counter(), time.process_time()
+        ejecutar_ciclo(almacen_metadatos)
+        resultado = {"seconds": time.perf_counter() - inicio, "cpu_seconds": time.process_time() - cpu_inicio,
+                     "new_messages": almacen_metadatos.total() - total_anterior}
+        resultado.update(MEDIDOR_FASES.resumen())
+        if resource is not None:
+            resultado["peak_rss_mb"] = _memoria_maxima_mb(resource.getrusage(resource.RUSAGE_SELF))
+        resultados.append(resultado)
+    almacen_metadatos.cerrar()
+    escribir_archivo_atomico(ruta_resultados, lambda f: json.dump(resultados, f, indent=2))
+
+def ejecutar_banco_pruebas(ruta_especificacion=None):
+    """
+    Modo --benchmark: levanta el servidor de prueba y ejecuta los ciclos de este script contra él en un
+    proceso aparte, con un directorio de datos temporal (los datos reales no se tocan).
+    Muestra correos/s, bytes/s, CPU, memoria máxima y el tiempo de cada fase por ciclo, y guarda el
+    informe en LOG_DIR_SCRIPT para comparar entre versiones. Retorna False si el proceso medido falla.
+    """
+    especificacion = cargar_especificacion_banco(ruta_especificacion)
+    servidor = iniciar_servidor_pop3_prueba(especificacion)
+    print(LANG_MESSAGES.get('benchmark_started', "Benchmark: {accounts} mailbox(es) x {messages} email(s), {mb:.1f} MB on the test server, {cycles} cycle(s).").format(
+        accounts=especificacion["accounts"], messages=especificacion["messages"], mb=servidor.tamano_total() / 1048576, cycles=especificacion["cycles"]))
+    try:
+        with tempfile.TemporaryDirectory(prefix="pop3_benchmark_") as directorio:
+            raiz_datos = os.path.join(directorio, "Documents", "Pop3MailDownloader_UserData")
+            os.makedirs(raiz_datos)
+            with open(os.path.join(raiz_datos, "settings.json"), 'w', encoding='utf-8') as f:
+                json.dump({"lang": SELECTED_LANG_CODE, **especificacion["settings"]}, f)
+            with open(os.path.join(raiz_datos, "accounts.txt"), 'w', encoding='utf-8') as f:
+                f.write("\n".join(servidor.lineas_cuentas()) + "\n")
+            entorno = dict(os.environ, HOME=directorio, USERPROFILE=directorio)
+            if especificacion["certfile"]:
+                entorno["SSL_CERT_FILE"] = os.path.abspath(especificacion["certfile"]) # El transporte asyncio verifica el certificado.
+            ruta_resultados = os.path.join(directorio, "benchmark_results.json")
+            ruta_salida = os.path.join(directorio, "benchmark_output.log")
+            uso_inicial = resource.getrusage(resource.RUSAGE_CHILDREN) if resource is not None else None
+            with open(ruta_salida, 'wb') as salida: # La salida del proceso medido no se muestra para no medir la terminal.
+                proceso = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--benchmark-run", str(especificacion["cycles"]), ruta_resultados],
+                    env=entorno, stdin=subprocess.DEVNULL, stdout=salida, stderr=subprocess.STDOUT)
+            uso_final = resource.getrusage(resource.RUSAGE_CHILDREN) if resource is not None else None
+            if proceso.returncode != 0 or not os.path.exists(ruta_resultados):
+                with open(ruta_salida, 'r', encoding='utf-8', errors='replace') as f:
+                    final_salida = f.read()[-4000:]
+                print(LANG_MESSAGES.get('benchmark_failed', "[ERROR] The benchmark process failed (exit code {code}). Last output:\n{output}").format(code=proceso.returncode, output=final_salida))
+                logging.error(LANG_MESSAGES.get('benchmark_failed', "The benchmark process failed (exit code {code}). Last output:\n{output}").format(code=proceso.returncode, output=final_salida))
+                return False
+            with open(ruta_resultados, 'r', encoding='utf-8') as f:
+                ciclos = json.load(f)
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+    for numero, ciclo in enumerate(ciclos, 1):
+        bytes_descargados = ciclo["counters"].get("retr_bytes", 0)
+        print(LANG_MESSAGES.get('benchmark_cycle_result', "Cycle {cycle}: {messages} new email(s) in {seconds:.2f} s, {msgs_per_s:.1f} emails/s, {mb_per_s:.2f} MB/s, CPU {cpu:.2f} s, peak RSS {rss}.").format(
+            cycle=numero, messages=ciclo["new_messages"], seconds=ciclo["seconds"], msgs_per_s=ciclo["new_messages"] / ciclo["seconds"],
+            mb_per_s=bytes_descargados / 1048576 / ciclo["seconds"], cpu=ciclo["cpu_seconds"],
+            rss=f"{ciclo['peak_rss_mb']:.1f} MB" if "peak_rss_mb" in ciclo else "n/a"))
+        for fase, medicion in sorted(ciclo["phases"].items(), key=lambda elemento: -elemento[1]["seconds"]):
+            print(f"    {fase:<12} {medicion['seconds']:9.3f} s  {medicion['count']:>8}")
+    informe = {"spec": especificacion, "cycles": ciclos, "server_bytes_sent": servidor.bytes_enviados}
+    if uso_final is not None:
+        informe["process_cpu_user_seconds"] = uso_final.ru_utime - uso_inicial.ru_utime
+        informe["process_cpu_system_seconds"] = uso_final.ru_stime - uso_inicial.ru_stime
+        informe["process_peak_rss_mb"] = _memoria_maxima_mb(uso_final)
+        print(LANG_MESSAGES.get('benchmark_process_usage', "Whole run (including start-up and worker processes): CPU {user:.2f} s user + {system:.2f} s system, peak RSS {rss:.1f} MB.").format(
+            user=informe["process_cpu_user_seconds"], system=informe["process_cpu_system_seconds"], rss=informe["process_peak_rss_mb"]))
+    ruta_informe = os.path.join(LOG_DIR_SCRIPT, f"benchmark_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json")
+    escribir_archivo_atomico(ruta_informe, lambda f: json.dump(informe, f, indent=2))
+    print(LANG_MESSAGES.get('benchmark_report_saved', "Benchmark report saved to '{path}'.").format(path=ruta_informe))
+    return True
 
 def main():
     """
@@ -944,31 +5020,38 @@ def main():
     logging.info(LANG_MESSAGES.get('script_started', "Script started."))
 
     crear_directorios_necesarios()
+    almacen_metadatos = crear_almacen_metadatos()
+    iniciar_exportacion_metricas()
+    perfil = None
     while True:
+        if perfil is None:
+            ciclos_perfil = leer_solicitud_perfil()
+            if ciclos_perfil:
+                perfil = PerfilCiclos(ciclos_perfil)
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         print(LANG_MESSAGES.get('new_cycle_started', "\n--- INICIANDO NUEVO CICLO DE VERIFICACIÓN ({timestamp}) ---").format(timestamp=timestamp))
         logging.info(LANG_MESSAGES.get('new_cycle_started', "Starting new email verification cycle.").format(timestamp=timestamp))
         try:
-            accounts = parse_accounts()
-            if not accounts:
-                print(LANG_MESSAGES.get('no_valid_accounts', "No se encontraron cuentas válidas. Esperando el próximo ciclo."))
-                logging.warning(LANG_MESSAGES.get('no_valid_accounts', "No valid accounts found. Waiting for next cycle."))
-                pass
-            else:
-                all_emails_metadata, existing_hashes = cargar_metadatos_existentes()
-                # Se llama a load_spam_config, pero ahora retorna filtros vacíos.
-                mail_whitelist, mail_blacklist, word_whitelist, word_blacklist = load_spam_config()
-                
-                # El mensaje de "filtros cargados" ahora reflejará que no se usa spam_config.json
-                print(f"  {LANG_MESSAGES.get('filters_loaded', 'Spam filter configuration (spam_config.json) is not being used. No filters applied.')}")
-
-                for account in accounts:
-                    procesar_cuenta(account, all_emails_metadata, existing_hashes, mail_whitelist, mail_blacklist, word_whitelist, word_blacklist)
-                guardar_metadatos_consolidados(all_emails_metadata)
+            with MEDIDOR_FASES.medir("cycle"):
+                if perfil is not None:
+                    perfil.ejecutar_ciclo(ejecutar_ciclo, almacen_metadatos)
+                else:
+                    ejecutar_ciclo(almacen_metadatos)
         except Exception as e:
+            MEDIDOR_FASES.contar("errors", 1, "", type(e).__name__)
             print(LANG_MESSAGES.get('critical_error', "\n[ERROR CRÍTICO] Ocurrió un error inesperado en el bucle principal del script: {details}").format(details=e))
             logging.critical(LANG_MESSAGES.get('critical_error', "Critical error in main script loop: {details}").format(details=e))
             pass
+        MEDIDOR_FASES.fijar("last_cycle_timestamp", time.time())
+        escribir_archivo_metricas()
+        if perfil is not None:
+            if not perfil.terminado():
+                continue # Los ciclos perfilados se ejecutan seguidos.
+            try:
+                perfil.escribir_informe()
+            except Exception as e:
+                logging.error(LANG_MESSAGES.get('profile_write_failed', "Could not write the profile: {error}").format(error=e))
+            perfil = None
         
         print(LANG_MESSAGES.get('cycle_finished_waiting', "\n--- Ciclo de verificación finalizado. Esperando {minutes} minuto(s) antes del próximo ciclo. ---").format(minutes=CHECK_INTERVAL//60))
         logging.info(LANG_MESSAGES.get('cycle_finished_waiting', "Verification cycle finished. Waiting {minutes} minute(s).").format(minutes=CHECK_INTERVAL//60))
@@ -977,6 +5060,8 @@ def main():
         while tiempo_esperado < CHECK_INTERVAL:
             time.sleep(1) # Espera 1 segundo para no consumir CPU innecesariamente.
             tiempo_esperado += 1
+            if os.path.exists(PROFILE_TRIGGER_FILE_PATH):
+                break # El próximo ciclo lee la solicitud de perfil y comienza de inmediato.
             if os.path.exists(TRIGGER_FILE_PATH):
                 print(LANG_MESSAGES.get('trigger_file_detected', f"\n--- Archivo de trigger '{TRIGGER_FILE_PATH}' detectado. Reiniciando ciclo manualmente. ---").format(path=TRIGGER_FILE_PATH))
                 logging.info(LANG_MESSAGES.get('trigger_file_detected', f"Trigger file '{TRIGGER_FILE_PATH}' detected. Restarting cycle.").format(path=TRIGGER_FILE_PATH))
@@ -991,4 +5076,42 @@ def main():
                 break # Rompe el bucle de espera y reinicia el ciclo principal de inmediato.
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="POP3 Mail Downloader")
+    parser.add_argument("--reindex", action="store_true", help="Rebuild the metadata store from the .eml files on disk and exit.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes for --reindex (default: reindex_workers setting).")
+    parser.add_argument("--check-header-hash", action="store_true", help="Compare the fast header hash with the parser-based one on every .eml file on disk and exit.")
+    parser.add_argument("--benchmark-compression", nargs="?", type=int, const=0, default=None, metavar="FILES",
+                        help="Measure the compression ratio and speed of each eml_compression codec on the stored .eml files (optionally only the first FILES) and exit.")
+    parser.add_argument("--benchmark-dates", nargs="?", type=int, const=20000, default=None, metavar="MESSAGES",
+                        help="Measure the Date header conversion on MESSAGES synthetic emails (default 20000) against parsing every header without memoization, and exit.")
+    parser.add_argument("--profile", nargs="?", type=int, const=1, default=None, metavar="CYCLES",
+                        help="Run CYCLES cycles (default 1) under cProfile and tracemalloc, write the profile to the Logs folder and exit.")
+    parser.add_argument("--test-server", nargs="?", const="", default=None, metavar="SPEC",
+                        help="Run a local POP3 test server with synthetic mailboxes (options in the SPEC JSON file) until Ctrl+C.")
+    parser.add_argument("--benchmark", nargs="?", const="", default=None, metavar="SPEC",
+                        help="Run the download cycle against the local test server and report throughput, CPU, memory and per-phase timings.")
+    parser.add_argument("--benchmark-run", nargs=2, metavar=("CYCLES", "RESULTS"), help=argparse.SUPPRESS) # Proceso medido por --benchmark.
+    args = parser.parse_args()
+    if args.reindex:
+        crear_directorios_necesarios()
+        reindexar(args.workers)
+    elif args.check_header_hash:
+        crear_directorios_necesarios()
+        raise SystemExit(1 if comprobar_hash_encabezados_crudos() else 0)
+    elif args.benchmark_compression is not None:
+        crear_directorios_necesarios()
+        comparar_compresion(args.benchmark_compression)
+    elif args.benchmark_dates is not None:
+        raise SystemExit(1 if comparar_conversion_fechas(args.benchmark_dates) else 0)
+    elif args.profile is not None:
+        crear_directorios_necesarios()
+        perfilar_ciclos(args.profile)
+    elif args.test_server is not None:
+        servir_pop3_prueba(args.test_server)
+    elif args.benchmark is not None:
+        crear_directorios_necesarios()
+        raise SystemExit(0 if ejecutar_banco_pruebas(args.benchmark) else 1)
+    elif args.benchmark_run:
+        medir_ciclos_banco(int(args.benchmark_run[0]), args.benchmark_run[1])
+    else:
+        main()
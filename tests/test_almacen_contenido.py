@@ -0,0 +1,73 @@
+"""
+Pruebas del almacén de contenido (blob_store): el mismo contenido guardado dos veces queda en un
+solo blob enlazado desde ambos .eml, con o sin compresión.
+"""
+import os
+import unittest
+
+from utilidades import main, vaciar_carpeta_datos
+
+LINEAS = [b"From: Ana <ana@example.com>", b"Subject: Hola", b"", b"Primera linea del cuerpo", b"..punto", b"", b"fin"] * 50
+CONTENIDO = b"\r\n".join(LINEAS) # Lo que retornaría poplib.retr() unido con CRLF.
+
+
+class PruebaAlmacenContenido(unittest.TestCase):
+    def setUp(self):
+        vaciar_carpeta_datos()
+        self.directorio = os.path.join(main.EMAILS_BASE_DIR, "ana@example.com")
+        os.makedirs(self.directorio)
+        main.ESTADISTICAS_BLOBS.update(nuevos=0, reutilizados=0, bytes_ahorrados=0)
+
+    def descargar(self, lineas=LINEAS):
+        descarga = main.DescargaEnCurso(self.directorio)
+        for linea in lineas:
+            descarga.escribir_linea(linea)
+        descarga.cerrar()
+        return descarga
+
+    def guardar(self, descarga, nombre):
+        """
+        Enlaza la descarga desde el almacén en `nombre` (.eml con la extensión del códec) y retorna su ruta.
+        """
+        extension = main.CODECS_EML.get(descarga.codec, "")
+        destino = os.path.join(self.directorio, f"{nombre}.eml{extension}")
+        self.assertTrue(main.guardar_en_almacen_blobs(descarga.ruta_temporal, descarga.clave_contenido(), destino, extension))
+        return destino
+
+    def blobs(self):
+        return sorted(os.path.join(raiz, nombre) for raiz, _, nombres in os.walk(main.BLOBS_DIR) for nombre in nombres)
+
+    def test_mismo_contenido_un_solo_blob(self):
+        for codec in ("none", "gzip"):
+            for buffer_kb in (8192, 1): # En memoria, o más grande que blob_buffer_kb (pasa por el archivo temporal).
+                with self.subTest(codec=codec, blob_buffer_kb=buffer_kb):
+                    self.setUp()
+                    main.SETTINGS.update(blob_store=True, eml_compression=codec, blob_buffer_kb=buffer_kb)
+                    primera = self.descargar()
+                    segunda = self.descargar()
+                    self.assertEqual(primera.clave_contenido(), segunda.clave_contenido())
+                    destino_a = self.guardar(primera, "a")
+                    destino_b = self.guardar(segunda, "b")
+
+                    blobs = self.blobs()
+                    self.assertEqual(len(blobs), 1)
+                    self.assertEqual(os.path.basename(blobs[0]), f"{primera.clave_contenido()}.eml{main.CODECS_EML.get(codec, '')}")
+                    for destino in (destino_a, destino_b):
+                        self.assertTrue(os.path.samefile(destino, blobs[0]))
+                        self.assertEqual(main.leer_eml(destino), CONTENIDO)
+                    self.assertEqual(main.ESTADISTICAS_BLOBS["nuevos"], 1)
+                    self.assertEqual(main.ESTADISTICAS_BLOBS["reutilizados"], 1)
+                    segunda.descartar() # Nunca elimina el blob, aunque ruta_temporal apunte a él.
+                    self.assertEqual(self.blobs(), blobs)
+                    self.assertEqual([nombre for nombre in os.listdir(self.directorio) if nombre.startswith(main.DescargaEnCurso.PREFIJO)], [])
+
+    def test_contenido_distinto_blobs_distintos(self):
+        main.SETTINGS.update(blob_store=True)
+        self.guardar(self.descargar(), "a")
+        self.guardar(self.descargar(LINEAS + [b"otra linea"]), "b")
+        self.assertEqual(len(self.blobs()), 2)
+        self.assertEqual(main.ESTADISTICAS_BLOBS["reutilizados"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
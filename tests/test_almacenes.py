@@ -0,0 +1,101 @@
+"""
+Pruebas de los almacenes de metadatos (json, jsonl y sqlite): agregar, volver a cargar y exportar
+deben dar el mismo resultado con los tres, y el registro jsonl debe tolerar una última línea truncada.
+"""
+import json
+import os
+import random
+import unittest
+
+from utilidades import main, vaciar_carpeta_datos
+
+CONFIGURACIONES = [("json", "set"), ("jsonl", "set"), ("jsonl", "compact"), ("sqlite", "set"), ("sqlite", "compact")]
+
+
+def registros_de_prueba(azar, cantidad, inicio=0):
+    return [{
+        "name": f"correo_{n}.eml",
+        "path": f"ana@example.com/correo_{n}.eml",
+        "subject": azar.choice(["Hola", "Factura ñandú", "Re: \"citas\" y \\barras\\", ""]),
+        "recipient": "ana@example.com",
+        "fecha_iso": f"2025-01-{1 + n % 28:02d}T10:00:00+00:00",
+        "tamano_eml": azar.randint(100, 10000),
+        "hash": azar.randbytes(32).hex(),
+        "spam_score": azar.choice([None, 1.5, 7.0]),
+        "spam_filter": "no",
+    } for n in range(inicio, inicio + cantidad)]
+
+
+class PruebaAlmacenes(unittest.TestCase):
+    def setUp(self):
+        self.azar = random.Random(20251018)
+
+    def crear(self, backend, dedup_index):
+        main.SETTINGS["metadata_backend"] = backend
+        main.SETTINGS["dedup_index"] = dedup_index
+        return main.crear_almacen_metadatos()
+
+    def exportar(self, almacen):
+        ruta = os.path.join(main.DATA_DIR, "exportado.json")
+        almacen.exportar_json(ruta)
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+
+    def test_mismo_resultado_en_todos_los_almacenes(self):
+        lote_1 = registros_de_prueba(self.azar, 30)
+        lote_2 = registros_de_prueba(self.azar, 20, inicio=30)
+        todos = lote_1 + lote_2
+        for backend, dedup_index in CONFIGURACIONES:
+            with self.subTest(backend=backend, dedup_index=dedup_index):
+                vaciar_carpeta_datos()
+                almacen = self.crear(backend, dedup_index)
+                self.assertEqual(len(almacen.cargar_hashes()), 0)
+                almacen.agregar(lote_1)
+                almacen.agregar([])
+                almacen.agregar(lote_2)
+                self.assertEqual(almacen.total(), len(todos))
+                almacen.cerrar()
+
+                almacen = self.crear(backend, dedup_index)
+                hashes = almacen.cargar_hashes()
+                self.assertEqual(len(hashes), len(todos))
+                for registro in todos:
+                    self.assertIn(registro["hash"], hashes)
+                self.assertNotIn(self.azar.randbytes(32).hex(), hashes)
+                self.assertEqual(list(almacen.iterar_registros()), todos)
+                self.assertEqual(self.exportar(almacen), {"emails": todos, "total_emails": len(todos)})
+                almacen.cerrar()
+
+    def test_importa_el_json_heredado(self):
+        registros = registros_de_prueba(self.azar, 10)
+        for backend in ("jsonl", "sqlite"):
+            with self.subTest(backend=backend):
+                vaciar_carpeta_datos()
+                with open(main.METADATA_FILE, "w", encoding="utf-8") as f:
+                    json.dump({"emails": registros, "total_emails": len(registros)}, f)
+                almacen = self.crear(backend, "set")
+                self.assertEqual(list(almacen.iterar_registros()), registros)
+                almacen.cerrar()
+
+    def test_jsonl_recupera_una_ultima_linea_truncada(self):
+        vaciar_carpeta_datos()
+        registros = registros_de_prueba(self.azar, 5)
+        almacen = self.crear("jsonl", "set")
+        almacen.agregar(registros)
+        almacen.cerrar()
+        with open(main.METADATA_LOG_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(registros_de_prueba(self.azar, 1)[0])[:40]) # Corte durante la escritura.
+
+        almacen = self.crear("jsonl", "set")
+        self.assertEqual(len(almacen.cargar_hashes()), len(registros))
+        nuevos = registros_de_prueba(self.azar, 3, inicio=5)
+        almacen.agregar(nuevos)
+        self.assertEqual(list(almacen.iterar_registros()), registros + nuevos)
+        almacen.compactar()
+        almacen.cerrar()
+        with open(main.METADATA_LOG_FILE, encoding="utf-8") as f:
+            self.assertEqual([json.loads(linea) for linea in f], registros + nuevos)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+"""
+Pruebas de ejecutar_ciclo() de principio a fin contra el servidor POP3 de prueba.
+"""
+import contextlib
+import json
+import os
+import shutil
+import sqlite3
+import ssl
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from utilidades import ServidorEnHilo, main, vaciar_carpeta_datos
+
+MENSAJES = 12
+ALMACENES = [("json", "set"), ("jsonl", "set"), ("jsonl", "compact"), ("sqlite", "compact")]
+
+
+@contextlib.contextmanager
+def base_de_datos_bloqueada(almacen):
+    """
+    Otra conexión retiene el bloqueo de escritura de la base de datos sqlite del almacén.
+    """
+    almacen.conexion.execute("PRAGMA busy_timeout=50")
+    otra = sqlite3.connect(almacen.ruta, isolation_level=None)
+    otra.execute("BEGIN EXCLUSIVE")
+    try:
+        yield
+    finally:
+        otra.execute("ROLLBACK")
+        otra.close()
+
+
+def fallo_de_escritura(almacen):
+    if almacen.nombre == "json":
+        return mock.patch.object(main, "escribir_archivo_atomico", side_effect=OSError("disco lleno"))
+    if almacen.nombre == "jsonl":
+        return mock.patch.object(almacen, "_termina_sin_salto_de_linea", side_effect=OSError("disco lleno"))
+    return base_de_datos_bloqueada(almacen)
+
+
+class PruebaCiclo(unittest.TestCase):
+    def setUp(self):
+        self.almacen = None
+
+    def tearDown(self):
+        self.almacen.cerrar()
+
+    def usar_almacen(self, backend, dedup_index="set", **opciones):
+        """
+        Empieza con la carpeta de datos vacía y el almacén indicado.
+        """
+        if self.almacen is not None:
+            self.almacen.cerrar()
+        vaciar_carpeta_datos()
+        main.SETTINGS.update(quiet=True, metadata_backend=backend, dedup_index=dedup_index, **opciones)
+        self.almacen = main.crear_almacen_metadatos()
+
+    def reiniciar(self):
+        """
+        Como un proceso nuevo: vuelve a abrir el almacén sin el estado en memoria del anterior.
+        """
+        self.almacen.cerrar()
+        self.almacen = main.crear_almacen_metadatos()
+
+    def hashes_registrados(self):
+        return [registro["hash"] for registro in self.almacen.iterar_registros()]
+
+    def comprobar_registrados_una_vez(self):
+        hashes = self.hashes_registrados()
+        self.assertEqual(len(hashes), 2 * MENSAJES)
+        self.assertEqual(len(set(hashes)), len(hashes))
+        self.assertEqual(main.listar_puntos_de_control(), [])
+        return hashes
+
+    def test_segundo_ciclo_no_descarga_nada(self):
+        for transporte in ("threads", "asyncio"):
+            for uidl in (True, False): # Sin UIDL, solo la comparación de hashes de TOP evita las descargas.
+                with self.subTest(transporte=transporte, uidl=uidl):
+                    self.usar_almacen("jsonl", transport=transporte)
+                    with ServidorEnHilo(accounts=2, messages=MENSAJES, size_kb=2, uidl=uidl):
+                        main.ejecutar_ciclo(self.almacen)
+                        hashes = self.comprobar_registrados_una_vez()
+                        archivos = main.listar_archivos_eml()
+                        self.assertEqual(len(archivos), 2 * MENSAJES)
+
+                        main.MEDIDOR_FASES.reiniciar()
+                        main.ejecutar_ciclo(self.almacen)
+                    resumen = main.MEDIDOR_FASES.resumen()
+                    self.assertNotIn("retr", resumen["phases"])
+                    self.assertNotIn("messages_new", resumen["counters"])
+                    self.assertEqual(resumen["counters"]["messages_known"], 2 * MENSAJES)
+                    self.assertEqual(resumen["phases"].get("top", {}).get("count", 0), 0 if uidl else 2 * MENSAJES)
+                    self.assertEqual(self.hashes_registrados(), hashes)
+                    self.assertEqual(main.listar_archivos_eml(), archivos)
+
+    def test_fallo_del_almacen_conserva_los_diarios(self):
+        for backend, dedup_index in ALMACENES:
+            with self.subTest(backend=backend, dedup_index=dedup_index):
+                # Sin puntos de control por cuenta, el único diario es el que escribe el ciclo al fallar el almacén.
+                self.usar_almacen(backend, dedup_index, checkpoint_every_messages=0, checkpoint_every_seconds=0)
+                with ServidorEnHilo(accounts=2, messages=MENSAJES, size_kb=2):
+                    with fallo_de_escritura(self.almacen):
+                        main.ejecutar_ciclo(self.almacen)
+                    self.assertEqual(self.hashes_registrados(), [])
+                    self.assertEqual(os.listdir(main.UIDL_INDEX_DIR), []) # Sin registros en el almacén no se guarda ningún UID.
+                    self.assertEqual(main.listar_puntos_de_control(), [main.obtener_ruta_punto_control(main.CYCLE_CHECKPOINT_NAME)])
+                    with open(main.listar_puntos_de_control()[0], encoding="utf-8") as f:
+                        self.assertEqual(len([json.loads(linea) for linea in f]), 2 * MENSAJES)
+
+                    main.ejecutar_ciclo(self.almacen) # Mismo proceso: el almacén no debe recordar los hashes no escritos.
+                self.comprobar_registrados_una_vez()
+                self.assertEqual(len(os.listdir(main.UIDL_INDEX_DIR)), 2)
+
+    def test_ciclo_interrumpido_se_recupera_una_vez(self):
+        for backend, dedup_index in ALMACENES:
+            with self.subTest(backend=backend, dedup_index=dedup_index):
+                self.usar_almacen(backend, dedup_index, checkpoint_every_messages=5)
+                with ServidorEnHilo(accounts=2, messages=MENSAJES, size_kb=2):
+                    # El proceso se detiene justo antes de registrar los correos del ciclo en el almacén.
+                    with mock.patch.object(self.almacen, "agregar", side_effect=KeyboardInterrupt):
+                        with self.assertRaises(KeyboardInterrupt):
+                            main.ejecutar_ciclo(self.almacen)
+                    self.reiniciar()
+                    self.assertEqual(self.hashes_registrados(), [])
+                    self.assertEqual(len(main.listar_puntos_de_control()), 2)
+                    self.assertEqual(len(os.listdir(main.UIDL_INDEX_DIR)), 2) # Cada punto de control guarda su índice.
+
+                    main.ejecutar_ciclo(self.almacen)
+                    hashes = self.comprobar_registrados_una_vez()
+
+                    main.recuperar_puntos_de_control(self.almacen) # Sin diarios no hace nada.
+                    self.reiniciar()
+                    main.ejecutar_ciclo(self.almacen)
+                    self.assertEqual(self.hashes_registrados(), hashes)
+
+    @unittest.skipUnless(shutil.which("openssl"), "openssl is required to create the test certificate")
+    def test_stls_con_el_mismo_contexto_en_ambos_transportes(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            certificado = os.path.join(directorio, "servidor.pem")
+            subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                            "-keyout", certificado, "-out", certificado], check=True, capture_output=True)
+            for transporte in ("threads", "asyncio"):
+                with self.subTest(transporte=transporte):
+                    self.usar_almacen("json", transport=transporte)
+                    with ServidorEnHilo(accounts=2, messages=MENSAJES, size_kb=2, certfile=certificado) as servidor:
+                        with mock.patch.object(servidor.contexto_tls, "wrap_socket", wraps=servidor.contexto_tls.wrap_socket) as envolver:
+                            main.ejecutar_ciclo(self.almacen)
+                    self.assertEqual(envolver.call_count, 2) # Una negociación STLS por cuenta.
+                    self.comprobar_registrados_una_vez()
+        main.SETTINGS["tls_verify"] = False
+        self.assertEqual(main.crear_contexto_tls().verify_mode, ssl.CERT_NONE)
+        main.SETTINGS["tls_verify"] = True
+        self.assertEqual(main.crear_contexto_tls().verify_mode, ssl.CERT_REQUIRED)
+        self.assertTrue(main.crear_contexto_tls().check_hostname)
+
+    def test_mediciones_de_los_procesos_de_analisis(self):
+        for transporte in ("threads", "asyncio"):
+            with self.subTest(transporte=transporte):
+                self.usar_almacen("json", transport=transporte, parse_pipeline=True, parse_workers=2)
+                main.MEDIDOR_FASES.reiniciar()
+                try:
+                    with ServidorEnHilo(accounts=2, messages=MENSAJES, size_kb=2):
+                        main.ejecutar_ciclo(self.almacen)
+                    self.assertIsNotNone(main.POOL_ANALISIS) # Analizó cada correo en el pool, no en línea.
+                finally:
+                    main.cerrar_pool_analisis()
+                    main.POOL_ANALISIS = None
+                self.comprobar_registrados_una_vez()
+                fases = main.MEDIDOR_FASES.resumen()["phases"]
+                for fase in ("parse", "date", "parse_wait"):
+                    self.assertEqual(fases[fase]["count"], 2 * MENSAJES, fase)
+                cuentas = {cuenta for fase, cuenta in main.MEDIDOR_FASES.fases if fase == "date"}
+                self.assertEqual(len(cuentas), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
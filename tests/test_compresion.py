@@ -0,0 +1,59 @@
+"""
+Pruebas de ida y vuelta de eml_compression: DescargaEnCurso escribe con cada códec y leer_eml/abrir_eml
+leen exactamente los mismos bytes que entregó el servidor.
+"""
+import os
+import unittest
+
+from utilidades import main, vaciar_carpeta_datos
+
+LINEAS = [b"From: Ana <ana@example.com>", b"Subject: Hola", b"", b"Primera linea del cuerpo", b"..punto", b"", b"fin"] * 50
+CONTENIDO = b"\r\n".join(LINEAS) # Lo que retornaría poplib.retr() unido con CRLF.
+CODECS = ["gzip", "lzma", "zstd"]
+
+
+class PruebaCompresion(unittest.TestCase):
+    def setUp(self):
+        vaciar_carpeta_datos()
+        self.directorio = os.path.join(main.EMAILS_BASE_DIR, "ana@example.com")
+        os.makedirs(self.directorio)
+
+    def descargar(self):
+        descarga = main.DescargaEnCurso(self.directorio)
+        for linea in LINEAS:
+            descarga.escribir_linea(linea)
+        descarga.cerrar()
+        return descarga
+
+    def test_cada_codec_lee_los_mismos_bytes(self):
+        for codec in CODECS:
+            with self.subTest(codec=codec):
+                if codec == "zstd" and main.zstandard is None:
+                    self.skipTest("zstandard is not installed")
+                main.SETTINGS["eml_compression"] = codec
+                descarga = self.descargar()
+                self.assertEqual(descarga.codec, codec)
+                ruta = os.path.join(self.directorio, f"{codec}.eml{main.CODECS_EML[codec]}")
+                os.replace(descarga.ruta_temporal, ruta)
+                self.assertEqual(main.codec_de_ruta(ruta), codec)
+                self.assertEqual(main.leer_eml(ruta), CONTENIDO)
+                with main.abrir_eml(ruta) as f:
+                    self.assertEqual(b"".join(f), CONTENIDO) # Recorrido línea por línea, como el filtro del cuerpo.
+                self.assertLess(os.path.getsize(ruta), len(CONTENIDO))
+
+    def test_sin_compresion(self):
+        descarga = self.descargar()
+        self.assertIsNone(descarga.codec)
+        with open(descarga.ruta_temporal, "rb") as f:
+            self.assertEqual(f.read(), CONTENIDO)
+        descarga.descartar()
+        self.assertFalse(os.path.exists(descarga.ruta_temporal))
+
+    def test_codec_desconocido_sin_compresion(self):
+        self.assertIsNone(main.obtener_codec_compresion("none"))
+        self.assertIsNone(main.obtener_codec_compresion("bzip2"))
+        self.assertIsNone(main.codec_de_ruta("correo.eml"))
+
+
+if __name__ == "__main__":
+    unittest.main()
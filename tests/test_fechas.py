@@ -0,0 +1,23 @@
+"""
+Pruebas de la conversión del encabezado Date: el valor crudo memorizado da la misma fecha que
+interpretar el encabezado con policy.default (la comparación de --benchmark-dates).
+"""
+import contextlib
+import io
+import unittest
+
+from utilidades import main
+
+
+class PruebaFechas(unittest.TestCase):
+    def test_misma_fecha_que_el_parser(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(main.comparar_conversion_fechas(2000), 0)
+
+    def test_fechas_no_interpretables(self):
+        self.assertEqual(main.convertir_fecha_correo("not a date")[:2], ("", ""))
+        self.assertEqual(main.convertir_fecha_correo("Tue, 1 Jul 2025 10:00:00 +0000")[:2], ("01-07-2025_04-00", "2025-07-01T04:00:00-06:00"))
+
+
+if __name__ == "__main__":
+    unittest.main()
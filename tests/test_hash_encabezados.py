@@ -0,0 +1,54 @@
+"""
+Pruebas de obtener_hash_encabezados_crudos(): debe dar el mismo hash que el parser completo
+(_hash_encabezados_con_parser), que es el que guardan las versiones anteriores y --reindex.
+"""
+import random
+import unittest
+
+from utilidades import main
+
+NOMBRES = [b"Subject", b"From", b"To", b"Cc", b"Date", b"Message-ID", b"Received", b"Content-Type",
+           b"X-Microsoft-Antispam-Message-Info", b"DKIM-Signature", b"Reply-To", b"X-Mailer"]
+VALORES = [b"foo", b"hola mundo", b"=?us-ascii?Q?hola_mundo?=", b"=?utf-8?B?w7FhbmR1?=",
+           b"Ana <ana@example.com>", b"ana@example.com, beto@example.org", b"<id.1@example.com>",
+           b"Tue, 1 Jul 2025 10:00:00 +0200", b"text/plain; charset=us-ascii", b"from a by b; x", b""]
+
+
+class PruebaHashEncabezados(unittest.TestCase):
+    def comparar(self, lineas):
+        self.assertEqual(self.calcular(main.obtener_hash_encabezados_crudos, lineas), self.calcular(main._hash_encabezados_con_parser, lineas), lineas)
+
+    @staticmethod
+    def calcular(funcion, lineas):
+        # Algunos valores mal formados hacen fallar a headerregistry; basta con que ambos fallen igual.
+        try:
+            return funcion(lineas)
+        except Exception as e:
+            return type(e).__name__
+
+    def test_valor_en_linea_de_continuacion(self):
+        self.comparar([b"Subject:", b" foo", b""])
+        self.comparar([b"Subject:", b"\tfoo", b""])
+        self.comparar([b"X-Microsoft-Antispam-Message-Info:", b"\t=?us-ascii?Q?abc?=", b"\t=?us-ascii?Q?def?=", b""])
+        self.comparar([b"Subject: ", b"  foo", b" bar", b""])
+        self.comparar([b"To:", b" ana@example.com,", b" beto@example.org", b""])
+
+    def test_valores_simples(self):
+        self.comparar([b"From: Ana <ana@example.com>", b"Subject:   foo bar", b"Received: from a", b"\tby b", b""])
+
+    def test_comparacion_aleatoria(self):
+        azar = random.Random(20251018)
+        for _ in range(3000):
+            lineas = []
+            for _ in range(azar.randint(1, 6)):
+                nombre = azar.choice(NOMBRES)
+                primera = azar.choice([b"", b" ", b"  ", b"\t"]) + azar.choice(VALORES)
+                lineas.append(nombre + b":" + primera)
+                for _ in range(azar.choice([0, 0, 1, 2])):
+                    lineas.append(azar.choice([b" ", b"\t", b"  "]) + azar.choice(VALORES))
+            lineas.append(b"")
+            self.comparar(lineas)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+Pruebas de IndiceHashesCompacto: construir, volver a abrir, pertenencia (incluidos los falsos
+positivos del filtro de Bloom) y agregar hashes tras reabrir.
+"""
+import os
+import random
+import tempfile
+import unittest
+
+from utilidades import main
+
+Indice = main.IndiceHashesCompacto
+
+
+def hashes_aleatorios(azar, cantidad):
+    return [azar.randbytes(32).hex() for _ in range(cantidad)]
+
+
+class PruebaIndiceHashes(unittest.TestCase):
+    def setUp(self):
+        self.directorio = tempfile.TemporaryDirectory()
+        self.ruta = os.path.join(self.directorio.name, "almacen.hashes")
+        self.azar = random.Random(20251018)
+        self.bits_por_hash = main.SETTINGS["dedup_bloom_bits_per_hash"]
+
+    def tearDown(self):
+        main.SETTINGS["dedup_bloom_bits_per_hash"] = self.bits_por_hash
+        self.directorio.cleanup()
+
+    def construir(self, hashes, firma="f1"):
+        indice = Indice.construir(self.ruta, Indice.empaquetar(hashes), firma)
+        self.addCleanup(indice.cerrar)
+        return indice
+
+    def abrir(self, firma):
+        indice = Indice.abrir(self.ruta, firma)
+        if indice is not None:
+            self.addCleanup(indice.cerrar)
+        return indice
+
+    def comprobar_pertenencia(self, indice, miembros, ausentes):
+        for hash_correo in miembros:
+            self.assertIn(hash_correo, indice)
+        for hash_correo in ausentes:
+            self.assertNotIn(hash_correo, indice)
+
+    def test_construir_y_reabrir(self):
+        miembros = hashes_aleatorios(self.azar, 3000)
+        ausentes = hashes_aleatorios(self.azar, 3000)
+        self.construir(miembros + miembros[:10]).cerrar() # Los repetidos se guardan una vez.
+        indice = self.abrir("f1")
+        self.assertIsNotNone(indice)
+        self.assertEqual(len(indice), len(miembros))
+        self.comprobar_pertenencia(indice, miembros, ausentes)
+        self.assertNotIn("no es hexadecimal", indice)
+        self.assertNotIn(miembros[0][:32], indice)
+
+    def test_sin_filtro_de_bloom(self):
+        main.SETTINGS["dedup_bloom_bits_per_hash"] = 0
+        miembros = hashes_aleatorios(self.azar, 500)
+        indice = self.construir(miembros)
+        self.assertEqual(indice.bits_bloom, 0)
+        self.comprobar_pertenencia(indice, miembros, hashes_aleatorios(self.azar, 500))
+
+    def test_falso_positivo_del_filtro_se_resuelve_en_la_tabla(self):
+        miembros = hashes_aleatorios(self.azar, 200)
+        indice = self.construir(miembros)
+        for hash_correo in miembros[:50]:
+            # Mismos bytes 8-24 (los que usa el filtro de Bloom) y distinta posición en la tabla.
+            digest = bytearray(bytes.fromhex(hash_correo))
+            digest[:8] = self.azar.randbytes(8)
+            digest[24:] = self.azar.randbytes(8)
+            self.assertEqual(indice._bits_bloom(bytes(digest)), indice._bits_bloom(bytes.fromhex(hash_correo)))
+            self.assertNotIn(digest.hex(), indice)
+
+    def test_colisiones_en_la_tabla(self):
+        prefijo = self.azar.randbytes(8)
+        miembros = [(prefijo + self.azar.randbytes(24)).hex() for _ in range(20)]
+        ausentes = [(prefijo + self.azar.randbytes(24)).hex() for _ in range(20)]
+        self.comprobar_pertenencia(self.construir(miembros), miembros, ausentes)
+
+    def test_firma_distinta_o_archivo_danado(self):
+        self.construir(hashes_aleatorios(self.azar, 10)).cerrar()
+        self.assertIsNone(self.abrir("f2"))
+        with open(self.ruta, "r+b") as f:
+            f.write(b"XXXXXXXX")
+        self.assertIsNone(self.abrir("f1"))
+        self.assertIsNone(Indice.abrir(self.ruta + ".no-existe", "f1"))
+
+    def test_agregar_tras_reabrir(self):
+        miembros = hashes_aleatorios(self.azar, 100)
+        self.construir(miembros).cerrar()
+        indice = self.abrir("f1")
+        nuevos = hashes_aleatorios(self.azar, 50)
+        indice.update(nuevos)
+        indice.discard(nuevos[-1])
+        self.comprobar_pertenencia(indice, miembros + nuevos[:-1], nuevos[-1:])
+        self.assertIs(indice.consolidar("f2"), indice)
+        indice.cerrar()
+        self.assertIsNone(self.abrir("f1"))
+        indice = self.abrir("f2")
+        self.assertEqual(len(indice), 149)
+        self.comprobar_pertenencia(indice, miembros + nuevos[:-1], nuevos[-1:] + hashes_aleatorios(self.azar, 100))
+
+    def test_crecer_al_superar_la_carga_maxima(self):
+        miembros = hashes_aleatorios(self.azar, 100)
+        indice = self.construir(miembros)
+        capacidad = indice.capacidad
+        nuevos = hashes_aleatorios(self.azar, capacidad)
+        indice.update(nuevos)
+        indice = indice.consolidar("f2")
+        self.addCleanup(indice.cerrar)
+        self.assertGreater(indice.capacidad, capacidad)
+        indice.cerrar()
+        indice = self.abrir("f2")
+        self.assertEqual(len(indice), len(miembros) + len(nuevos))
+        self.comprobar_pertenencia(indice, miembros + nuevos, hashes_aleatorios(self.azar, 500))
+
+
+if __name__ == "__main__":
+    unittest.main()
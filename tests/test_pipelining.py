@@ -0,0 +1,164 @@
+"""
+Pruebas de iterar_respuestas_multilinea() (poplib y ClientePOP3Asincrono) contra el servidor POP3 de
+prueba: con y sin pipelining, RETR y TOP mezclados y un -ERR a mitad de un lote.
+"""
+import asyncio
+import os
+import poplib
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from utilidades import ServidorEnHilo, main, vaciar_carpeta_datos
+
+USUARIO = "bench0@bench.example"
+MENSAJES = 10
+
+
+class DestinoEnMemoria:
+    def __init__(self):
+        self.lineas = []
+        self.cerrado = self.descartado = False
+        self.hilos = set() # Hilos desde los que se escribió.
+
+    def escribir_linea(self, linea):
+        self.lineas.append(linea)
+        self.hilos.add(threading.get_ident())
+
+    def cerrar(self):
+        self.cerrado = True
+
+    def descartar(self):
+        self.descartado = True
+
+
+class PruebaPipelining(unittest.TestCase):
+    def setUp(self):
+        vaciar_carpeta_datos()
+        self.servidor_prueba = ServidorEnHilo(accounts=1, messages=MENSAJES, size_kb=3)
+        self.servidor = self.servidor_prueba.__enter__()
+        self.addCleanup(self.servidor_prueba.__exit__, None, None, None)
+        self.host, self.puerto = self.servidor.server_address[:2]
+        buzon = self.servidor.buzones[USUARIO]
+        # Respuesta esperada de cada comando: líneas sin relleno de puntos, o None para un -ERR.
+        self.comandos = []
+        self.esperado = {}
+        for n in range(1, MENSAJES + 1):
+            correo = buzon[n - 1][4]
+            self.comandos.append(((n, "RETR"), f"RETR {n}"))
+            self.esperado[(n, "RETR")] = correo.split(b"\r\n")
+            self.comandos.append(((n, "TOP"), f"TOP {n} 0"))
+            self.esperado[(n, "TOP")] = correo.split(b"\r\n\r\n", 1)[0].split(b"\r\n") + [b""]
+            if n == 4:
+                self.comandos.append(((999, "RETR"), "RETR 999"))
+                self.esperado[(999, "RETR")] = None
+
+    def conectar(self):
+        servidor_pop = poplib.POP3(self.host, self.puerto, timeout=10)
+        self.addCleanup(servidor_pop.close)
+        servidor_pop.user(USUARIO)
+        servidor_pop.pass_("bench")
+        return servidor_pop
+
+    def comprobar(self, respuestas):
+        self.assertEqual([clave for clave, _, _ in respuestas], [clave for clave, _ in self.comandos])
+        for clave, lineas, error in respuestas:
+            if self.esperado[clave] is None:
+                self.assertIsInstance(error, poplib.error_proto, clave)
+                self.assertIsNone(lineas, clave)
+            else:
+                self.assertIsNone(error, clave)
+                self.assertEqual(lineas, self.esperado[clave], clave)
+
+    def test_poplib_con_y_sin_pipelining(self):
+        for ventana in (1, 3, 8, 64):
+            with self.subTest(ventana=ventana):
+                servidor_pop = self.conectar()
+                self.comprobar(list(main.iterar_respuestas_multilinea(servidor_pop, self.comandos, ventana)))
+                self.assertTrue(servidor_pop.noop().startswith(b"+OK")) # La conexión sigue sincronizada.
+                servidor_pop.quit()
+
+    def test_poplib_con_destino(self):
+        destinos = {}
+        def crear_destino(clave):
+            destinos[clave] = DestinoEnMemoria()
+            return destinos[clave]
+        servidor_pop = self.conectar()
+        respuestas = list(main.iterar_respuestas_multilinea(servidor_pop, self.comandos, 8, crear_destino))
+        self.assertNotIn((999, "RETR"), destinos) # El destino no se crea para un -ERR.
+        for clave, destino, _ in respuestas:
+            if destino is not None:
+                self.assertTrue(destino.cerrado and not destino.descartado)
+        self.comprobar([(clave, destino.lineas if destino is not None else None, error) for clave, destino, error in respuestas])
+
+    def test_poplib_con_descarga_en_curso(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            servidor_pop = self.conectar()
+            comandos = [(clave, comando) for clave, comando in self.comandos if clave[1] == "RETR"]
+            for clave, descarga, error in main.iterar_respuestas_multilinea(servidor_pop, comandos, 8, lambda clave: main.DescargaEnCurso(directorio)):
+                if self.esperado[clave] is None:
+                    self.assertIsNotNone(error)
+                    continue
+                with open(descarga.ruta_temporal, "rb") as f:
+                    self.assertEqual(f.read(), b"\r\n".join(self.esperado[clave]), clave)
+                descarga.descartar()
+            self.assertEqual(os.listdir(directorio), [])
+
+    def test_cliente_asincrono(self):
+        async def descargar(ventana):
+            cliente = main.ClientePOP3Asincrono(self.host, self.puerto, timeout=10)
+            await cliente.conectar(False)
+            await cliente.comando(f"USER {USUARIO}")
+            await cliente.comando("PASS bench")
+            respuestas = [respuesta async for respuesta in cliente.iterar_respuestas_multilinea(self.comandos, ventana)]
+            await cliente.cerrar()
+            return respuestas
+        for ventana in (1, 8):
+            with self.subTest(ventana=ventana):
+                self.comprobar(asyncio.run(descargar(ventana)))
+
+    def test_cliente_asincrono_escribe_fuera_del_bucle(self):
+        destinos = {}
+        def crear_destino(clave):
+            destinos[clave] = DestinoEnMemoria()
+            return destinos[clave]
+        async def descargar():
+            cliente = main.ClientePOP3Asincrono(self.host, self.puerto, timeout=10)
+            await cliente.conectar(False)
+            await cliente.comando(f"USER {USUARIO}")
+            await cliente.comando("PASS bench")
+            respuestas = [respuesta async for respuesta in cliente.iterar_respuestas_multilinea(self.comandos, 8, crear_destino)]
+            await cliente.cerrar()
+            return respuestas
+        with mock.patch.object(main.ClientePOP3Asincrono, "LOTE_ESCRITURA", 1000): # Varios lotes por correo.
+            respuestas = asyncio.run(descargar())
+        self.assertNotIn((999, "RETR"), destinos)
+        for destino in destinos.values():
+            self.assertTrue(destino.cerrado and not destino.descartado)
+            self.assertNotIn(threading.get_ident(), destino.hilos)
+        self.comprobar([(clave, destino.lineas if destino is not None else None, error) for clave, destino, error in respuestas])
+
+    def test_cliente_asincrono_con_descarga_en_curso(self):
+        async def descargar(directorio):
+            cliente = main.ClientePOP3Asincrono(self.host, self.puerto, timeout=10)
+            await cliente.conectar(False)
+            await cliente.comando(f"USER {USUARIO}")
+            await cliente.comando("PASS bench")
+            comandos = [(clave, comando) for clave, comando in self.comandos if clave[1] == "RETR"]
+            async for clave, descarga, error in cliente.iterar_respuestas_multilinea(comandos, 8, lambda clave: main.DescargaEnCurso(directorio)):
+                if self.esperado[clave] is None:
+                    self.assertIsNotNone(error)
+                    continue
+                with open(descarga.ruta_temporal, "rb") as f:
+                    self.assertEqual(f.read(), b"\r\n".join(self.esperado[clave]), clave)
+                descarga.descartar()
+            await cliente.cerrar()
+        with tempfile.TemporaryDirectory() as directorio:
+            with mock.patch.object(main.ClientePOP3Asincrono, "LOTE_ESCRITURA", 1000):
+                asyncio.run(descargar(directorio))
+            self.assertEqual(os.listdir(directorio), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
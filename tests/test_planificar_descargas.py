@@ -0,0 +1,72 @@
+"""
+Pruebas de planificar_descargas(): orden de RETR según download_order y correos que caben en
+download_budget_kb_per_cycle.
+"""
+import contextlib
+import io
+import unittest
+
+from utilidades import main
+
+KB = 1024
+# Número de mensaje -> tamaño según LIST.
+TAMANOS = {1: 30 * KB, 2: 10 * KB, 3: 50 * KB, 4: 10 * KB, 5: 5 * KB}
+NUEVOS = [(num, f"hash{num}") for num in (1, 2, 3, 4, 5)]
+
+# (download_order, download_budget_kb_per_cycle, tamaños, números planificados en orden)
+CASOS = [
+    ("server", 0, TAMANOS, [1, 2, 3, 4, 5]),
+    ("smallest_first", 0, TAMANOS, [5, 2, 4, 1, 3]), # Mismo tamaño: por número.
+    ("newest_first", 0, TAMANOS, [5, 4, 3, 2, 1]),
+    ("server", 45, TAMANOS, [1, 2, 5]), # 3 no cabe; 4 tampoco tras 1 y 2; 5 sí.
+    ("smallest_first", 25, TAMANOS, [5, 2, 4]), # 5 + 10 + 10 KB: exactamente el presupuesto.
+    ("newest_first", 60, TAMANOS, [5, 4, 2, 1]), # 3 no cabe tras 5 y 4; 2 y 1 sí.
+    ("server", 40, TAMANOS, [1, 2]), # Ni 4 ni 5 caben tras 1 y 2 (40 KB).
+    ("server", 1, TAMANOS, [1]), # El primero se descarga aunque supere el presupuesto.
+    ("smallest_first", 1, TAMANOS, [5]),
+    ("server", 10, {}, [1, 2, 3, 4, 5]), # Sin tamaños de LIST no hay presupuesto que aplicar.
+    ("smallest_first", 0, {3: 1 * KB}, [1, 2, 4, 5, 3]), # Sin tamaño cuenta como 0.
+]
+
+
+class PruebaPlanificarDescargas(unittest.TestCase):
+    def setUp(self):
+        main.SETTINGS.update(main.DEFAULT_SETTINGS)
+        self.addCleanup(main.SETTINGS.update, main.DEFAULT_SETTINGS)
+
+    def planificar(self, mensajes, tamanos):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return main.planificar_descargas(mensajes, tamanos, "ana@example.com")
+
+    def test_tabla_de_planificacion(self):
+        for orden, presupuesto_kb, tamanos, esperado in CASOS:
+            with self.subTest(orden=orden, presupuesto_kb=presupuesto_kb, tamanos=tamanos):
+                main.SETTINGS.update(download_order=orden, download_budget_kb_per_cycle=presupuesto_kb)
+                planificados = self.planificar(NUEVOS, tamanos)
+                self.assertEqual([num for num, _ in planificados], esperado)
+                self.assertTrue(all(hash_correo == f"hash{num}" for num, hash_correo in planificados))
+
+    def test_no_modifica_la_lista_original(self):
+        main.SETTINGS.update(download_order="newest_first", download_budget_kb_per_cycle=20)
+        mensajes = list(NUEVOS)
+        self.planificar(mensajes, TAMANOS)
+        self.assertEqual(mensajes, NUEVOS)
+
+    def test_sin_mensajes(self):
+        main.SETTINGS.update(download_order="smallest_first", download_budget_kb_per_cycle=20)
+        self.assertEqual(self.planificar([], TAMANOS), [])
+
+    def test_necesita_tamanos_list(self):
+        self.assertFalse(main.necesita_tamanos_list())
+        for opcion, valor in (("max_message_size_kb", 100), ("download_order", "smallest_first"), ("download_budget_kb_per_cycle", 100)):
+            with self.subTest(opcion=opcion):
+                main.SETTINGS.update(main.DEFAULT_SETTINGS)
+                main.SETTINGS[opcion] = valor
+                self.assertTrue(main.necesita_tamanos_list())
+        main.SETTINGS.update(main.DEFAULT_SETTINGS)
+        main.SETTINGS["download_order"] = "newest_first" # Solo necesita los números de mensaje.
+        self.assertFalse(main.necesita_tamanos_list())
+
+
+if __name__ == "__main__":
+    unittest.main()
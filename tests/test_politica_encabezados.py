@@ -0,0 +1,92 @@
+"""
+Pruebas de evaluar_politica_encabezados(): qué correos nuevos se descargan, se omiten o se aplazan
+antes de RETR según skip_blacklisted_senders, skip_spam_score_above, max_message_size_kb y
+off_peak_hours.
+"""
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from utilidades import main
+
+LISTA_BLANCA = ["jefa@example.com"]
+LISTA_NEGRA = ["spammer@example.net", "example.org"]
+
+# (configuración, From, X-Spam-Score o None, tamaño según LIST o None, en off_peak_hours, acción, motivo)
+CASOS = [
+    ({}, "spammer@example.net", "50", 10**7, False, "download", None), # Sin reglas activas.
+    ({"skip_blacklisted_senders": True}, "spammer@example.net", None, None, False, "skip", "blacklisted_sender"),
+    ({"skip_blacklisted_senders": True}, "Spammer <SPAMMER@example.net>", None, None, False, "skip", "blacklisted_sender"),
+    ({"skip_blacklisted_senders": True}, "alguien@example.org", None, None, False, "skip", "blacklisted_sender"), # Dominio en la lista.
+    ({"skip_blacklisted_senders": True}, "ana@example.com", None, None, False, "download", None),
+    ({"skip_blacklisted_senders": False, "skip_spam_score_above": 5.0}, "spammer@example.net", None, None, False, "download", None),
+    ({"skip_spam_score_above": 5.0}, "ana@example.com", "7.5", None, False, "skip", "spam_score"),
+    ({"skip_spam_score_above": 5.0}, "ana@example.com", "5.0", None, False, "download", None), # Solo por encima del umbral.
+    ({"skip_spam_score_above": 5.0}, "ana@example.com", None, None, False, "download", None), # Sin puntuación.
+    ({"skip_spam_score_above": 5.0, "skip_blacklisted_senders": True}, "jefa@example.com", "9", None, False, "download", None), # Lista blanca.
+    ({"max_message_size_kb": 100}, "ana@example.com", None, 100 * 1024, False, "download", None), # Justo en el límite.
+    ({"max_message_size_kb": 100}, "ana@example.com", None, 100 * 1024 + 1, False, "defer", "size"),
+    ({"max_message_size_kb": 100}, "ana@example.com", None, 100 * 1024 + 1, True, "download", None), # Aplazado: en off_peak_hours sí.
+    ({"max_message_size_kb": 100}, "ana@example.com", None, None, False, "download", None), # Sin tamaño de LIST.
+    ({"max_message_size_kb": 100, "size_limit_action": "skip"}, "ana@example.com", None, 10**6, True, "skip", "size"),
+    ({"max_message_size_kb": 100}, "jefa@example.com", None, 10**6, False, "defer", "size"), # La lista blanca no evita el límite de tamaño.
+    ({"max_message_size_kb": 100, "skip_spam_score_above": 5.0}, "ana@example.com", "8", 10**6, True, "skip", "spam_score"),
+]
+
+
+class PruebaPoliticaEncabezados(unittest.TestCase):
+    def setUp(self):
+        main.SETTINGS.update(main.DEFAULT_SETTINGS)
+        self.addCleanup(main.SETTINGS.update, main.DEFAULT_SETTINGS)
+        self.listas = (main.ListaRemitentes(LISTA_BLANCA), main.ListaRemitentes(LISTA_NEGRA))
+
+    def test_tabla_de_decisiones(self):
+        for configuracion, remitente, score, tamano, en_valle, accion, motivo in CASOS:
+            with self.subTest(configuracion=configuracion, remitente=remitente, score=score, tamano=tamano, en_valle=en_valle):
+                main.SETTINGS.update(main.DEFAULT_SETTINGS)
+                main.SETTINGS.update(configuracion)
+                encabezados = [f"From: {remitente}".encode(), b"Subject: Oferta"]
+                if score is not None:
+                    encabezados.append(f"X-Spam-Score: {score}".encode())
+                with mock.patch.object(main, "en_horario_valle", return_value=en_valle):
+                    resultado = main.evaluar_politica_encabezados(encabezados + [b""], tamano, *self.listas)
+                self.assertEqual(resultado[:2], (accion, motivo))
+
+    def test_politica_activa(self):
+        self.assertFalse(main.politica_encabezados_activa())
+        for opcion, valor in (("skip_blacklisted_senders", True), ("skip_spam_score_above", 5.0), ("max_message_size_kb", 100)):
+            with self.subTest(opcion=opcion):
+                main.SETTINGS.update(main.DEFAULT_SETTINGS)
+                main.SETTINGS[opcion] = valor
+                self.assertTrue(main.politica_encabezados_activa())
+
+    def test_solo_analiza_los_encabezados_si_hace_falta(self):
+        main.SETTINGS["max_message_size_kb"] = 100
+        with mock.patch.object(main, "BytesParser") as parser:
+            self.assertEqual(main.evaluar_politica_encabezados([b"From: ana@example.com", b""], 10, *self.listas), ("download", None, None))
+        parser.assert_not_called()
+
+    def test_horario_valle(self):
+        casos = [
+            ("", "03:00", False),
+            ("01:00-06:00", "00:59", False),
+            ("01:00-06:00", "01:00", True),
+            ("01:00-06:00", "06:00", False), # El final no está incluido.
+            ("22:00-06:00", "23:30", True), # Cruza la medianoche.
+            ("22:00-06:00", "05:59", True),
+            ("22:00-06:00", "12:00", False),
+        ]
+        for franja, hora, esperado in casos:
+            with self.subTest(franja=franja, hora=hora):
+                main.SETTINGS["off_peak_hours"] = franja
+                self.assertEqual(main.en_horario_valle(datetime.strptime(f"2025-07-01 {hora}", "%Y-%m-%d %H:%M")), esperado)
+
+    def test_horario_valle_no_valido(self):
+        main._parsear_horario_valle.cache_clear()
+        main.SETTINGS["off_peak_hours"] = "no es una franja"
+        with self.assertLogs(level="WARNING"):
+            self.assertFalse(main.en_horario_valle())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+"""
+Pruebas de las reglas de spam compiladas: AutomataPalabras debe encontrar las mismas palabras que la
+búsqueda por subcadena palabra por palabra que reemplaza, y ListaRemitentes debe distinguir direcciones,
+dominios y subdominios.
+"""
+import json
+import os
+import random
+import re
+import unittest
+from email.utils import parseaddr
+
+from utilidades import ServidorEnHilo, main, vaciar_carpeta_datos
+
+
+def buscar_por_subcadena(palabras, texto):
+    return {palabra for palabra in palabras if palabra and palabra in texto}
+
+
+class PruebaAutomataPalabras(unittest.TestCase):
+    def comparar(self, palabras, texto):
+        palabras = [palabra.strip().lower() for palabra in palabras] # Igual que load_spam_config().
+        texto = texto.lower()
+        self.assertEqual(main.AutomataPalabras(palabras).buscar(texto), buscar_por_subcadena(palabras, texto), (palabras, texto))
+
+    def test_palabras_solapadas(self):
+        self.comparar(["he", "she", "his", "hers"], "ushers")
+        self.comparar(["aba", "bab"], "ababab")
+        self.comparar(["free money", "money back", "back guarantee"], "free money back guarantee")
+
+    def test_palabras_prefijo_de_otras(self):
+        self.comparar(["a", "ab", "abc", "abcd"], "xabcx")
+        self.comparar(["viagra", "via"], "vía viagr viagra")
+        self.comparar(["abcd", "bc"], "abce")
+
+    def test_acentos_y_mayusculas(self):
+        self.comparar(["Café", "NIÑO", "Über Alles", "ÇA"], "UN CAFÉ para el niño, über alles. Ça va")
+        self.comparar(["cafe"], "Café")
+        self.comparar(["ß"], "STRASSE straße")
+
+    def test_listas_vacias(self):
+        automata = main.AutomataPalabras([])
+        self.assertEqual(len(automata), 0)
+        self.assertEqual(automata.buscar("cualquier texto"), set())
+        self.assertEqual(main.AutomataPalabras(["", "  "]).buscar("texto"), set())
+        self.assertEqual(main.AutomataPalabras(["oferta"]).buscar(""), set())
+        self.comparar(["", "oferta"], "gran oferta")
+
+    def test_comparacion_aleatoria(self):
+        azar = random.Random(20251018)
+        alfabeto = "abcñé .-"
+        for _ in range(2000):
+            palabras = ["".join(azar.choices(alfabeto, k=azar.randint(1, 4))) for _ in range(azar.randint(0, 8))]
+            texto = "".join(azar.choices(alfabeto + "xyzÉ\n", k=azar.randint(0, 60)))
+            self.comparar(palabras, texto)
+
+
+class PruebaListaRemitentes(unittest.TestCase):
+    def test_direccion_exacta(self):
+        lista = main.ListaRemitentes(["Ana@Example.com"])
+        self.assertTrue(lista.coincide("ana@example.com"))
+        self.assertFalse(lista.coincide("beto@example.com"))
+        self.assertFalse(lista.coincide("ana@mail.example.com"))
+        self.assertFalse(lista.coincide("xana@example.com"))
+
+    def test_dominio_y_subdominios(self):
+        for entrada in ("example.com", "@example.com", "*.example.com"):
+            lista = main.ListaRemitentes([entrada])
+            self.assertTrue(lista.coincide("ana@example.com"), entrada)
+            self.assertTrue(lista.coincide("ana@mail.example.com"), entrada)
+            self.assertTrue(lista.coincide("ana@a.b.example.com"), entrada)
+
+    def test_dominios_parecidos(self):
+        lista = main.ListaRemitentes(["example.com", "beto@example.org"])
+        for direccion in ("ana@evilexample.com", "ana@example.com.evil.org", "ana@example.co", "ana@com",
+                          "beto@evilexample.org", "", "ana@examplecom"):
+            self.assertFalse(lista.coincide(direccion), direccion)
+
+    def test_entradas_vacias(self):
+        lista = main.ListaRemitentes(["", "   "])
+        self.assertEqual(len(lista), 0)
+        self.assertFalse(lista.coincide("ana@example.com"))
+
+
+class PruebaCargaReglasSpam(unittest.TestCase):
+    def setUp(self):
+        vaciar_carpeta_datos()
+        main.SETTINGS["quiet"] = True
+
+    def escribir_reglas(self, spam_config, listas=None):
+        with open(main.SPAM_CONFIG_FILE, "w", encoding="utf-8") as f:
+            json.dump(spam_config, f)
+        for clave, lineas in (listas or {}).items():
+            with open(main.ARCHIVOS_LISTAS_SPAM[clave], "w", encoding="utf-8") as f:
+                f.write("\n".join(lineas) + "\n")
+
+    def test_combina_spam_config_y_listas(self):
+        self.escribir_reglas({"mail_blacklist": ["Spam.example"], "word_blacklist": ["Oferta"]},
+                             {"mail_blacklist": ["# comentario", "Malo@Otro.example"], "word_blacklist": ["gratis"]})
+        mail_whitelist, mail_blacklist, word_whitelist, word_blacklist = main.load_spam_config()
+        self.assertEqual(len(mail_whitelist), 0)
+        self.assertTrue(mail_blacklist.coincide("x@news.spam.example"))
+        self.assertTrue(mail_blacklist.coincide("malo@otro.example"))
+        self.assertFalse(mail_blacklist.coincide("bueno@otro.example"))
+        self.assertFalse(mail_blacklist.coincide("x@notspam.example"))
+        self.assertEqual(word_blacklist.buscar("oferta gratis"), {"oferta", "gratis"})
+        self.assertEqual(len(word_whitelist), 0)
+
+    def test_recompila_al_cambiar_un_archivo(self):
+        self.escribir_reglas({"mail_blacklist": ["uno.example"]})
+        primeras = main.load_spam_config()
+        self.assertIs(main.load_spam_config(), primeras)
+        self.escribir_reglas({"mail_blacklist": ["dos.example.org"]})
+        os.utime(main.SPAM_CONFIG_FILE, ns=(0, 0)) # Otra firma aunque el reloj no haya avanzado.
+        mail_blacklist = main.load_spam_config()[1]
+        self.assertFalse(mail_blacklist.coincide("x@uno.example"))
+        self.assertTrue(mail_blacklist.coincide("x@dos.example.org"))
+
+    def test_lista_blanca_tiene_prioridad(self):
+        main.SETTINGS["skip_blacklisted_senders"] = True
+        self.escribir_reglas({"mail_blacklist": ["example.com"], "mail_whitelist": ["ana@example.com"]})
+        mail_whitelist, mail_blacklist, _, _ = main.load_spam_config()
+        def accion(remitente):
+            return main.evaluar_politica_encabezados([f"From: {remitente}".encode(), b""], 100, mail_whitelist, mail_blacklist)[0]
+        self.assertEqual(accion("Ana <ana@example.com>"), "download")
+        self.assertEqual(accion("Beto <beto@example.com>"), "skip")
+        self.assertEqual(accion("Ana <ana@evilexample.com>"), "download")
+
+    def test_lista_blanca_anula_la_negra_al_registrar(self):
+        with ServidorEnHilo(accounts=1, messages=20, size_kb=2) as servidor:
+            correos = [mensaje[4] for mensaje in servidor.buzones["bench0@bench.example"]]
+            remitentes = [re.search(rb"^From: .*<(.+)>", correo, re.M).group(1).decode() for correo in correos]
+            blancos = set(remitentes[:3])
+            self.escribir_reglas({"mail_blacklist": ["bench.example"], "mail_whitelist": sorted(blancos)})
+            almacen = main.crear_almacen_metadatos()
+            main.ejecutar_ciclo(almacen)
+        registros = list(almacen.iterar_registros())
+        almacen.cerrar()
+        self.assertEqual(len(registros), len(correos))
+        for registro in registros:
+            blanco = parseaddr(registro["sender"])[1] in blancos
+            self.assertEqual((registro["spam_filter"], registro["spam_filter_whitelist"]), ("no", "yes") if blanco else ("yes", "no"), registro["sender"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+"""
+Pruebas de reservar_hash(): un correo que reservó otra cuenta solo se da por conocido cuando esa
+cuenta lo guarda; si lo aplaza o falla, la otra cuenta lo vuelve a verificar.
+"""
+import unittest
+
+from utilidades import main
+
+ENCABEZADOS = [b"From: Ana <ana@example.com>", b"Subject: Hola", b"Message-ID: <1@example.com>", b""] # Líneas de la respuesta TOP.
+
+
+class PruebaReservaHashes(unittest.TestCase):
+    def setUp(self):
+        self.existentes = set()
+        self.indices = {"a": {}, "b": {}}
+
+    def tearDown(self):
+        main.liberar_hashes(self.existentes, list(self.existentes))
+
+    def verificar(self, cuenta):
+        return main.verificar_encabezados_mensaje(1, 1, cuenta, ENCABEZADOS, self.existentes, self.indices[cuenta], {1: f"uid-{cuenta}"})
+
+    def test_reserva_liberada_se_vuelve_a_verificar(self):
+        hash_correo = self.verificar("a")
+        self.assertIsNotNone(hash_correo)
+        self.assertIsNone(self.verificar("b"))
+        self.assertEqual(self.indices["b"], {}) # Sin anotar el UID mientras "a" no guarde el correo.
+
+        main.liberar_hashes(self.existentes, [hash_correo]) # "a" aplazó o no pudo guardar el correo.
+        self.assertEqual(self.verificar("b"), hash_correo)
+
+    def test_reserva_confirmada_es_conocida(self):
+        hash_correo = self.verificar("a")
+        main.confirmar_hash(hash_correo)
+        self.assertIsNone(self.verificar("b"))
+        self.assertEqual(self.indices["b"], {"uid-b": hash_correo})
+
+    def test_resultados_de_reservar_hash(self):
+        self.assertIs(main.reservar_hash(self.existentes, "h1"), True)
+        self.assertIsNone(main.reservar_hash(self.existentes, "h1"))
+        main.confirmar_hash("h1")
+        self.assertIs(main.reservar_hash(self.existentes, "h1"), False)
+
+
+if __name__ == "__main__":
+    unittest.main()
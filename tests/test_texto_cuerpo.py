@@ -0,0 +1,158 @@
+"""
+Pruebas de extraer_texto_del_cuerpo_desde_archivo(): debe extraer el mismo texto que
+extraer_texto_del_cuerpo(), que recorre el correo completo con msg.walk().
+"""
+import os
+import tempfile
+import unittest
+from email import policy
+from email.message import EmailMessage
+from email.parser import BytesParser
+
+from utilidades import main
+
+
+def correo_simple(asunto, texto, **opciones):
+    msg = EmailMessage()
+    msg["From"] = "Ana <ana@example.com>"
+    msg["To"] = "beto@example.org"
+    msg["Subject"] = asunto
+    msg.set_content(texto, **opciones)
+    return msg
+
+
+def crudo(texto):
+    return texto.replace("\n", "\r\n").encode("utf-8")
+
+
+def muestras():
+    alternativo = correo_simple("Alternativo", "Texto plano del alternativo.\n")
+    alternativo.add_alternative("<p>Solo HTML</p>", subtype="html")
+
+    mixto = correo_simple("Mixto", "Cuerpo con adjuntos.\n-- \nFirma con guiones\n--no es un delimitador\n")
+    mixto.add_attachment("Texto del adjunto, no se extrae.\n", filename="nota.txt")
+    mixto.add_attachment(bytes(range(256)) * 20, maintype="application", subtype="octet-stream", filename="datos.bin")
+
+    anidado = correo_simple("Anidado", "Primera parte.\n")
+    anidado.add_alternative("<b>html</b>", subtype="html")
+    anidado.make_mixed()
+    anidado.add_attachment("Segunda parte en línea.\n", disposition="inline")
+
+    codificaciones = correo_simple("Codificaciones", "Texto en base64 con ñandú y acentos: áéíóú.\n" * 30, cte="base64")
+    codificaciones.add_attachment("Quoted-printable: café, pingüino y una línea muy larga " * 5 + "\n", disposition="inline", cte="quoted-printable")
+    codificaciones.add_attachment("Latin-1: señal\n".encode("latin-1"), maintype="text", subtype="plain", disposition="inline", params={"charset": "iso-8859-1"})
+
+    reenviado = correo_simple("Reenviado", "Mira el correo adjunto.\n")
+    reenviado.add_attachment(alternativo) # message/rfc822 como adjunto.
+    doble = correo_simple("Doble reenvío", "Reenvío del reenvío.\n")
+    doble.add_attachment(reenviado, disposition="inline")
+    doble.add_attachment(correo_simple("Otro", "Texto del segundo adjunto.\n", cte="quoted-printable"))
+
+    return {
+        "simple": correo_simple("Simple", "Hola.\nUna línea .\n.Empieza con punto\n").as_bytes(policy=policy.SMTP),
+        "simple_base64": correo_simple("B64", "Texto codificado en base64.\n", cte="base64").as_bytes(policy=policy.SMTP),
+        "alternativo": alternativo.as_bytes(policy=policy.SMTP),
+        "mixto": mixto.as_bytes(policy=policy.SMTP),
+        "anidado": anidado.as_bytes(policy=policy.SMTP),
+        "codificaciones": codificaciones.as_bytes(policy=policy.SMTP),
+        "reenviado": reenviado.as_bytes(policy=policy.SMTP),
+        "doble_reenvio": doble.as_bytes(policy=policy.SMTP),
+        "digest": crudo(
+            "From: lista@example.com\n"
+            "Subject: Resumen\n"
+            "MIME-Version: 1.0\n"
+            'Content-Type: multipart/digest; boundary="d1"\n'
+            "\n"
+            "--d1\n"
+            "\n"
+            "From: ana@example.com\n"
+            "Subject: Uno\n"
+            "\n"
+            "Primer mensaje del resumen.\n"
+            "--d1\n"
+            "Content-Type: message/rfc822\n"
+            "\n"
+            "From: beto@example.org\n"
+            "Subject: Dos\n"
+            'Content-Type: multipart/mixed; boundary="m2"\n'
+            "\n"
+            "--m2\n"
+            "Content-Type: text/plain; charset=utf-8\n"
+            "Content-Transfer-Encoding: quoted-printable\n"
+            "\n"
+            "Segundo mensaje: caf=C3=A9=\n"
+            " sin corte.\n"
+            "--m2--\n"
+            "--d1--\n"),
+        "rfc822_principal": crudo(
+            "From: ana@example.com\n"
+            "Content-Type: message/rfc822\n"
+            "\n"
+            "From: beto@example.org\n"
+            "Subject: Dentro\n"
+            "\n"
+            "Texto del correo contenido.\n"),
+        "informe_de_entrega": crudo(
+            "From: MAILER-DAEMON@example.com\n"
+            'Content-Type: multipart/report; report-type=delivery-status; boundary="r"\n'
+            "\n"
+            "--r\n"
+            "Content-Type: text/plain\n"
+            "\n"
+            "No se pudo entregar.\n"
+            "--r\n"
+            "Content-Type: message/delivery-status\n"
+            "\n"
+            "Reporting-MTA: dns; mx.example.com\n"
+            "\n"
+            "Final-Recipient: rfc822; nadie@example.com\n"
+            "Action: failed\n"
+            "--r\n"
+            "Content-Type: message/rfc822\n"
+            "\n"
+            "From: ana@example.com\n"
+            "Subject: Original\n"
+            "\n"
+            "Texto del correo original.\n"
+            "--r--\n"),
+    }
+
+
+def normalizar(texto):
+    # El parser completo conserva los CRLF del archivo y separa las partes con líneas en blanco distintas.
+    return " ".join(texto.split())
+
+
+class PruebaTextoCuerpo(unittest.TestCase):
+    def setUp(self):
+        self.directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directorio.cleanup)
+
+    def extraer(self, nombre, contenido, **opciones):
+        ruta = os.path.join(self.directorio.name, f"{nombre}.eml")
+        with open(ruta, "wb") as f:
+            f.write(contenido)
+        return main.extraer_texto_del_cuerpo_desde_archivo(ruta, **opciones)
+
+    def test_mismo_texto_que_walk(self):
+        for nombre, contenido in muestras().items():
+            with self.subTest(muestra=nombre):
+                esperado = main.extraer_texto_del_cuerpo(BytesParser(policy=policy.default).parsebytes(contenido))
+                self.assertTrue(esperado, nombre)
+                self.assertEqual(normalizar(self.extraer(nombre, contenido)), normalizar(esperado))
+
+    def test_entra_en_correos_adjuntos(self):
+        texto = self.extraer("doble", muestras()["doble_reenvio"])
+        for fragmento in ("Reenvío del reenvío.", "Mira el correo adjunto.", "Texto plano del alternativo.", "Texto del segundo adjunto."):
+            self.assertIn(fragmento, texto)
+        self.assertNotIn("Solo HTML", texto)
+
+    def test_limite_por_parte(self):
+        texto = self.extraer("codificaciones", muestras()["codificaciones"], max_bytes_por_parte=100)
+        self.assertTrue(texto.startswith("Texto en base64"))
+        self.assertLess(len(texto), 400)
+        self.assertIn("señal", texto)
+
+
+if __name__ == "__main__":
+    unittest.main()
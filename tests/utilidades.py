@@ -0,0 +1,73 @@
+"""
+Utilidades compartidas por las pruebas: importar main.py con una carpeta de datos temporal y
+levantar el servidor POP3 de prueba (ServidorPOP3Prueba) en un hilo.
+"""
+import importlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+RAIZ_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def importar_main():
+    """
+    Importa main.py con un HOME temporal: al importarse crea la carpeta de datos y lee settings.json.
+    """
+    if "main" in sys.modules:
+        return sys.modules["main"]
+    home = tempfile.mkdtemp(prefix="pop3_pruebas_")
+    datos = os.path.join(home, "Documents", "Pop3MailDownloader_UserData")
+    os.makedirs(datos)
+    with open(os.path.join(datos, "settings.json"), "w", encoding="utf-8") as f:
+        json.dump({"lang": "en"}, f)
+    os.environ["HOME"] = home
+    sys.path.insert(0, RAIZ_REPO)
+    return importlib.import_module("main")
+
+
+main = importar_main()
+logging.disable(logging.INFO) # Solo avisos y errores en la salida de las pruebas.
+
+
+def vaciar_carpeta_datos():
+    """
+    Deja la carpeta de datos como recién instalada (solo settings.json) y restaura SETTINGS.
+    """
+    for nombre in os.listdir(main.DATA_DIR):
+        ruta = os.path.join(main.DATA_DIR, nombre)
+        if nombre == "settings.json":
+            continue
+        if os.path.isdir(ruta):
+            shutil.rmtree(ruta)
+        else:
+            os.remove(ruta)
+    main.SETTINGS.clear()
+    main.SETTINGS.update(main.DEFAULT_SETTINGS)
+    main.crear_directorios_necesarios()
+
+
+class ServidorEnHilo:
+    """
+    ServidorPOP3Prueba con la especificación indicada (combinada con BENCHMARK_PREDETERMINADO),
+    atendiendo en un hilo y con sus cuentas escritas en accounts.txt.
+    """
+    def __init__(self, **especificacion):
+        datos = main.cargar_especificacion_banco()
+        datos.update(especificacion)
+        self.servidor = main.ServidorPOP3Prueba(datos)
+        self.hilo = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.hilo.start()
+        with open(main.ACCOUNTS_FILE, "w", encoding="utf-8") as f:
+            f.write("\n".join(self.servidor.lineas_cuentas()) + "\n")
+        return self.servidor
+
+    def __exit__(self, *excepcion):
+        self.servidor.shutdown()
+        self.servidor.server_close()